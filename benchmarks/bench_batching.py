@@ -0,0 +1,94 @@
+##
+# @file bench_batching.py
+# @brief Loopback benchmark of sending chat message bursts with and without batching.
+#
+# Sends bursts of binary MSG frames over 127.0.0.1, once with one sendto() per frame and
+# once through processes.batch.SendBatcher (flushed at the end of every burst, as the
+# network process does at the end of a loop iteration). The receiver drains and decodes
+# every datagram, so the rates include both ends. Reported are messages per second and
+# datagrams (= sendto syscalls) per message.
+#
+# Run from the repository root:
+# @code
+# python -m benchmarks.bench_batching [messages]
+# @endcode
+#
+# @author SLCP Team
+# @date June 2025
+#
+
+import socket
+import sys
+import time
+
+from processes.batch     import SendBatcher
+from processes.eventloop import EventLoop
+from processes.protocol  import OP_MSG, decode_all, encode
+
+BURSTS = (1, 4, 16, 32, 64)  # Messages per burst
+
+##
+# @brief Sender that puts every frame into its own datagram.
+class _Unbatched:
+    def __init__(self, sock):
+        self._sock     = sock
+        self.datagrams = 0
+
+    def send(self, frame, addr):
+        self._sock.sendto(frame, addr)
+        self.datagrams += 1
+
+    def flush(self):
+        pass
+
+##
+# @brief Receives and decodes everything pending on `sock`.
+# @return Number of frames received.
+def drain(sock, buf):
+    frames = 0
+    while True:
+        try:
+            n = sock.recv_into(buf)
+        except BlockingIOError:
+            return frames
+        frames += len(decode_all(buf[:n]))
+
+##
+# @brief Sends `total` messages in bursts of `burst` through `sender`.
+# @return Tuple (messages per second, datagrams per message).
+def run(sender, rx, burst, total):
+    addr, buf = rx.getsockname(), memoryview(bytearray(65536))
+    frames = [encode(OP_MSG, i, "Alice", "Bob", f"message number {i}".encode()) for i in range(burst)]
+    received, start = 0, time.perf_counter()
+    for _ in range(total // burst):
+        for frame in frames:
+            sender.send(frame, addr)
+        sender.flush()
+        received += drain(rx, buf)
+    elapsed = time.perf_counter() - start
+    received += drain(rx, buf)
+    if received != total // burst * burst:
+        print(f"  (lost {total // burst * burst - received} messages on loopback)")
+    return received / elapsed, sender.datagrams / received
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rx.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    rx.bind(("127.0.0.1", 0))
+    rx.setblocking(False)
+    loop = EventLoop()
+
+    print(f"{'burst':>5} {'unbatched msg/s':>16} {'dgram/msg':>10} {'batched msg/s':>14} {'dgram/msg':>10}")
+    for burst in BURSTS:
+        plain, plain_ratio = run(_Unbatched(tx), rx, burst, total)
+        batch, batch_ratio = run(SendBatcher(loop, tx), rx, burst, total)
+        print(f"{burst:>5} {plain:>16,.0f} {plain_ratio:>10.2f} {batch:>14,.0f} {batch_ratio:>10.2f}")
+
+    loop.close()
+    tx.close()
+    rx.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+##
+# @file bench_fanout.py
+# @brief Loopback benchmark of sending one message to every peer: unicast loop vs multicast.
+#
+# For a growing number of peers (one UDP socket each), a binary MSG frame is delivered to
+# all of them either with one sendto() per peer, as scripts looping over `msg <handle>`
+# did, or with a single sendto() to a multicast group all peer sockets joined, as
+# `msg *` does. Reported are the sender's time per fan-out and the end-to-end fan-outs per
+# second until every peer has drained its copy.
+#
+# Run from the repository root:
+# @code
+# python -m benchmarks.bench_fanout [fanouts] [group]
+# @endcode
+#
+# @author SLCP Team
+# @date June 2025
+#
+
+import socket
+import struct
+import sys
+import time
+
+from processes.protocol import OP_MSG, encode
+
+PEERS = (1, 2, 4, 8, 16, 32, 64)
+
+##
+# @brief Creates `n` non-blocking receiver sockets.
+# @param group Multicast group to join on one shared port, or None for one port per peer.
+# @return Tuple (sockets, list of destination addresses a sender has to use).
+def open_peers(n, group):
+    socks = []
+    port  = 0
+    for _ in range(n):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        if group:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, "SO_REUSEPORT"):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(("", port))
+            port = sock.getsockname()[1]
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                            struct.pack("4s4s", socket.inet_aton(group), socket.inet_aton("0.0.0.0")))
+        else:
+            sock.bind(("127.0.0.1", 0))
+        sock.setblocking(False)
+        socks.append(sock)
+    if group:
+        return socks, [(group, port)]
+    return socks, [s.getsockname() for s in socks]
+
+##
+# @brief Reads everything pending on the peer sockets.
+# @return Number of datagrams received.
+def drain(socks, buf):
+    received = 0
+    for sock in socks:
+        while True:
+            try:
+                sock.recv_into(buf)
+            except BlockingIOError:
+                break
+            received += 1
+    return received
+
+##
+# @brief Sends `fanouts` messages to every peer.
+# @return Tuple (sender microseconds per fan-out, end-to-end fan-outs per second, copies lost).
+def run(n, fanouts, group):
+    socks, dests = open_peers(n, group)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    frame  = encode(OP_MSG, 1, "Alice", "", b"hello everyone")
+    buf    = memoryview(bytearray(2048))
+    sending, received = 0.0, 0
+    start = time.perf_counter()
+    for _ in range(fanouts):
+        t = time.perf_counter()
+        for dest in dests:
+            sender.sendto(frame, dest)
+        sending += time.perf_counter() - t
+        received += drain(socks, buf)
+    elapsed = time.perf_counter() - start
+    time.sleep(0.05)
+    received += drain(socks, buf)
+    for sock in socks + [sender]:
+        sock.close()
+    return sending / fanouts * 1e6, fanouts / elapsed, fanouts * n - received
+
+def main():
+    fanouts = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+    group   = sys.argv[2] if len(sys.argv) > 2 else "239.255.76.67"
+    print(f"{'peers':>5} {'unicast us':>11} {'fanout/s':>10} {'multicast us':>13} {'fanout/s':>10}")
+    for n in PEERS:
+        uni_us, uni_rate, uni_lost = run(n, fanouts, None)
+        try:
+            mc_us, mc_rate, mc_lost = run(n, fanouts, group)
+        except OSError as e:
+            print(f"Multicast not available here: {e}")
+            return
+        note = f"  (lost {uni_lost} unicast, {mc_lost} multicast)" if uni_lost or mc_lost else ""
+        print(f"{n:>5} {uni_us:>11.1f} {uni_rate:>10,.0f} {mc_us:>13.1f} {mc_rate:>10,.0f}{note}")
+
+if __name__ == "__main__":
+    main()
@@ -10,29 +10,40 @@
 # - Text and image messaging
 # - Peer discovery
 # - AFK autoreply toggle
+# - Channels (join #room, msg #room ...)
 # - Dynamic client configuration from config.toml
 #
 # @section usage_sec Usage
 # Run the CLI as:
 # @code
-# python cli.py <Handle>
+# python cli.py <Handle> [--latency]
 # @endcode
-# The handle must be defined in `config.toml`.
+# The handle must be defined in `config.toml`. With `--latency`, every received message is
+# followed by the time from its receipt by the network process until it was printed, and
+# `stats` adds a summary of those latencies.
+#
+# Events from the network process are printed by a receiver thread that blocks in
+# multiprocessing.connection.wait() until an event or the stop signal arrives, so messages
+# are shown as soon as they are received and an idle client uses no CPU.
 #
 
-import socket
+import collections
 import os
 import multiprocessing
+import statistics
 import sys
 import threading
 import time
 from datetime import datetime
+from multiprocessing.connection import wait
 
 import toml
 from processes.discovery import discovery_process
 from processes.network import network_process
+from processes.peers import PeerDirectory
 
 CONFIG_FILE = "config.toml"
+LATENCY_SAMPLES = 1000  # Message latencies kept for the `stats` summary
 
 # ANSI escape codes for terminal colors
 COLOR_RESET  = "\033[0m"
@@ -45,25 +56,21 @@ COLOR_YELLOW = "\033[93m"
 def ts():
     return datetime.now().strftime("[%H:%M:%S]")
 
-##
-# @brief Checks if a UDP port is currently in use.
-# @param port UDP port to test.
-# @return True if in use, False otherwise.
-def port_in_use(port):
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-        try:
-            s.bind(("", port))
-            return False
-        except OSError:
-            return True
-
 ##
 # @brief Prints a list of available CLI commands.
 def print_commands():
     print("\nAvailable commands:")
     print("  msg <handle> <text>")
+    print("  msg * <text>           (to everyone)")
+    print("  msg #<channel> <text>")
+    print("  join #<channel>")
+    print("  part #<channel>")
+    print("  channels")
     print("  img <handle> <path_to_image>")
+    print("  cancel <handle>        (image downloads from that client)")
+    print("  cancel #<id>           (one image download, ids as shown by stats)")
     print("  clients")
+    print("  stats")
     print("  afk on|off")
     print("  leave\n")
 
@@ -77,13 +84,16 @@ def main():
         print("No [[clients]] section found in config.toml.")
         sys.exit(1)
 
-    if len(sys.argv) != 2:
+    args = sys.argv[1:]
+    show_latency = "--latency" in args
+    args = [a for a in args if a != "--latency"]
+    if len(args) != 1:
         handles = [c["handle"] for c in clients]
-        print("Usage: python cli.py <Handle>")
+        print("Usage: python cli.py <Handle> [--latency]")
         print("Available handles:", ", ".join(handles))
         sys.exit(1)
 
-    chosen = sys.argv[1]
+    chosen = args[0]
     client_index = next((i for i, c in enumerate(clients) if c["handle"] == chosen), None)
     if client_index is None:
         print(f"Handle '{chosen}' not found.")
@@ -91,50 +101,99 @@ def main():
 
     # Prepare client configuration and shared state
     config = clients[client_index]
-    manager = multiprocessing.Manager()
-    config["peers"] = manager.list()
+    config["peers"] = PeerDirectory()
     config["__cfg_all"] = cfg_all
     config["__cfg_index"] = clients.index(config)
+    config["__latency"] = show_latency  # MSG events then carry their receipt time
 
     # Inter-process communication pipes
     ui2net_p, ui2net_c = multiprocessing.Pipe()
     net2ui_p, net2ui_c = multiprocessing.Pipe()
     disc_ctrl_parent, disc_ctrl_child = multiprocessing.Pipe()
+    disc2net_r, disc2net_w = multiprocessing.Pipe(duplex=False)
 
-    # Start discovery process if not already running
-    p_disc = None
-    if not port_in_use(config["whoisport"]):
-        p_disc = multiprocessing.Process(target=discovery_process, args=(config, disc_ctrl_child))
-        p_disc.start()
-        print(f"[INFO] Discovery service started on port {config['whoisport']}")
-    else:
-        print(f"[INFO] Discovery already running on port {config['whoisport']}")
+    # Start discovery process; the discovery processes elect one WHO responder among themselves
+    p_disc = multiprocessing.Process(target=discovery_process, args=(config, disc_ctrl_child, disc2net_w))
+    p_disc.start()
+    print(f"[INFO] Discovery service started on port {config['whoisport']}")
 
     # Start network process
-    p_net = multiprocessing.Process(target=network_process, args=(config, ui2net_c, net2ui_p))
+    p_net = multiprocessing.Process(target=network_process, args=(config, ui2net_c, net2ui_p, disc2net_r))
     p_net.start()
 
-    stop_event = threading.Event()
+    stop_r, stop_w = multiprocessing.Pipe(duplex=False)  # Closing stop_w stops the receiver
     left_peers = set()
+    latencies = collections.deque(maxlen=LATENCY_SAMPLES)  # Seconds, receipt to display
+
+    ##
+    # @brief Prints one event from the network process.
+    def show_event(event):
+        typ, src, payload = event[:3]
+        if typ == 'MSG':
+            print(f"\n{COLOR_GREEN}{ts()} [{src}] {payload}{COLOR_RESET}\n")
+        elif typ == 'IMG':
+            print(f"\n{COLOR_YELLOW}{ts()} [{src}] sent image → {payload}{COLOR_RESET}\n")
+        elif typ == 'JOIN':
+            left_peers.discard(src)
+            print(f"\n{COLOR_GREEN}{ts()} [{src}] joined the chat ({payload}).{COLOR_RESET}\n")
+        elif typ == 'LEAVE':
+            if src not in left_peers:
+                print(f"\n{COLOR_RED}{ts()} [{src}] left the chat.{COLOR_RESET}\n")
+                left_peers.add(src)
+        elif typ == 'DELIVERED':
+            print(f"\n{ts()} [DELIVERED] to {src}: {payload}\n")
+        elif typ == 'QUEUED':
+            print(f"\n{COLOR_YELLOW}{ts()} [QUEUED] for {src} until they are online: {payload}{COLOR_RESET}\n")
+        elif typ == 'FAILED':
+            print(f"\n{COLOR_RED}{ts()} [FAILED] to {src}: {payload}{COLOR_RESET}\n")
+        elif typ == 'CHANMSG':
+            sender, text = payload
+            print(f"\n{COLOR_GREEN}{ts()} [{src}] [{sender}] {text}{COLOR_RESET}\n")
+        elif typ == 'CHANNELS':
+            print(f"\n[CHANNELS] {payload}\n")
+        elif typ == 'STATS':
+            print(f"\n[{src.upper()}] {payload}\n")
+
+        if len(event) > 3:  # Receipt time, sent with --latency
+            latency = time.perf_counter() - event[3]
+            latencies.append(latency)
+            print(f"[LATENCY] {latency * 1000:.2f} ms from receipt to display\n")
+
+    ##
+    # @brief Prints a summary of the measured message latencies.
+    def show_latency_summary():
+        if not latencies:
+            print("\n[LATENCY] No messages received yet.\n")
+            return
+        ms = sorted(l * 1000 for l in latencies)
+        p99 = ms[min(len(ms) - 1, int(len(ms) * 0.99))]
+        print(f"\n[LATENCY] {len(ms)} messages: median {statistics.median(ms):.2f} ms, "
+              f"p99 {p99:.2f} ms, max {ms[-1]:.2f} ms\n")
+
+    ##
+    # @brief Receives events from the network process and prints them as they arrive.
+    #
+    # Blocks until an event arrives or the stop pipe is closed; returns then or once the
+    # network process has closed its end.
+    def receive_events():
+        while True:
+            ready = wait([net2ui_c, stop_r])
+            if stop_r in ready:
+                return
+            try:
+                while net2ui_c.poll():
+                    show_event(net2ui_c.recv())
+            except (EOFError, OSError):
+                return
+
+    receiver = threading.Thread(target=receive_events, daemon=True)
+    receiver.start()
 
     ##
-    # @brief Polls the network process for incoming messages and handles them.
-    def poll_network():
-        while not stop_event.is_set():
-            while net2ui_c.poll():
-                typ, src, payload = net2ui_c.recv()
-                if typ == 'MSG':
-                    print(f"\n{COLOR_GREEN}{ts()} [{src}] {payload}{COLOR_RESET}\n")
-                elif typ == 'IMG':
-                    print(f"\n{COLOR_YELLOW}{ts()} [{src}] sent image → {payload}{COLOR_RESET}\n")
-                elif typ == 'LEAVE':
-                    if src not in left_peers:
-                        print(f"\n{COLOR_RED}{ts()} [{src}] left the chat.{COLOR_RESET}\n")
-                        left_peers.add(src)
-                    config['peers'][:] = [p for p in config['peers'] if p[0] != src]
-            time.sleep(0.05)
-
-    threading.Thread(target=poll_network, daemon=True).start()
+    # @brief Wakes the receiver thread and waits until it has printed what it was printing.
+    def stop_receiver():
+        stop_w.close()
+        receiver.join(1.0)
 
     print(f"\n========== SLCP CLI Chat started as '{chosen}' ==========")
     print_commands()
@@ -151,20 +210,10 @@ def main():
             if action == "leave":
                 print("Sending LEAVE...")
                 ui2net_p.send(("LEAVE", "", ""))
-
-                if p_disc:
-                    disc_ctrl_parent.send("STOP")
-                    p_disc.join()
-                    print("[INFO] Discovery stopped.")
-
-                ui2net_p.send(("EXIT", "", ""))
-                p_net.join()
-                stop_event.set()
-                time.sleep(0.1)
-                break
+                break  # The processes are stopped below
 
             elif action == "clients":
-                peers = [(h, ip, pt) for (h, ip, pt) in config['peers'] if h != chosen]
+                peers = [(h, ip, pt) for h, (ip, pt) in config['peers'].snapshot().items() if h != chosen]
                 if not peers:
                     print("No other clients found.")
                 else:
@@ -173,15 +222,35 @@ def main():
                         print(f"  {h} ({ip}:{pt})")
                     print()
 
+            elif action in ("join", "part") and len(parts) == 2:
+                if not parts[1].startswith("#"):
+                    print(f"[ERROR] Usage: {action} #<channel>")
+                    continue
+                ui2net_p.send(("CHANNEL", parts[1], action.upper()))
+
+            elif action == "cancel" and len(parts) == 2:
+                ui2net_p.send(("CANCEL", parts[1], ""))
+
+            elif action == "channels":
+                ui2net_p.send(("CHANNEL", "", "LIST"))
+
+            elif action == "stats":
+                ui2net_p.send(("STATS", "", ""))
+                if show_latency:
+                    show_latency_summary()
+
             elif action == "msg" and len(parts) >= 3:
                 dest = parts[1]
                 msg = parts[2]
                 ui2net_p.send(("MSG", dest, msg))
-                print(f"[SEND] to {dest}: {msg}")
+                print(f"[SEND] to {'everyone' if dest == '*' else dest}: {msg}")
 
             elif action == "img" and len(parts) >= 3:
                 dest = parts[1]
                 path = parts[2]
+                if dest == "*" or dest.startswith("#"):
+                    print("[ERROR] Images can only be sent to one recipient.")
+                    continue
                 if not os.path.isfile(path):
                     print(f"[ERROR] File not found: {path}")
                     continue
@@ -202,18 +271,14 @@ def main():
             else:
                 print("[ERROR] Unknown command. Type 'help' for commands.")
 
-            time.sleep(0.05)
-
     finally:
-        stop_event.set()
-        time.sleep(0.1)
-
-        if p_disc:
-            disc_ctrl_parent.send("STOP")
-            p_disc.join()
+        disc_ctrl_parent.send("STOP")
+        p_disc.join()
+        print("[INFO] Discovery stopped.")
 
         ui2net_p.send(("EXIT", "", ""))
         p_net.join()
+        stop_receiver()  # After the network process, so its last events are still shown
 
 
 if __name__ == "__main__":
@@ -28,27 +28,12 @@
 import sys
 import toml
 import multiprocessing
-import socket
 import os
 from processes.discovery import discovery_process
+from processes.peers     import PeerDirectory
 from processes.network   import network_process
 from processes.gui       import gui_process
 
-##
-# @brief Checks whether the specified UDP port is already in use.
-#
-# This function attempts to bind to the given port to detect conflicts.
-#
-# @param port UDP port number to test.
-# @return True if the port is currently in use, False if available.
-def port_in_use(port):
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-        try:
-            s.bind(("", port))  # Try to bind to the port
-            return False        # Success: port not in use
-        except OSError:
-            return True         # Port already in use
-
 ##
 # @brief Saves the full client configuration back to the TOML file.
 #
@@ -87,8 +72,7 @@ def main():
         sys.exit(1)
 
     config = clients[client_index]
-    manager = multiprocessing.Manager()
-    config["peers"] = manager.list()         # Shared list of known peers
+    config["peers"] = PeerDirectory()        # Shared snapshot of known peers (written by network)
     config["__cfg_all"] = cfg_all            # Full config for saving later
     config["__cfg_index"] = clients.index(config)  # Index of this client in the TOML file
 
@@ -96,18 +80,15 @@ def main():
     ui2net_p, ui2net_c = multiprocessing.Pipe()     # GUI → Network
     net2ui_p, net2ui_c = multiprocessing.Pipe()     # Network → GUI
     disc_ctrl_parent, disc_ctrl_child = multiprocessing.Pipe()  # Main → Discovery (for stopping)
+    disc2net_r, disc2net_w = multiprocessing.Pipe(duplex=False)  # Discovery → Network (peer deltas)
 
-    # Start discovery process only if port is free
-    if not port_in_use(config["whoisport"]):
-        p_disc = multiprocessing.Process(target=discovery_process, args=(config, disc_ctrl_child))
-        p_disc.start()
-        print(f"[INFO] Discovery service started on port {config['whoisport']}")
-    else:
-        p_disc = None
-        print(f"[INFO] Discovery service already running on port {config['whoisport']}, not starting again.")
+    # Start discovery process; the discovery processes elect one WHO responder among themselves
+    p_disc = multiprocessing.Process(target=discovery_process, args=(config, disc_ctrl_child, disc2net_w))
+    p_disc.start()
+    print(f"[INFO] Discovery service started on port {config['whoisport']}")
 
     # Start network and GUI processes
-    p_net = multiprocessing.Process(target=network_process, args=(config, ui2net_c, net2ui_p))
+    p_net = multiprocessing.Process(target=network_process, args=(config, ui2net_c, net2ui_p, disc2net_r))
     p_gui = multiprocessing.Process(target=gui_process,       args=(config, ui2net_p, net2ui_c))
 
     p_net.start()
@@ -116,10 +97,9 @@ def main():
     # Wait for GUI process to exit (user closed window)
     p_gui.join()
 
-    # Stop discovery process if we started it
-    if p_disc:
-        disc_ctrl_parent.send("STOP")
-        p_disc.join()
+    # Stop discovery process (hands the responder role over if we had it)
+    disc_ctrl_parent.send("STOP")
+    p_disc.join()
 
     # Notify network process to exit cleanly
     ui2net_p.send(("EXIT", "", ""))
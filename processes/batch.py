@@ -0,0 +1,82 @@
+##
+# @file batch.py
+# @brief Coalescing of outgoing binary frames into fewer datagrams.
+#
+# A burst of chat messages, or the ACKs for a burst of received ones, would otherwise cost
+# one sendto() syscall and one packet per frame. The SendBatcher collects the frames for
+# each destination address and packs them back to back into a single datagram (binary
+# frames carry their own length, see protocol.decode_all). A destination's batch is sent
+# once it would grow beyond `limit` bytes, or when the flush timer fires: by default at
+# the end of the current event loop iteration, so a burst handled in one wakeup leaves in
+# as few datagrams as possible without adding latency. A larger `delay` trades latency for
+# fuller datagrams.
+#
+# Only peers that announce `batch1` may be sent batches; the network process decides that
+# and uses the plain socket for everyone else.
+#
+# @author SLCP Team
+# @date June 2025
+#
+
+MAX_BATCH_SIZE      = 1472  # UDP payload of one Ethernet frame (1500 - IP and UDP headers)
+DEFAULT_FLUSH_DELAY = 0.0   # Seconds; 0 flushes at the end of the current loop iteration
+
+##
+# @class SendBatcher
+# @brief Per-destination send queue that packs several frames into one datagram.
+class SendBatcher:
+    ##
+    # @param loop  EventLoop the flush timer runs on.
+    # @param sock  UDP socket the datagrams are sent from.
+    # @param delay Seconds a frame may wait for more frames to the same destination.
+    # @param limit Largest datagram built from several frames.
+    def __init__(self, loop, sock, delay=DEFAULT_FLUSH_DELAY, limit=MAX_BATCH_SIZE):
+        self._loop     = loop
+        self._sock     = sock
+        self.delay     = delay
+        self.limit     = limit
+        self._pending  = {}    # addr -> [frames, total size]
+        self._timer    = None
+        self.frames    = 0     # Frames queued
+        self.datagrams = 0     # Datagrams sent for them
+
+    ##
+    # @brief Queues one encoded frame for `addr`.
+    def send(self, frame, addr):
+        pending = self._pending.get(addr)
+        if pending is not None and pending[1] + len(frame) > self.limit:
+            self._flush(addr)
+            pending = None
+        if pending is None:
+            pending = self._pending[addr] = [[], 0]
+        pending[0].append(frame)
+        pending[1] += len(frame)
+        self.frames += 1
+        if pending[1] >= self.limit:
+            self._flush(addr)  # Full already, no point in waiting
+        elif self._timer is None:
+            self._timer = self._loop.call_later(self.delay, self.flush)
+
+    ##
+    # @brief Sends everything queued right away, e.g. before the socket is closed.
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for addr in list(self._pending):
+            self._flush(addr)
+
+    ##
+    # @brief Returns the batching counters as a human-readable line.
+    def stats(self):
+        ratio = self.frames / self.datagrams if self.datagrams else 0.0
+        return f"frames {self.frames} in {self.datagrams} datagrams ({ratio:.1f} per datagram)"
+
+    def _flush(self, addr):
+        frames, _ = self._pending.pop(addr)
+        self.datagrams += 1
+        try:
+            self._sock.sendto(frames[0] if len(frames) == 1 else b"".join(frames), addr)
+        except OSError as e:
+            # Reliable frames are retransmitted, anything else is lost like any UDP datagram
+            print(f"[BATCH] Cannot send {len(frames)} frame(s) to {addr}: {e}")
@@ -0,0 +1,303 @@
+##
+# @file blobstore.py
+# @brief Content-addressed store for received images with LRU eviction under a size quota.
+#
+# Every received image is kept once, under the BLAKE2b hash of its content, in a
+# subdirectory named after the first two hex digits of the hash:
+#
+#   imagepath/3f/3fa2...c9.jpg
+#
+# The extension is taken from the image's magic bytes. A small index of JSON lines next to
+# the blobs records size, sender and time of last use:
+#
+#   {"hash": "3fa2...c9", "ext": "jpg", "size": 48213, "src": "Bob", "time": 1718000000.0}
+#   {"evict": ["77b0...1e"]}
+#
+# A later line for the same hash replaces the earlier one and marks the blob as most
+# recently used; the second form removes blobs. Like the outbox, the index is replayed on
+# open and rewritten once it holds mostly dead lines.
+#
+# Whenever the blobs grow beyond `quota` bytes, the least recently used ones are deleted.
+# Before an image is downloaded, the sender announces its hash (see processes.transfer), so
+# an image that is already in the store is not transferred again.
+#
+# Downloads are written to hidden `.part` files next to the blobs. The part file of an image
+# whose hash was announced is named after sender and hash, so a failed or cancelled download
+# is resumed when the same image is offered again; expire_parts() deletes the ones nobody
+# came back for.
+#
+# The store is shared by the download worker threads and guarded by a lock.
+#
+# @author SLCP Team
+# @date June 2025
+#
+
+import collections
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+DEFAULT_IMAGE_QUOTA = 256 * 1024 * 1024  # Bytes of received images kept
+HASH_SIZE           = 32                 # Bytes of the BLAKE2b content hash
+COMPACT_MIN_LINES   = 1000               # Dead lines tolerated before the index is rewritten
+INDEX_NAME          = "index.jsonl"
+SAFE_NAME           = re.compile(r"[A-Za-z0-9_-]{1,64}")  # Handles used in file names as they are
+
+# Magic bytes -> file extension
+_FORMATS = (
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff",      "jpg"),
+    (b"GIF87a",            "gif"),
+    (b"GIF89a",            "gif"),
+    (b"BM",                "bmp"),
+)
+
+##
+# @brief Returns the BLAKE2b content hash of a file.
+def content_hash(path):
+    h = hashlib.blake2b(digest_size=HASH_SIZE)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.digest()
+
+##
+# @brief Returns a file name component for a handle received from the network.
+#
+# Handles are chosen by peers and may contain path separators or "..", so anything but a
+# plain name is replaced by its hash.
+def safe_name(src):
+    if SAFE_NAME.fullmatch(src):
+        return src
+    return hashlib.blake2b(src.encode("utf-8"), digest_size=8).hexdigest()
+
+##
+# @brief Guesses the file extension of an image from its first bytes.
+def sniff_extension(path):
+    with open(path, "rb") as f:
+        head = f.read(12)
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    for magic, ext in _FORMATS:
+        if head.startswith(magic):
+            return ext
+    return "bin"
+
+##
+# @class BlobStore
+# @brief Received images by content hash, least recently used evicted first.
+class BlobStore:
+    ##
+    # @param root  Directory of the blobs and their index (created if missing).
+    # @param quota Bytes of blobs kept; 0 keeps everything.
+    def __init__(self, root, quota=DEFAULT_IMAGE_QUOTA):
+        self.root    = root
+        self.quota   = quota
+        self._blobs  = collections.OrderedDict()  # hex hash -> index entry, least recent first
+        self._bytes  = 0
+        self._lines  = 0   # Lines in the index
+        self._lock   = threading.Lock()
+        self._parts  = set()  # Part files a download is writing to right now
+        self.hits    = 0   # Downloads skipped because the blob was already here
+        self.evicted = 0
+        os.makedirs(root, exist_ok=True)
+        self._index = os.path.join(root, INDEX_NAME)
+        self._replay()
+        with self._lock:
+            if self._lines - len(self._blobs) > len(self._blobs):
+                self._compact()
+            else:
+                self._file = open(self._index, "a", encoding="utf-8")
+            self._evict()
+
+    def __len__(self):
+        return len(self._blobs)
+
+    ##
+    # @brief Looks up a blob by hash and marks it as used by `src`.
+    # @return Path of the blob, or None if it is not in the store.
+    def get(self, digest, src, now=None):
+        key = digest.hex()
+        with self._lock:
+            entry = self._blobs.get(key)
+            if entry is None:
+                return None
+            path = self._path(entry)
+            if not os.path.exists(path):  # Deleted behind our back
+                self._drop([key])
+                return None
+            self.hits += 1
+            self._use(entry, src, now)
+            return path
+
+    ##
+    # @brief Returns a path in the store's directory to download a new blob into.
+    def temp_path(self, src):
+        return os.path.join(self.root, f".{safe_name(src)}_{uuid.uuid4().hex}.part")
+
+    ##
+    # @brief Claims the part file an announced image from `src` is downloaded into.
+    #
+    # The name only depends on sender and hash, so a later attempt at the same image finds
+    # what an earlier one left behind. Give it back with release_part().
+    # @return The path, or None if another download of the image is using it.
+    def claim_part(self, src, digest):
+        path = os.path.join(self.root, f".{safe_name(src)}_{digest.hex()}.part")
+        with self._lock:
+            if path in self._parts:
+                return None
+            self._parts.add(path)
+        return path
+
+    def release_part(self, path):
+        with self._lock:
+            self._parts.discard(path)
+
+    ##
+    # @brief Deletes part files (and the files kept next to them) untouched for `timeout`
+    #        seconds, e.g. of offers that have expired or of downloads cut short by a crash.
+    # @return Number of deleted files.
+    def expire_parts(self, timeout, now=None):
+        cutoff  = (time.time() if now is None else now) - timeout
+        deleted = 0
+        with self._lock:
+            busy = set(self._parts)
+        for entry in os.scandir(self.root):
+            part = os.path.join(self.root, entry.name.split(".part", 1)[0] + ".part")
+            if not entry.name.startswith(".") or ".part" not in entry.name or part in busy:
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    deleted += 1
+            except OSError:
+                pass
+        return deleted
+
+    ##
+    # @brief Moves a downloaded file into the store.
+    # @param path   Downloaded file, on the same file system (see temp_path(), claim_part()).
+    # @param digest Hash the sender announced, or None if it did not announce one.
+    # @return Path of the blob.
+    # @throws ValueError if the file does not match `digest`; the file is removed.
+    def put(self, path, src, digest=None, now=None):
+        actual = content_hash(path)
+        if digest is not None and actual != digest:
+            os.remove(path)
+            raise ValueError("image does not match the announced hash")
+        key = actual.hex()
+        ext = sniff_extension(path)
+        with self._lock:
+            entry = self._blobs.get(key)
+            if entry is not None and os.path.exists(self._path(entry)):
+                os.remove(path)  # Same image arrived twice at once
+            else:
+                entry = {"hash": key, "ext": ext, "size": os.path.getsize(path)}
+                blob  = self._path(entry)
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                os.replace(path, blob)
+                self._bytes += entry["size"]
+                self._blobs[key] = entry
+            self._use(entry, src, now)
+            self._evict(keep=key)
+            return self._path(entry)
+
+    ##
+    # @brief Returns the store counters as a human-readable line.
+    def stats(self):
+        with self._lock:
+            quota = f" of {self.quota}" if self.quota else ""
+            return (f"blobs {len(self._blobs)}, {self._bytes}{quota} bytes, "
+                    f"hits {self.hits}, evicted {self.evicted}")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def _path(self, entry):
+        return os.path.join(self.root, entry["hash"][:2], f"{entry['hash']}.{entry['ext']}")
+
+    def _use(self, entry, src, now):
+        entry["src"]  = src
+        entry["time"] = time.time() if now is None else now
+        self._blobs.move_to_end(entry["hash"])
+        self._append(entry)
+
+    ##
+    # @brief Deletes least recently used blobs until the store fits its quota.
+    # @param keep Hash that is never evicted, e.g. the blob just stored.
+    def _evict(self, keep=None):
+        if not self.quota:
+            return
+        victims, excess = [], self._bytes - self.quota
+        for key, entry in self._blobs.items():
+            if excess <= 0:
+                break
+            if key != keep:
+                victims.append(key)
+                excess -= entry["size"]
+        for key in victims:
+            path = self._path(self._blobs[key])
+            try:
+                os.remove(path)
+                os.rmdir(os.path.dirname(path))  # Only succeeds once the shard is empty
+            except OSError:
+                pass
+        self.evicted += len(victims)
+        self._drop(victims)
+
+    def _drop(self, keys):
+        if not keys:
+            return
+        for key in keys:
+            self._bytes -= self._blobs.pop(key)["size"]
+        self._append({"evict": keys})
+
+    ##
+    # @brief Rebuilds the blob table from the index, skipping blobs whose file is gone.
+    def _replay(self):
+        try:
+            f = open(self._index, encoding="utf-8")
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                self._lines += 1
+                try:
+                    record = json.loads(line)
+                    if "evict" in record:
+                        for key in record["evict"]:
+                            self._blobs.pop(key, None)
+                    else:
+                        self._blobs.pop(record["hash"], None)
+                        self._blobs[record["hash"]] = record  # Most recently used last
+                except (ValueError, KeyError, TypeError):
+                    continue  # Torn or foreign line
+        for key, entry in list(self._blobs.items()):
+            if os.path.exists(self._path(entry)):
+                self._bytes += entry["size"]
+            else:
+                del self._blobs[key]
+
+    def _append(self, record):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        self._lines += 1
+        if self._lines >= COMPACT_MIN_LINES and self._lines - len(self._blobs) > len(self._blobs):
+            self._file.close()
+            self._compact()
+
+    ##
+    # @brief Rewrites the index with only the live blobs and reopens it for appending.
+    def _compact(self):
+        tmp = self._index + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for entry in self._blobs.values():
+                f.write(json.dumps(entry) + "\n")
+        os.replace(tmp, self._index)
+        self._lines = len(self._blobs)
+        self._file  = open(self._index, "a", encoding="utf-8")
@@ -0,0 +1,62 @@
+##
+# @file channels.py
+# @brief Index of named chat channels and their members.
+#
+# Every client announces the channels it is in with `chans=#a,#b` in its JOIN broadcasts,
+# which every network process overhears on the discovery port. The ChannelIndex keeps the
+# resulting membership in both directions, so sending to a channel is a single lookup of its
+# member set and a client that announces a new list (or leaves) is updated in proportion to
+# what changed rather than by scanning all channels.
+#
+# @author SLCP Team
+# @date June 2025
+#
+
+##
+# @class ChannelIndex
+# @brief Channel -> members and member -> channels, kept in sync.
+class ChannelIndex:
+    def __init__(self):
+        self._members  = {}  # channel -> set of handles
+        self._channels = {}  # handle -> frozenset of channels
+
+    ##
+    # @brief Replaces the channel list of `handle`.
+    # @return True if its membership changed.
+    def update(self, handle, channels):
+        old = self._channels.get(handle, frozenset())
+        new = frozenset(channels)
+        if new == old:
+            return False
+        for channel in old - new:
+            members = self._members[channel]
+            members.discard(handle)
+            if not members:
+                del self._members[channel]
+        for channel in new - old:
+            self._members.setdefault(channel, set()).add(handle)
+        if new:
+            self._channels[handle] = new
+        else:
+            del self._channels[handle]
+        return True
+
+    ##
+    # @brief Removes `handle` from all its channels, e.g. because it left.
+    def drop(self, handle):
+        return self.update(handle, ())
+
+    ##
+    # @brief Returns the members of `channel` (empty if nobody is in it).
+    def members(self, channel):
+        return self._members.get(channel, frozenset())
+
+    ##
+    # @brief Returns the channels `handle` is in.
+    def channels_of(self, handle):
+        return self._channels.get(handle, frozenset())
+
+    ##
+    # @brief Returns the membership as a human-readable line, channels sorted by name.
+    def describe(self):
+        return "; ".join(f"{c}: {', '.join(sorted(m))}" for c, m in sorted(self._members.items()))
@@ -0,0 +1,140 @@
+##
+# @file chatlog.py
+# @brief Bounded chat log: a ring buffer of recent lines with older history paged from disk.
+#
+# The GUI shows the chat log through a list model over a ChatLog. Only the newest
+# `capacity` lines are kept in memory. Lines pushed out of the ring are written to a history
+# file of JSON lines in the client's data directory, which is started afresh every session:
+#
+#   ["[12:00:01]", "#204EB4", "Bob: hi"]
+#
+# Scrolling to the top pages older lines back in from the end of that file, HISTORY_PAGE
+# lines at a time, without reading the lines before them. While paged-in history is shown,
+# lines leaving the ring join it, so the rows stay contiguous; once that makes it longer than
+# MAX_PAGED_IN lines, its oldest lines are dropped again (they can be paged back in).
+# collapse() drops all of it once the user is back at the newest lines.
+#
+# The rows are the paged-in history followed by the ring. ChatLog does not know about Qt;
+# the model asks rows_to_drop() before make_room() so it can announce removals first.
+#
+# @author SLCP Team
+# @date June 2025
+#
+
+import collections
+import json
+import os
+
+DEFAULT_LOG_CAPACITY = 2000      # Lines kept in memory
+HISTORY_PAGE         = 200       # Older lines paged in per request
+MAX_PAGED_IN         = 5 * HISTORY_PAGE  # Paged-in lines kept while lines leave the ring
+READ_BLOCK           = 64 * 1024 # Bytes read per step when reading the history backwards
+
+##
+# @brief Returns the history file line of an entry.
+def _encode(entry):
+    return json.dumps(entry).encode("utf-8") + b"\n"
+
+##
+# @class ChatLog
+# @brief Fixed-capacity ring of log entries that spills to and pages from a history file.
+class ChatLog:
+    ##
+    # @param path     History file (truncated on open).
+    # @param capacity Lines kept in the ring.
+    def __init__(self, path, capacity=DEFAULT_LOG_CAPACITY):
+        self.capacity = capacity
+        self._ring    = collections.deque()
+        self._older   = []  # Entries paged in from the history file, oldest first
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file    = open(path, "w+b")
+        self._cursor  = 0   # File offset of the first line not shown (end of file if none paged in)
+
+    def __len__(self):
+        return len(self._older) + len(self._ring)
+
+    ##
+    # @brief Returns the entry shown in `row`.
+    def __getitem__(self, row):
+        older = len(self._older)
+        return self._older[row] if row < older else self._ring[row - older]
+
+    ##
+    # @brief Returns the number of rows make_room(n) will remove from the top.
+    def rows_to_drop(self, n):
+        spill = max(0, len(self._ring) + n - self.capacity)
+        if self._older:
+            # Lines leaving the ring join the paged-in history, which sheds its oldest lines
+            return max(0, len(self._older) + spill - MAX_PAGED_IN)
+        return spill
+
+    ##
+    # @brief Spills the oldest ring entries to the history file so `n` more fit.
+    # @return Number of rows removed from the top (see rows_to_drop()).
+    def make_room(self, n):
+        dropped = self.rows_to_drop(n)
+        spill   = [self._ring.popleft() for _ in range(max(0, len(self._ring) + n - self.capacity))]
+        if spill:
+            self._file.seek(0, os.SEEK_END)
+            self._file.write(b"".join(_encode(e) for e in spill))
+            if self._older:
+                self._older.extend(spill)
+                # The shed lines stay in the file right before the first row shown
+                self._cursor += sum(len(_encode(e)) for e in self._older[:dropped])
+                del self._older[:dropped]
+            else:
+                self._cursor = self._file.tell()
+        return dropped
+
+    ##
+    # @brief Appends entries (stamp, color, text) after make_room() made space for them.
+    def extend(self, entries):
+        self._ring.extend(entries)
+
+    ##
+    # @brief Returns True if there is history that is not shown.
+    def has_older(self):
+        return self._cursor > 0
+
+    ##
+    # @brief Reads the page of history right before the oldest shown row.
+    # @return Tuple (entries oldest first, file offset of the first of them) for prepend().
+    def older_page(self, count=HISTORY_PAGE):
+        end = pos = self._cursor
+        buf = b""
+        while pos > 0 and buf.count(b"\n") <= count:
+            step = min(READ_BLOCK, pos)
+            pos -= step
+            self._file.seek(pos)
+            buf = self._file.read(step) + buf
+        lines = buf.split(b"\n")[:-1]  # The history always ends with a newline
+        if pos > 0:
+            lines = lines[1:]          # Partial line in front of the first newline
+        lines = lines[-count:]
+        start = end - sum(len(line) + 1 for line in lines)
+        return [tuple(json.loads(line)) for line in lines], start
+
+    ##
+    # @brief Shows a page returned by older_page() in front of the other rows.
+    def prepend(self, page):
+        entries, start = page
+        self._older[:0] = entries
+        self._cursor    = start
+
+    ##
+    # @brief Drops the paged-in history from memory.
+    # @return Number of rows removed from the top.
+    def collapse(self):
+        dropped = len(self._older)
+        self._older.clear()
+        self._file.seek(0, os.SEEK_END)
+        self._cursor = self._file.tell()
+        return dropped
+
+    ##
+    # @brief Returns the number of paged-in history rows.
+    def paged_in(self):
+        return len(self._older)
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,143 @@
+##
+# @file compress.py
+# @brief Codecs, the per-transfer compression heuristic and compression counters.
+#
+# Image chunks and long chat messages may travel compressed. zlib is always available;
+# zstd is faster at a similar ratio and used when the `zstandard` package is installed on
+# both ends. Which codecs a receiver understands travels as a bitmask of `1 << codec`.
+#
+# Whether a transfer is compressed at all is decided once per transfer by choose_codec():
+# small files and formats that are compressed already (PNG, JPEG, GIF, WebP) are sent as
+# they are, anything else only if a sample of its first bytes shrinks noticeably. Chunks
+# that do not shrink are still sent raw.
+#
+# @author SLCP Team
+# @date June 2025
+#
+
+import threading
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # Optional, zlib is used instead
+    zstandard = None
+
+from processes.blobstore import sniff_extension
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+
+ZLIB_LEVEL         = 1          # Favours speed: on a LAN the CPU, not the ratio, is the limit
+ZSTD_LEVEL         = 3
+MIN_COMPRESS_SIZE  = 16 * 1024  # Transfers smaller than this are sent as they are
+MIN_TEXT_SIZE      = 512        # Messages shorter than this are sent as they are
+SAMPLE_SIZE        = 64 * 1024  # Bytes compressed to estimate the ratio of a file
+MAX_RATIO          = 0.9        # Compressed / raw size above which compression is not used
+COMPRESSED_FORMATS = {"png", "jpg", "gif", "webp"}
+
+##
+# @brief Returns the codecs this client can compress and decompress with.
+def available_codecs():
+    return {CODEC_ZLIB, CODEC_ZSTD} if zstandard is not None else {CODEC_ZLIB}
+
+##
+# @brief Returns the bitmask of a set of codecs, as sent to the sender.
+def codec_mask(codecs):
+    mask = 0
+    for codec in codecs:
+        mask |= 1 << codec
+    return mask
+
+##
+# @brief Returns the preferred codec both sides support, or CODEC_NONE.
+def pick_codec(mask):
+    for codec in (CODEC_ZSTD, CODEC_ZLIB):
+        if mask & (1 << codec) and codec in available_codecs():
+            return codec
+    return CODEC_NONE
+
+##
+# @brief Compresses `data` with `codec`.
+def compress(codec, data):
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return zlib.compress(data, ZLIB_LEVEL)
+
+##
+# @brief Decompresses data that must expand to exactly `length` bytes.
+# @throws ValueError if the data is malformed or has a different length.
+def decompress(codec, data, length):
+    if codec == CODEC_ZSTD and zstandard is not None:
+        try:
+            if zstandard.frame_content_size(data) != length:
+                raise ValueError("compressed chunk has the wrong length")
+            out = zstandard.ZstdDecompressor().decompress(data, max_output_size=length)
+        except zstandard.ZstdError as e:
+            raise ValueError(f"corrupt compressed chunk: {e}")
+    elif codec == CODEC_ZLIB:
+        out = inflate(data, length)
+    else:
+        raise ValueError(f"unknown codec {codec}")
+    if out is None or len(out) != length:
+        raise ValueError("compressed chunk has the wrong length")
+    return out
+
+##
+# @brief Decompresses a zlib stream of unknown length, e.g. a compressed chat message.
+# @return The data, or None if it is malformed or expands beyond `limit` bytes.
+def inflate(data, limit):
+    d = zlib.decompressobj()
+    try:
+        out = d.decompress(data, limit)
+    except zlib.error:
+        return None
+    if d.unconsumed_tail or not d.eof:
+        return None  # Larger than the limit, or truncated
+    return out
+
+##
+# @brief Decides how a file is compressed for a receiver that understands `mask`.
+# @return The codec, or CODEC_NONE to send the file as it is.
+def choose_codec(path, size, mask):
+    codec = pick_codec(mask)
+    if codec == CODEC_NONE or size < MIN_COMPRESS_SIZE:
+        return CODEC_NONE
+    if sniff_extension(path) in COMPRESSED_FORMATS:
+        return CODEC_NONE
+    with open(path, "rb") as f:
+        sample = f.read(SAMPLE_SIZE)
+    if len(compress(codec, sample)) > len(sample) * MAX_RATIO:
+        return CODEC_NONE  # High entropy, e.g. an unknown compressed format
+    return codec
+
+##
+# @class CompressionStats
+# @brief Bytes before and after compression and the CPU time spent, shared by threads.
+class CompressionStats:
+    def __init__(self):
+        self._lock   = threading.Lock()
+        self.raw     = 0    # Bytes before compression (or after decompression)
+        self.wire    = 0    # Bytes actually sent or received
+        self.seconds = 0.0  # CPU time spent compressing or decompressing
+
+    ##
+    # @brief Records one compressed (or decompressed) piece of data.
+    # @param started time.thread_time() taken before the work.
+    def add(self, raw, wire, started):
+        spent = time.thread_time() - started
+        with self._lock:
+            self.raw     += raw
+            self.wire    += wire
+            self.seconds += spent
+
+    ##
+    # @brief Returns the counters as a human-readable line.
+    def describe(self):
+        with self._lock:
+            saved = self.raw - self.wire
+            pct   = 100.0 * saved / self.raw if self.raw else 0.0
+            return (f"{self.raw} -> {self.wire} bytes (saved {saved}, {pct:.0f}%), "
+                    f"{self.seconds * 1000:.0f} ms CPU")
@@ -6,15 +6,134 @@
 # It uses UDP broadcasting to detect other clients on the same network via `JOIN`, `WHO`, and `KNOWUSERS` messages.
 # One process takes the role of a WHO responder and provides a list of all known clients upon request.
 #
-# The discovery process is run in a separate process and periodically sends discovery messages to update the local peer list.
+# Every client runs a discovery process. The processes elect the responder among themselves:
+# the active responder broadcasts `RESPONDER <handle> <epoch>` heartbeats, the others stay on
+# standby and keep their own peer list up to date from the JOIN/LEAVE broadcasts. A standby
+# takes over when the heartbeats stop for RESPONDER_TIMEOUT seconds, or right away when the
+# responder announces `RESIGN <handle>` on shutdown. If two responders hear each other, the
+# one with the higher handle steps down.
+#
+# The discovery process only listens and answers. The periodic `JOIN` and `WHO` broadcasts of a
+# client are sent by exactly one DiscoveryScheduler, which runs inside the network process.
 #
 # @author Group SLCP
 # @date June 2025
 #
 
+import collections
+import random
 import socket
 import time
 
+from processes.eventloop import EventLoop
+from processes.peers     import DEFAULT_HISTORY, DEFAULT_PEER_TTL, SWEEP_TICK, PeerRegistry
+from processes.protocol  import parse_fields, parse_text
+
+MAX_UDP_SIZE           = 65507  # Largest datagram we may receive
+MAX_PAGE_BYTES         = 1400   # Largest directory reply we send, fits into one Ethernet frame
+BROADCAST_MIN_INTERVAL = 2.0    # Seconds; broadcast interval right after start or a change
+BROADCAST_MAX_INTERVAL = 30.0   # Seconds; upper bound the interval backs off to while stable
+REPLY_HOLDOFF          = 1.0    # Seconds an identical directory reply is not broadcast again
+HEARTBEAT_INTERVAL     = 1.0    # Seconds between heartbeats of the active WHO responder
+RESPONDER_TIMEOUT      = 3.0    # Seconds without heartbeat before a standby takes over
+
+##
+# @class DiscoveryScheduler
+# @brief Single source of a client's periodic discovery broadcasts (`JOIN`, `WHO`).
+#
+# Each kind of broadcast has its own interval I, which starts at `min_interval`. Within every
+# interval the broadcast is sent once, at a random point in [I/2, I], so clients that started
+# together do not stay in lockstep. After each interval I doubles up to its maximum, so a
+# stable network quickly settles on few broadcasts; reset() drops it back to the minimum when
+# something changed. If an equivalent broadcast was heard during the interval (see heard()),
+# the client's own broadcast is suppressed.
+class DiscoveryScheduler:
+    ##
+    # @param loop         EventLoop the timers run on.
+    # @param senders      Dict kind → callable that sends that broadcast.
+    # @param min_interval Interval in seconds after start/reset.
+    # @param max_interval Dict kind → largest interval in seconds.
+    def __init__(self, loop, senders, min_interval, max_interval):
+        self._loop         = loop
+        self._senders      = senders
+        self.min_interval  = min_interval
+        self.max_interval  = max_interval
+        self.interval      = {k: min_interval for k in senders}
+        self._timers       = {}
+        self._window_start = {k: 0.0 for k in senders}  # Start of the current interval
+        self._heard        = {k: -1.0 for k in senders}  # Last equivalent broadcast heard
+        self.sent          = collections.Counter()
+        self.suppressed    = collections.Counter()
+
+    ##
+    # @brief Sends every broadcast once right away and starts the intervals.
+    def start(self):
+        for kind in self._senders:
+            self._send(kind)
+            self._schedule(kind)
+
+    ##
+    # @brief Records that an equivalent broadcast of `kind` was just heard from someone else.
+    def heard(self, kind):
+        self._heard[kind] = time.monotonic()
+
+    ##
+    # @brief Shrinks the interval of `kind` back to the minimum after a change.
+    def reset(self, kind):
+        if self.interval[kind] <= self.min_interval:
+            return  # Already fast, restarting would only delay the next broadcast
+        self.interval[kind] = self.min_interval
+        self._timers[kind].cancel()
+        self._schedule(kind)
+
+    ##
+    # @brief Returns the broadcast counters as a human-readable line.
+    def stats(self):
+        return "; ".join(f"{k} sent {self.sent[k]}, suppressed {self.suppressed[k]}, "
+                         f"interval {self.interval[k]:.0f}s" for k in self._senders)
+
+    def _schedule(self, kind):
+        now = time.monotonic()
+        self._window_start[kind] = now
+        interval = self.interval[kind]
+        self._timers[kind] = self._loop.call_later(random.uniform(interval / 2, interval),
+                                                   lambda: self._fire(kind, now + interval))
+
+    def _fire(self, kind, window_end):
+        if self._heard[kind] >= self._window_start[kind]:
+            self.suppressed[kind] += 1
+        else:
+            self._send(kind)
+        # Wait for the rest of the interval, then start the next (longer) one
+        def next_interval():
+            self.interval[kind] = min(self.interval[kind] * 2, self.max_interval[kind])
+            self._schedule(kind)
+        self._timers[kind] = self._loop.call_later(window_end - time.monotonic(), next_interval)
+
+    def _send(self, kind):
+        try:
+            self._senders[kind]()
+            self.sent[kind] += 1
+        except OSError as e:
+            print(f"[{kind}] Error while sending: {e}")
+
+##
+# @brief Splits directory entries into comma-joined pages of at most `limit` bytes.
+# @param entries List of entry strings (e.g. "Alice 10.0.0.2 5005").
+# @param limit   Maximum encoded size of one page.
+# @return List of page strings; at least one (possibly empty) page.
+def paginate(entries, limit):
+    pages, current, size = [], [], 0
+    for entry in entries:
+        n = len(entry.encode("utf-8")) + 1
+        if current and size + n > limit:
+            pages.append(",".join(current))
+            current, size = [], 0
+        current.append(entry)
+        size += n
+    pages.append(",".join(current))
+    return pages
+
 ##
 # @brief Get the local machine's IP address.
 #
@@ -35,39 +154,65 @@ def get_local_ip():
 ##
 # @brief Main discovery process function.
 #
-# This function is designed to run in its own multiprocessing process. It listens and sends UDP broadcasts
-# to discover peers on the network. It maintains a list of active peers by interpreting SLCP commands like:
+# This function is designed to run in its own multiprocessing process. It listens to UDP broadcasts
+# on the discovery port and maintains a list of active peers by interpreting SLCP commands like:
 # - `JOIN` (a peer has joined),
 # - `LEAVE` (a peer has left),
-# - `WHO` (a peer is asking who is online),
-# - `KNOWUSERS` (a reply containing known peers).
+# - `WHO` (a peer is asking who is online).
+#
+# The discovery port is shared (SO_REUSEADDR/SO_REUSEPORT) by all local clients. One discovery
+# process in the network is elected WHO responder; the others are standbys ready to take over.
+# The process is driven by an EventLoop and listens to a control pipe for termination.
+#
+# The responder's directory is versioned. Every responder instance picks a random `epoch`;
+# together with the registry version it identifies a directory state. Clients ask with
+# `WHO <epoch> <version> <handle>` and get only the changes since that state (the handle
+# lets the asker recognise its own broadcast):
+#
+#     KNOWDELTA <epoch> <base> <version> <page> <pages> <full> +h ip pt,-h,...
+#
+# `full` is 1 if the client's state was unknown (other epoch, too old) and the reply lists
+# every peer instead. Replies are split into numbered pages that fit into one datagram and
+# are broadcast, so every client in the same state can use them and skip its own WHO; the
+# same reply is not broadcast twice within REPLY_HOLDOFF seconds.
+# A plain `WHO` still gets the classic `KNOWUSERS` list, sent to the asker in several datagrams.
 #
-# One client that successfully binds to the discovery port acts as the WHO responder.
-# The process listens to a control pipe for termination.
+# The process keeps its own PeerRegistry and forwards every change to the network process,
+# which owns the peer table shown to the user. A peer's JOIN broadcasts are its sign of life;
+# peers that stay silent for `peer_ttl` seconds are dropped and reported as LEAVE.
 #
-# @param config A shared dictionary (Manager.dict) containing client configuration and a shared peer list.
-#        Required fields: `handle`, `port`, `whoisport`, `peers`.
+# @param config A dictionary containing client configuration.
+#        Required fields: `handle`, `port`, `whoisport`.
 # @param ctrl_pipe A multiprocessing pipe used by the main process to send control signals (e.g., "STOP").
-def discovery_process(config, ctrl_pipe):
+# @param to_network Optional pipe for ("JOIN", handle, (ip, port)) / ("LEAVE", handle, None) deltas.
+def discovery_process(config, ctrl_pipe, to_network=None):
     handle    = config["handle"]
     port      = config["port"][0]
     whoisport = config["whoisport"]
-    peers     = config["peers"]
+    peers     = PeerRegistry(ttl=float(config.get("peer_ttl", DEFAULT_PEER_TTL)),
+                             history=DEFAULT_HISTORY)
+    epoch     = random.getrandbits(31) + 1  # Identifies this responder's directory
 
-    responder = False  # Only one client becomes WHO responder
+    responder = False  # Only the elected client answers WHO
 
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, "SO_REUSEPORT"):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
     try:
         sock.bind(("", whoisport))
-        responder = True
-        print(f"[Discovery] WHO responder active on {whoisport}")
     except OSError as e:
-        print(f"[Discovery] Not WHO responder – {e}")
+        print(f"[Discovery] Cannot listen on {whoisport} – {e}")
+        sock.close()
+        return
 
-    sock.settimeout(1.0)
+    sock.setblocking(False)
+    loop = EventLoop()
+    recent_replies = {}  # (full, base, version) -> time the reply was last broadcast
+    heartbeat_timer = None
+    watchdog        = None  # Fires when the responder has been silent for too long
 
     ##
     # @brief Broadcast a UTF-8 encoded message over the discovery UDP socket.
@@ -75,67 +220,182 @@ def discovery_process(config, ctrl_pipe):
     def broadcast(msg: str):
         sock.sendto(msg.encode("utf-8"), ("255.255.255.255", whoisport))
 
-    while True:
-        # Handle stop command from main process
-        if ctrl_pipe.poll():
+    ##
+    # @brief Answer a WHO request, with a delta if the client's directory state is known.
+    # @param addr      Address of the requesting client.
+    # @param req_epoch Epoch the client last saw, or None for a legacy WHO.
+    # @param since     Directory version the client last saw.
+    def answer_who(addr, req_epoch=None, since=0):
+        me = f"{handle} {get_local_ip()} {port}"
+        if req_epoch is None:
+            entries = [me] + [f"{h} {ip} {pt}" for h, ip, pt in peers]
+            for page in paginate(entries, MAX_PAGE_BYTES - len("KNOWUSERS ")):
+                sock.sendto(f"KNOWUSERS {page}".encode("utf-8"), addr)
+            return
+
+        changes = peers.changes_since(since) if req_epoch == epoch else None
+        if changes is None:
+            full, base = 1, 0
+            entries = [f"+{me}"] + [f"+{h} {ip} {pt}" for h, ip, pt in peers]
+        else:
+            full, base = 0, since
+            entries = [f"+{h} {a[0]} {a[1]}" if a else f"-{h}" for h, a in changes.items()]
+
+        # Someone else asked for the same thing a moment ago, the reply is already out
+        now = time.monotonic()
+        key = (full, base, peers.version)
+        if now - recent_replies.get(key, -REPLY_HOLDOFF) < REPLY_HOLDOFF:
+            return
+        if len(recent_replies) > 64:
+            recent_replies.clear()
+        recent_replies[key] = now
+
+        pages = paginate(entries, MAX_PAGE_BYTES - 64)  # Leave room for the header
+        for i, page in enumerate(pages, 1):
+            msg = f"KNOWDELTA {epoch} {base} {peers.version} {i} {len(pages)} {full} {page}"
+            broadcast(msg.rstrip())
+
+    ##
+    # @brief Broadcast a heartbeat and schedule the next one while we are responder.
+    def heartbeat():
+        nonlocal heartbeat_timer
+        try:
+            broadcast(f"RESPONDER {handle} {epoch}")
+        except OSError as e:
+            print(f"[Discovery] Error while sending heartbeat: {e}")
+        heartbeat_timer = loop.call_later(HEARTBEAT_INTERVAL, heartbeat)
+
+    ##
+    # @brief (Re)arm the standby timeout after `delay` seconds.
+    def watch_responder(delay):
+        nonlocal watchdog
+        if watchdog is not None:
+            watchdog.cancel()
+        watchdog = loop.call_later(delay, take_over)
+
+    ##
+    # @brief No heartbeat for too long: become the WHO responder.
+    def take_over():
+        nonlocal responder
+        responder = True
+        print(f"[Discovery] WHO responder active on {whoisport}")
+        heartbeat()
+
+    ##
+    # @brief Another responder is active: stand by and watch its heartbeats.
+    def step_down():
+        nonlocal responder
+        if responder:
+            print("[Discovery] Another WHO responder is active, standing by.")
+            responder = False
+            heartbeat_timer.cancel()
+        # Jitter keeps the standbys from all taking over at the same moment
+        watch_responder(RESPONDER_TIMEOUT + random.uniform(0, HEARTBEAT_INTERVAL))
+
+    ##
+    # @brief Forward a peer change to the network process.
+    def notify(cmd, peer, addr=None):
+        if to_network is not None:
+            to_network.send((cmd, peer, addr))
+
+    ##
+    # @brief Handle stop command from main process.
+    def handle_ctrl():
+        try:
             cmd = ctrl_pipe.recv()
-            if cmd == "STOP":
-                print("[Discovery] Terminated by main process.")
-                break
+        except EOFError:
+            cmd = "STOP"
+        if cmd == "STOP":
+            print("[Discovery] Terminated by main process.")
+            loop.stop()
 
-        # Broadcast JOIN and WHO messages
-        broadcast(f"JOIN {handle} {port}\n")
-        broadcast("WHO\n")
+    ##
+    # @brief JOIN: add the new peer.
+    def on_join(fields, addr):
+        peer, pport, _ = fields
+        if peer != handle and peers.add(peer, addr[0], pport):
+            notify("JOIN", peer, (addr[0], pport))
+            print(f"[Discovery] New peer detected: {(peer, addr[0], pport)}")
 
-        start = time.time()
-        while time.time() - start < 1.0:
-            try:
-                data, addr = sock.recvfrom(4096)
-            except socket.timeout:
-                break
+    ##
+    # @brief LEAVE: remove the peer.
+    def on_leave(fields, addr):
+        if peers.remove(fields[0]):
+            notify("LEAVE", fields[0])
 
+    ##
+    # @brief Heartbeat of the active responder; the lower handle wins if there are two.
+    def on_responder(fields, addr):
+        if fields[0] == handle:
+            return
+        if not responder or fields[0] < handle:
+            step_down()
+        else:
+            heartbeat_timer.cancel()
+            heartbeat()  # Assert ourselves so the other one steps down quickly
+
+    ##
+    # @brief The responder is shutting down: one of the standbys takes over soon.
+    def on_resign(fields, addr):
+        if fields[0] != handle and not responder:
+            watch_responder(random.uniform(0, HEARTBEAT_INTERVAL))
+
+    ##
+    # @brief WHO request: respond with known users if we are the responder.
+    def on_who(fields, addr):
+        if not responder:
+            return
+        if not fields[0]:
+            answer_who(addr)
+            return
+        state = parse_fields(fields[0], "ii*")
+        if state is not None:
+            answer_who(addr, *state[:2])
+
+    # Command -> handler(fields, addr); fields are already validated by parse_text()
+    handlers = {
+        "JOIN":      on_join,
+        "LEAVE":     on_leave,
+        "RESPONDER": on_responder,
+        "RESIGN":    on_resign,
+        "WHO":       on_who,
+    }
+
+    ##
+    # @brief Handle one datagram received on the discovery port.
+    def handle_socket():
+        try:
+            data, addr = sock.recvfrom(MAX_UDP_SIZE)
+        except (BlockingIOError, InterruptedError, ConnectionResetError):
+            return
+
+        parsed = parse_text(data)
+        if parsed is None:
+            return  # Malformed, unknown or binary
+        handler = handlers.get(parsed[0])
+        if handler is not None:
+            handler(parsed[1], addr)
+
+    ##
+    # @brief Drop peers that stopped broadcasting JOIN.
+    def sweep_expired_peers():
+        for peer in peers.expire():
+            print(f"[Discovery] Peer {peer} timed out.")
+            notify("LEAVE", peer)
+        loop.call_later(SWEEP_TICK, sweep_expired_peers)
+
+    loop.add_reader(ctrl_pipe, handle_ctrl)
+    loop.add_reader(sock, handle_socket)
+    sweep_expired_peers()
+    step_down()  # Start as standby; take over if no responder is heard
+
+    try:
+        loop.run()
+    finally:
+        if responder:
             try:
-                text = data.decode("utf-8").strip()
-            except UnicodeDecodeError:
-                continue
-
-            if not text:
-                continue
-
-            parts = text.split()
-            cmd = parts[0]
-
-            # Handle JOIN message: add new peer
-            if cmd == "JOIN" and len(parts) == 3:
-                peer, pport = parts[1], int(parts[2])
-                entry = (peer, addr[0], pport)
-                if peer != handle and entry not in peers:
-                    peers.append(entry)
-                    print(f"[Discovery] New peer detected: {entry}")
-
-            # Handle LEAVE message: remove peer
-            elif cmd == "LEAVE" and len(parts) == 2:
-                peer = parts[1]
-                peers[:] = [p for p in peers if p[0] != peer]
-
-            # Handle WHO request: respond with known users
-            elif cmd == "WHO" and responder:
-                all_known = [(handle, get_local_ip(), port)] + list(peers)
-                payload = ",".join(f"{h} {ip} {pt}" for h, ip, pt in all_known)
-                sock.sendto(f"KNOWUSERS {payload}".encode("utf-8"), addr)
-
-            # Handle KNOWUSERS response: merge peer list
-            elif cmd == "KNOWUSERS":
-                rest = text[len("KNOWUSERS "):]
-                for chunk in rest.split(','):
-                    if not chunk.strip():
-                        continue
-                    try:
-                        h, ip, pt = chunk.strip().split()
-                        entry = (h, ip, int(pt))
-                        if h != handle and entry not in peers:
-                            peers.append(entry)
-                    except ValueError:
-                        continue
-
-        time.sleep(3)
\ No newline at end of file
+                broadcast(f"RESIGN {handle}")
+            except OSError:
+                pass
+        loop.close()
+        sock.close()
@@ -0,0 +1,167 @@
+##
+# @file eventloop.py
+# @brief Minimal readiness-driven event loop used by the SLCP processes.
+#
+# The loop waits on all registered file objects (UDP sockets, IPC pipes) and on the
+# nearest timer deadline in a single blocking call. It only wakes up when a descriptor
+# is ready or a timer is due, so an idle client does not burn CPU and incoming work is
+# handled without any fixed sleep latency.
+#
+# Worker threads hand results back to the loop with call_soon_threadsafe(), which wakes
+# the loop through a socket pair so the callback runs on the loop thread.
+#
+# On POSIX systems the waiting is done with `selectors.DefaultSelector` (epoll/kqueue).
+# Windows cannot select on pipe handles, so there `multiprocessing.connection.wait`
+# is used instead, which accepts both sockets and pipe connections.
+#
+# @author SLCP Team
+# @date June 2025
+#
+
+import collections
+import heapq
+import itertools
+import selectors
+import socket
+import sys
+import time
+from multiprocessing.connection import wait as _connection_wait
+
+##
+# @class Timer
+# @brief Handle for a scheduled callback, returned by EventLoop.call_later().
+class Timer:
+    __slots__ = ("deadline", "callback", "cancelled")
+
+    def __init__(self, deadline, callback):
+        self.deadline  = deadline
+        self.callback  = callback
+        self.cancelled = False
+
+    ##
+    # @brief Prevents the callback from running. Safe to call more than once.
+    def cancel(self):
+        self.cancelled = True
+
+##
+# @class EventLoop
+# @brief Single-threaded loop dispatching readiness and timer events to callbacks.
+class EventLoop:
+    def __init__(self):
+        self._use_selector = sys.platform != "win32"
+        self._selector = selectors.DefaultSelector() if self._use_selector else None
+        self._readers  = {}                 # fileobj -> callback
+        self._timers   = []                 # heap of (deadline, seq, Timer)
+        self._seq      = itertools.count()  # Tie-breaker for equal deadlines
+        self._running  = False
+        self._ready    = collections.deque()  # Callbacks queued from other threads
+
+        # Self-pipe used by other threads to interrupt a blocking wait
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self.add_reader(self._wake_r, self._run_ready)
+
+    ##
+    # @brief Registers a callback that runs whenever `fileobj` is readable.
+    # @param fileobj  Socket or multiprocessing Connection (anything with fileno()).
+    # @param callback Callable without arguments.
+    def add_reader(self, fileobj, callback):
+        if fileobj in self._readers:
+            self.remove_reader(fileobj)
+        self._readers[fileobj] = callback
+        if self._use_selector:
+            self._selector.register(fileobj, selectors.EVENT_READ, callback)
+
+    ##
+    # @brief Stops watching `fileobj`. Unknown objects are ignored.
+    def remove_reader(self, fileobj):
+        if self._readers.pop(fileobj, None) is not None and self._use_selector:
+            self._selector.unregister(fileobj)
+
+    ##
+    # @brief Schedules `callback` to run once after `delay` seconds.
+    # @return Timer handle that can be cancelled.
+    def call_later(self, delay, callback):
+        timer = Timer(time.monotonic() + max(0.0, delay), callback)
+        heapq.heappush(self._timers, (timer.deadline, next(self._seq), timer))
+        return timer
+
+    ##
+    # @brief Schedules `callback` to run on the loop thread as soon as possible.
+    #
+    # This is the only EventLoop method that may be called from other threads.
+    def call_soon_threadsafe(self, callback):
+        self._ready.append(callback)
+        try:
+            self._wake_w.send(b"\0")
+        except (BlockingIOError, InterruptedError):
+            pass  # Wakeup buffer is full, the loop is going to wake up anyway
+        except OSError:
+            pass  # Loop already closed
+
+    ##
+    # @brief Clears the wakeup socket and runs callbacks queued by other threads.
+    def _run_ready(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        while self._ready:
+            self._ready.popleft()()
+
+    ##
+    # @brief Makes run() return after the current iteration.
+    def stop(self):
+        self._running = False
+
+    ##
+    # @brief Returns the seconds until the next live timer, or None if there is none.
+    def _next_timeout(self):
+        while self._timers and self._timers[0][2].cancelled:
+            heapq.heappop(self._timers)
+        if not self._timers:
+            return None
+        return max(0.0, self._timers[0][0] - time.monotonic())
+
+    ##
+    # @brief Blocks until at least one reader is ready or `timeout` expires.
+    # @return List of callbacks whose file objects are readable.
+    def _wait(self, timeout):
+        if self._use_selector:
+            return [key.data for key, _ in self._selector.select(timeout)]
+        ready = _connection_wait(list(self._readers), timeout)
+        return [self._readers[obj] for obj in ready if obj in self._readers]
+
+    ##
+    # @brief Runs all timers whose deadline has passed.
+    def _run_due_timers(self):
+        now = time.monotonic()
+        while self._timers and self._timers[0][0] <= now:
+            _, _, timer = heapq.heappop(self._timers)
+            if not timer.cancelled:
+                timer.callback()
+
+    ##
+    # @brief Runs the loop until stop() is called.
+    def run(self):
+        self._running = True
+        while self._running:
+            for callback in self._wait(self._next_timeout()):
+                callback()
+                if not self._running:
+                    break
+            if self._running:
+                self._run_due_timers()
+
+    ##
+    # @brief Releases the selector and wakeup sockets. Registered file objects are not closed.
+    def close(self):
+        if self._use_selector:
+            self._selector.close()
+        self._readers.clear()
+        self._timers.clear()
+        self._ready.clear()
+        self._wake_r.close()
+        self._wake_w.close()
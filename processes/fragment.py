@@ -0,0 +1,117 @@
+##
+# @file fragment.py
+# @brief Splitting large chat messages into datagram-sized fragments and reassembling them.
+#
+# A UDP datagram larger than the path MTU is fragmented by IP, and losing any one IP
+# fragment loses the whole datagram. Large message payloads are therefore split by the
+# sender into fragments of at most FRAGMENT_SIZE bytes that each fit into one Ethernet
+# frame. Every fragment carries the message id, its index and the fragment count (see
+# protocol.FRAGMENT), so with reliable delivery only a lost fragment is resent.
+#
+# The Reassembler collects fragments per sending peer. Memory is bounded: each peer may
+# have at most `cap` bytes buffered in incomplete messages, and incomplete messages are
+# discarded after `timeout` seconds. A fragment that does not fit is refused rather than
+# evicting data that was already acknowledged; with reliable delivery the receiver simply
+# does not acknowledge it, so the sender retries once earlier messages are complete.
+#
+# @author SLCP Team
+# @date June 2025
+#
+
+import time
+
+FRAGMENT_SIZE          = 1400     # Payload bytes per fragment; header + payload fit into 1500
+MAX_FRAGMENTS          = 1024     # Largest message: MAX_FRAGMENTS * FRAGMENT_SIZE bytes
+DEFAULT_REASSEMBLY_CAP = 1 << 20  # Bytes of incomplete messages buffered per peer
+REASSEMBLY_TIMEOUT     = 30.0     # Seconds an incomplete message is kept
+
+##
+# @brief Splits a payload into fragments of at most `size` bytes.
+# @return List of bytes objects; a single element if no fragmentation is needed.
+def split(data, size=FRAGMENT_SIZE):
+    return [data[off:off + size] for off in range(0, len(data), size)] or [data]
+
+##
+# @class _Partial
+# @brief Fragments of one message received so far.
+class _Partial:
+    __slots__ = ("count", "parts", "size", "started")
+
+    def __init__(self, count, now):
+        self.count   = count
+        self.parts   = {}   # index -> bytes
+        self.size    = 0
+        self.started = now
+
+##
+# @class Reassembler
+# @brief Bounded per-peer reassembly of fragmented messages.
+class Reassembler:
+    ##
+    # @param cap     Bytes of incomplete messages buffered per peer.
+    # @param timeout Seconds after which an incomplete message is dropped.
+    def __init__(self, cap=DEFAULT_REASSEMBLY_CAP, timeout=REASSEMBLY_TIMEOUT):
+        self.cap      = cap
+        self.timeout  = timeout
+        self._partial = {}   # src -> {msg_id: _Partial}, oldest first
+        self._usage   = {}   # src -> bytes buffered
+        self.rejected = 0    # Fragments refused because of the cap
+        self.expired  = 0    # Incomplete messages dropped after the timeout
+
+    ##
+    # @brief Checks whether a fragment can be stored right now without exceeding the cap.
+    #        Refused fragments are counted in `rejected`.
+    def admits(self, src, count, length):
+        if count * length <= self.cap and self._usage.get(src, 0) + length <= self.cap:
+            return True
+        self.rejected += 1  # Over the cap now, or the message could never fit at all
+        return False
+
+    ##
+    # @brief Stores one fragment.
+    # @param src     Handle of the sender.
+    # @param msg_id  Sender's message id.
+    # @param index   Index of this fragment.
+    # @param count   Number of fragments of the message.
+    # @param data    Fragment payload (bytes, kept as is).
+    # @return The complete message as bytes once the last fragment arrived, else None.
+    def add(self, src, msg_id, index, count, data, now=None):
+        if not 0 <= index < count <= MAX_FRAGMENTS:
+            return None  # Malformed
+        if not self.admits(src, count, len(data)):
+            return None
+        now      = time.monotonic() if now is None else now
+        messages = self._partial.setdefault(src, {})
+        partial  = messages.get(msg_id)
+        if partial is None:
+            partial = messages[msg_id] = _Partial(count, now)
+        if partial.count != count or index in partial.parts:
+            return None  # Inconsistent or duplicate fragment
+
+        partial.parts[index] = data
+        partial.size += len(data)
+        self._usage[src] = self._usage.get(src, 0) + len(data)
+        if len(partial.parts) < count:
+            return None
+
+        self._usage[src] -= partial.size
+        del messages[msg_id]
+        return b"".join(partial.parts[i] for i in range(count))
+
+    ##
+    # @brief Drops incomplete messages older than the timeout.
+    def expire(self, now=None):
+        cutoff = (time.monotonic() if now is None else now) - self.timeout
+        for src, messages in list(self._partial.items()):
+            for msg_id in [m for m, p in messages.items() if p.started < cutoff]:
+                self._usage[src] -= messages.pop(msg_id).size
+                self.expired += 1
+            if not messages:
+                del self._partial[src]
+                self._usage.pop(src, None)
+
+    ##
+    # @brief Forgets everything buffered for a peer that left.
+    def drop_peer(self, src):
+        self._partial.pop(src, None)
+        self._usage.pop(src, None)
@@ -9,11 +9,21 @@
 # Communication with the network and discovery processes is handled via multiprocessing pipes.
 # Built using PyQt5 and styled optionally using QDarkStyle.
 #
+# The chat log is a QListView over a ChatLogModel: only the newest `log_lines` lines are kept
+# in memory, older ones are paged back in from the session's history file when the view is
+# scrolled to the top (see processes.chatlog). Lines are appended in one model update per
+# wakeup, however many events arrived.
+#
+# The GUI sleeps until the network process sends something: a QSocketNotifier watches the
+# pipe's file descriptor (on Windows, where pipes are not sockets, a QTimer polls it
+# instead). Peers joining and leaving arrive as JOIN and LEAVE events.
+#
 # Key GUI Features:
 # - Display chat log with timestamps and color-coded messages
 # - Input fields for recipient and message
 # - Send image button (opens file dialog)
 # - View active clients
+# - Join/part channels and post to them (#channel as recipient)
 # - AFK mode toggle with autoreply functionality
 # - Dark mode toggle
 # - In-app configuration management
@@ -30,14 +40,18 @@ import socket
 import toml
 import qdarkstyle
 from PyQt5.QtWidgets import (
-    QApplication, QWidget, QTextEdit, QVBoxLayout, QHBoxLayout,
+    QApplication, QWidget, QListView, QVBoxLayout, QHBoxLayout,
     QLineEdit, QPushButton, QFileDialog, QMessageBox,
     QDialog, QFormLayout
 )
-from PyQt5.QtCore import QTimer
-from PyQt5.QtGui import QTextCursor, QColor
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, QSocketNotifier, Qt, QTimer
+from PyQt5.QtGui import QBrush, QColor
+
+from processes.chatlog import DEFAULT_LOG_CAPACITY, ChatLog
 
 MAX_DISPLAY_CHUNK = 200  # Max characters per chat display chunk
+MAX_EVENTS_PER_WAKEUP = 256  # Network events handled before the GUI gets to repaint
+POLL_INTERVAL_MS = 50  # Pipe polling interval where QSocketNotifier cannot watch pipes
 CONFIG_FILE = "config.toml"  # Default path to config file
 
 ##
@@ -75,6 +89,72 @@ def get_local_ip():
     finally:
         s.close()
 
+##
+# @class ChatLogModel
+# @brief Read-only list model over a ChatLog; one row per displayed line.
+class ChatLogModel(QAbstractListModel):
+    ##
+    # @param log ChatLog holding the rows.
+    def __init__(self, log, parent=None):
+        super().__init__(parent)
+        self._log = log
+        self._brushes = {}  # Color string -> QBrush, shared by all rows of that color
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._log)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        stamp, color, text = self._log[index.row()]
+        if role == Qt.DisplayRole:
+            return f"{stamp} {text}" if stamp else text
+        if role == Qt.ForegroundRole:
+            brush = self._brushes.get(color)
+            if brush is None:
+                brush = self._brushes[color] = QBrush(QColor(color))
+            return brush
+        return None
+
+    ##
+    # @brief Appends entries (stamp, color, text) with one insert per ring's worth of rows.
+    def add(self, entries):
+        for i in range(0, len(entries), self._log.capacity):
+            batch = entries[i:i + self._log.capacity]
+            dropped = self._log.rows_to_drop(len(batch))
+            if dropped:
+                self.beginRemoveRows(QModelIndex(), 0, dropped - 1)
+                self._log.make_room(len(batch))
+                self.endRemoveRows()
+            else:
+                self._log.make_room(len(batch))
+            first = len(self._log)
+            self.beginInsertRows(QModelIndex(), first, first + len(batch) - 1)
+            self._log.extend(batch)
+            self.endInsertRows()
+
+    ##
+    # @brief Pages in older history in front of the first row.
+    # @return Number of rows inserted.
+    def load_older(self):
+        if not self._log.has_older():
+            return 0
+        page = self._log.older_page()
+        if page[0]:
+            self.beginInsertRows(QModelIndex(), 0, len(page[0]) - 1)
+            self._log.prepend(page)
+            self.endInsertRows()
+        return len(page[0])
+
+    ##
+    # @brief Drops paged-in history again, e.g. once the view is back at the newest rows.
+    def collapse(self):
+        n = self._log.paged_in()
+        if n:
+            self.beginRemoveRows(QModelIndex(), 0, n - 1)
+            self._log.collapse()
+            self.endRemoveRows()
+
 ##
 # @class SettingsDialog
 # @brief Dialog window for editing and saving user configuration.
@@ -159,41 +239,86 @@ def gui_process(config, to_network, from_network):
 
     # Main layout
     vlayout = QVBoxLayout()
-    chat = QTextEdit(); chat.setReadOnly(True)
+    data_dir = config.get("datadir", os.path.join("data", handle))
+    log = ChatLog(os.path.join(data_dir, "chatlog.jsonl"),
+                  int(config.get("log_lines", DEFAULT_LOG_CAPACITY)))
+    model = ChatLogModel(log)
+    chat = QListView()
+    chat.setModel(model)
+    chat.setUniformItemSizes(True)  # Rows are single lines, so Qt need not measure each one
+    chat.setSelectionMode(QListView.NoSelection)
     vlayout.addWidget(chat)
 
     # Control layout (buttons + inputs)
     controls = QHBoxLayout()
-    dest_input = QLineEdit(); dest_input.setPlaceholderText("Recipient handle")
+    dest_input = QLineEdit(); dest_input.setPlaceholderText("Recipient handle, #channel or * for everyone")
     msg_input = QLineEdit(); msg_input.setPlaceholderText("Message…")
     btn_send = QPushButton("Send")
     btn_img = QPushButton("Send Image")
     btn_clients = QPushButton("Clients")
+    btn_stats = QPushButton("Stats")
+    btn_channel = QPushButton("Join/Part #")
     btn_leave = QPushButton("Leave Chat")
     btn_afk = QPushButton("AFK: OFF"); btn_afk.setCheckable(True)
     btn_afk.setStyleSheet("background-color: #666; color: white;")
     btn_dark = QPushButton("Dark Mode"); btn_dark.setCheckable(True)
     btn_settings = QPushButton("Settings")
 
-    for w in (dest_input, msg_input, btn_send, btn_img, btn_clients, btn_settings, btn_leave, btn_afk, btn_dark):
+    for w in (dest_input, msg_input, btn_send, btn_img, btn_clients, btn_channel, btn_stats, btn_settings, btn_leave, btn_afk, btn_dark):
         controls.addWidget(w)
     vlayout.addLayout(controls)
     wnd.setLayout(vlayout)
 
     local_peers = set()
     afk_mode = False
+    my_channels = set(config.get("channels", []))
+    pending = []  # Log entries waiting to be shown
 
     ##
     # @brief Append message to chat window with color and timestamp.
+    #
+    # The line is shown once control returns to the Qt event loop, in one model update with
+    # everything else appended in the meantime.
+    #
+    # Long lines and line breaks are split into rows of at most MAX_DISPLAY_CHUNK characters.
+    #
     # @param text The message content.
     # @param color The HTML hex color string for the message text.
     def append(text, color="#010202"):
-        chat.setTextColor(QColor(color))
-        chat.append(f"{ts()} {text}")
-        chat.moveCursor(QTextCursor.End)
+        if not pending:
+            QTimer.singleShot(0, flush_log)
+        stamp = ts()
+        for line in text.splitlines() or [""]:
+            for i in range(0, max(len(line), 1), MAX_DISPLAY_CHUNK):
+                pending.append((stamp, color, line[i:i + MAX_DISPLAY_CHUNK]))
+                stamp = ""  # Continuation rows
+
+    ##
+    # @brief Moves pending lines into the log in one model update and follows the newest
+    #        line if the view was showing it.
+    def flush_log():
+        if not pending:
+            return
+        bar = chat.verticalScrollBar()
+        at_bottom = bar.value() >= bar.maximum()
+        if at_bottom:
+            model.collapse()
+        model.add(pending)
+        pending.clear()
+        if at_bottom:
+            chat.scrollToBottom()
+
+    ##
+    # @brief Pages in older history when the view is scrolled to the top.
+    def on_scroll(value):
+        if value == chat.verticalScrollBar().minimum() and log.has_older():
+            added = model.load_older()
+            chat.verticalScrollBar().setValue(value + added)  # Keep the same rows in view
+
+    chat.verticalScrollBar().valueChanged.connect(on_scroll)
 
     ##
-    # @brief Sends a text message to a specified recipient.
+    # @brief Sends a text message to a specified recipient, or to everyone for "*".
     def send_message():
         dest = dest_input.text().strip()
         msg = msg_input.text().strip()
@@ -213,13 +338,16 @@ def gui_process(config, to_network, from_network):
         if not dest:
             QMessageBox.warning(wnd, "Error", "Please enter recipient handle!")
             return
+        if dest == "*" or dest.startswith("#"):
+            QMessageBox.warning(wnd, "Error", "Images can only be sent to one recipient!")
+            return
         append(f"{handle} → {dest} [Image]", "#2A8940")
         to_network.send(("IMG", dest, path))
 
     ##
     # @brief Displays a list of active known peers.
     def show_clients():
-        peers = [(h, ip, pt) for (h, ip, pt) in config['peers'] if h != handle]
+        peers = [(h, ip, pt) for h, (ip, pt) in config['peers'].snapshot().items() if h != handle]
         if not peers:
             QMessageBox.information(wnd, "Clients", "No other clients found.")
         else:
@@ -241,6 +369,22 @@ def gui_process(config, to_network, from_network):
         to_network.send(("EXIT", "", ""))
         wnd.close()
 
+    ##
+    # @brief Joins the channel typed as recipient, or parts it if already joined.
+    def toggle_channel():
+        channel = dest_input.text().strip()
+        if not channel.startswith("#") or len(channel) < 2 or " " in channel:
+            QMessageBox.warning(wnd, "Error", "Please enter a channel name like #team as recipient!")
+            return
+        if channel in my_channels:
+            my_channels.discard(channel)
+            to_network.send(("CHANNEL", channel, "PART"))
+            append(f"[System] Left {channel}", "#666666")
+        else:
+            my_channels.add(channel)
+            to_network.send(("CHANNEL", channel, "JOIN"))
+            append(f"[System] Joined {channel}", "#666666")
+
     ##
     # @brief Toggles AFK (away-from-keyboard) mode and updates GUI/network.
     def toggle_afk():
@@ -279,6 +423,8 @@ def gui_process(config, to_network, from_network):
     msg_input.returnPressed.connect(send_message)
     btn_img.clicked.connect(send_image)
     btn_clients.clicked.connect(show_clients)
+    btn_channel.clicked.connect(toggle_channel)
+    btn_stats.clicked.connect(lambda: to_network.send(("STATS", handle, "")))
     btn_leave.clicked.connect(leave_chat)
     btn_afk.clicked.connect(toggle_afk)
     btn_dark.clicked.connect(toggle_dark)
@@ -287,29 +433,49 @@ def gui_process(config, to_network, from_network):
     already_left = set()
 
     ##
-    # @brief Polls the pipe from the network process for new messages/events.
-    def poll_network():
-        current = {h for (h, _, _) in config['peers'] if h != handle}
-        newcomers = current - local_peers
-        for h in sorted(newcomers):
-            append(f"{h} joined the chat.", "#2A8940")
-        local_peers.update(newcomers)
-
-        while from_network.poll():
-            typ, src, payload = from_network.recv()
-            if typ == 'MSG':
+    # @brief Handles the events waiting in the pipe from the network process.
+    #
+    # At most MAX_EVENTS_PER_WAKEUP events are handled at once; if more are waiting, the pipe
+    # stays readable and the notifier fires again right after the GUI has repainted.
+    def handle_network():
+        for _ in range(MAX_EVENTS_PER_WAKEUP):
+            try:
+                if not from_network.poll():
+                    break
+                typ, src, payload = from_network.recv()
+            except (EOFError, OSError):
+                stop_watching()
+                append("[System] Network process has exited.", "#D60C0C")
+                break
+            if typ == 'JOIN':
+                already_left.discard(src)
+                if src not in local_peers:
+                    local_peers.add(src)
+                    append(f"{src} joined the chat.", "#2A8940")
+            elif typ == 'MSG':
                 append(f"{src}: {payload}", "#204EB4")
+            elif typ == 'CHANMSG':
+                sender, text = payload
+                append(f"[{src}] {sender}: {text}", "#204EB4")
             elif typ == 'IMG':
                 append(f"{src} sent image → {payload}", "#204EB4")
                 open_file(payload)
+            elif typ == 'DELIVERED':
+                append(f"✓ delivered to {src}: {payload}", "#7A9A7A")
+            elif typ == 'QUEUED':
+                append(f"queued for {src} until they are online: {payload}", "#B08000")
+            elif typ == 'FAILED':
+                append(f"WARNING message to {src} not delivered: {payload}", "#D60C0C")
+            elif typ == 'STATS':
+                append(f"[System] {src}: {payload}", "#666666")
             elif typ == 'LEAVE':
                 if src in already_left:
-                    return
+                    continue
                 already_left.add(src)
                 append(f"WARNING {src} left the chat.", "#D60C0C")
-                if src in local_peers:
-                    local_peers.remove(src)
-                config['peers'][:] = [p for p in config['peers'] if p[0] != src]
+                local_peers.discard(src)
+
+        flush_log()
 
     append(f"Welcome, {handle}!", "#000000")
 
@@ -324,10 +490,23 @@ def gui_process(config, to_network, from_network):
         already_closing = True
         event.accept()
 
-    # Use QTimer instead of threads to poll for new data
-    timer = QTimer()
-    timer.timeout.connect(poll_network)
-    timer.start(50)
+    # Wake up when the network process has sent something
+    if platform.system() == 'Windows':
+        watcher = QTimer()
+        watcher.timeout.connect(handle_network)
+        watcher.start(POLL_INTERVAL_MS)
+    else:
+        watcher = QSocketNotifier(from_network.fileno(), QSocketNotifier.Read)
+        watcher.activated.connect(handle_network)
+
+    ##
+    # @brief Stops watching the pipe once the network process is gone.
+    def stop_watching():
+        if isinstance(watcher, QTimer):
+            watcher.stop()
+        else:
+            watcher.setEnabled(False)
 
     wnd.show()
-    app.exec_()
\ No newline at end of file
+    app.exec_()
+    log.close()
\ No newline at end of file
@@ -5,212 +5,907 @@
 This module implements the core networking layer of the SLCP protocol. It allows clients to send and receive messages and images, manage AFK states, and maintain a list of peers discovered in the network. Communication is done using UDP for messages and TCP for binary image transfer.
 """
 
-import socket, os, time, threading
-
-MAX_UDP_SIZE = 65507  # Maximum safe UDP packet size
-
-# Sends an image via TCP after notifying the recipient via UDP
+import itertools, random, socket, struct, os, time
+
+from processes.batch     import DEFAULT_FLUSH_DELAY, SendBatcher
+from processes.channels  import ChannelIndex
+from processes.discovery import BROADCAST_MAX_INTERVAL, BROADCAST_MIN_INTERVAL, DiscoveryScheduler
+from processes.eventloop import EventLoop
+from processes.blobstore import DEFAULT_IMAGE_QUOTA, BlobStore
+from processes.compress  import CODEC_ZLIB, MAX_RATIO, MIN_TEXT_SIZE, CompressionStats, compress, inflate
+from processes.peers     import DEFAULT_PEER_TTL, SWEEP_TICK, PeerRegistry
+from processes.outbox    import DEFAULT_OUTBOX_LIMIT, DEFAULT_OUTBOX_TTL, Outbox
+from processes.fragment  import DEFAULT_REASSEMBLY_CAP, FRAGMENT_SIZE, MAX_FRAGMENTS, Reassembler, split
+from processes.protocol  import (BATCH_CAP, BINARY_CAP, FLAG_CHANNEL, FLAG_COMPRESSED, FLAG_FRAGMENT,
+                                 FLAG_RELIABLE, FRAGMENT, FRAGMENT_CAP, GROUP_CAP, IMG_OFFER, OP_ACK,
+                                 OP_IMG, OP_LEAVE, OP_MSG, RELIABLE, RELIABLE_CAP, TRANSFER_CAP,
+                                 ZLIB_CAP,
+                                 ack_payload, channel_payload,
+                                 decode_all, encode, handle_id, is_binary, is_channel,
+                                 parse_ack_payload, parse_caps, parse_channel_payload,
+                                 parse_channels, parse_delta, parse_fields, parse_knowusers,
+                                 parse_text)
+from processes.reliable  import ReceiveWindow, ReliableSender
+from processes.transfer  import (DEFAULT_MAX_ACTIVE, DEFAULT_MAX_PER_PEER, OFFER_TIMEOUT,
+                                 ConnectionPool, TransferCancelled, TransferScheduler,
+                                 TransferServer, download_image, download_once, serve_once)
+
+MAX_UDP_SIZE          = 65507    # Maximum safe UDP packet size
+RECV_BATCH            = 32       # Datagrams drained per wakeup (size of the buffer pool)
+UI_BATCH              = 64       # UI commands handled per wakeup, so bursts can be batched
+DEFAULT_RECV_BUFFER   = 1 << 20  # Default SO_RCVBUF in bytes if `recv_buffer` is not configured
+DEFAULT_GROUP         = "239.255.76.67"  # Multicast group for messages to everyone
+EVERYONE              = "*"      # Recipient handle that addresses every peer
+
+##
+# @brief Reads all pending datagrams from a non-blocking socket into a preallocated buffer pool.
+#
+# Each datagram is received with `recvfrom_into` directly into one of the pool buffers, so no
+# per-packet bytes objects are allocated. At most `len(pool)` datagrams are read per call; if
+# more are pending the socket stays readable and the event loop calls back right away.
+#
+# @param sock Non-blocking UDP socket.
+# @param pool List of writable memoryviews of MAX_UDP_SIZE bytes each.
+# @return List of (memoryview, addr) tuples. The views are only valid until the next call.
+def drain_datagrams(sock, pool):
+    batch = []
+    for buf in pool:
+        while True:
+            try:
+                n, addr = sock.recvfrom_into(buf)
+            except InterruptedError:
+                continue
+            except BlockingIOError:
+                return batch
+            except ConnectionResetError:
+                continue  # Windows reports ICMP port unreachable on the next recv
+            break
+        batch.append((buf[:n], addr))
+    return batch
+
+# Offers an image on the client's TransferServer and notifies the recipient via UDP
+#
+# The recipient fetches the file over a pooled keep-alive connection to `server`. Peers that
+# do not announce `xfer1` cannot, they are sent the image with send_image_once() instead.
+#
+# @param config       Dictionary containing client configuration.
+# @param server       Running TransferServer of this client.
+# @param udp_sock     UDP socket used to send the IMG notice.
+# @param dest_handle  Handle of the recipient client.
+# @param filepath     Path to the image file.
+# @param peer_ip      IP address of the peer.
+# @param peer_port    UDP port of the peer.
+# @param seq          Sequence number for a binary notice, or None to send the text form.
+def send_image_via_tcp(config, server, udp_sock, dest_handle, filepath, peer_ip, peer_port, seq=None):
+    handle  = config["handle"]
+    size    = os.stat(filepath).st_size  # File is only opened once the receiver asks for it
+    xfer_id = server.offer(filepath, size, peer_ip)
+
+    if seq is None:
+        notice = f"IMG {handle} {dest_handle} {server.port} {size} {xfer_id}".encode("utf-8")
+    else:
+        notice = encode(OP_IMG, seq, handle, dest_handle, IMG_OFFER.pack(server.port, size, xfer_id))
+    udp_sock.sendto(notice, (peer_ip, peer_port))
+
+# Sends an image to a peer without `xfer1` the original way: a four-field IMG notice
+# pointing at a listener that streams the file once
 #
 # @param config       Dictionary containing client configuration.
+# @param udp_sock     UDP socket used to send the IMG notice.
 # @param dest_handle  Handle of the recipient client.
 # @param filepath     Path to the image file.
 # @param peer_ip      IP address of the peer.
 # @param peer_port    UDP port of the peer.
-def send_image_via_tcp(config, dest_handle, filepath, peer_ip, peer_port):
-    handle   = config["handle"]
-    img_path = config["imagepath"]
-    data = open(filepath, "rb").read()   # Read image file as bytes
-    size = len(data)
-
-    # Set up temporary TCP server to send image
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind(("", 0))                  # Bind to a random free port
-    server.listen(1)
-    tcp_port = server.getsockname()[1]   # Get the chosen port
-
-    # Notify recipient via UDP
-    udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    udp.sendto(f"IMG {handle} {dest_handle} {tcp_port} {size}".encode("utf-8"),
-               (peer_ip, peer_port))
-    udp.close()
-
-    # Serve the image in a separate thread
-    def _serve():
-        conn, _ = server.accept()
-        conn.sendall(data)   # Send image data
-        conn.close()
-        server.close()
-
-    threading.Thread(target=_serve, daemon=True).start()
+def send_image_once(config, udp_sock, dest_handle, filepath, peer_ip, peer_port):
+    size     = os.stat(filepath).st_size
+    tcp_port = serve_once(filepath, size, peer_ip)
+    udp_sock.sendto(f"IMG {config['handle']} {dest_handle} {tcp_port} {size}".encode("utf-8"),
+                    (peer_ip, peer_port))
 
 # Main network process responsible for handling all networking logic
 #
-# @param config   Client configuration dictionary.
-# @param ui2net   Pipe for receiving commands from the UI (CLI or GUI).
-# @param net2ui   Pipe for sending events back to the UI.
-def network_process(config, ui2net, net2ui):
+# The process is driven by an EventLoop: it sleeps until the UDP socket or the UI pipe
+# becomes readable, or until the next periodic JOIN/WHO broadcast is due.
+#
+# All discovery broadcasts of the client come from one DiscoveryScheduler. Besides its chat
+# port the process also listens on the shared `whoisport`, so it hears other clients' JOIN
+# and WHO broadcasts and the responder's broadcast KNOWDELTA replies. A WHO for the same
+# directory state as ours, or a reply that brings us up to date, makes our own WHO redundant.
+#
+# Peers that announce `caps=bin1` in their JOIN (or send us binary frames) are addressed with
+# the compact binary framing from processes.protocol; everyone else gets the text commands.
+# Chat messages to peers that also announce `rel1` are delivered reliably (sequence numbers,
+# ACKs, retransmission; see processes.reliable) and the UI is told with a DELIVERED or
+# FAILED event once the outcome is known. Messages larger than FRAGMENT_SIZE are split into
+# fragments for peers that announce `frag1` and reassembled on receipt within a per-peer
+# memory cap (`reassembly_cap`).
+#
+# Binary frames to peers that announce `batch1` go through a SendBatcher, which packs the
+# frames for one peer into a single datagram per loop iteration (or per `flush_delay`).
+# ACKs are coalesced as well: one per peer and iteration, covering everything received.
+#
+# A message to EVERYONE is sent as one binary MSG frame without recipient to the configured
+# `group` (a multicast group joined on the discovery port socket, or a broadcast address)
+# and reaches every peer that announces `group1`. Only peers without that capability, or
+# every peer if the group cannot be used, are sent the message one by one. Messages to
+# everyone are best effort, they are neither acknowledged nor reported as delivered.
+#
+# Channels (`#name`) are joined and parted with ("CHANNEL", "#name", "JOIN"/"PART") from
+# the UI. The channels of every client travel in its JOIN broadcasts (`chans=...`) into a
+# ChannelIndex; a message to a channel is sent to each member, reliably and batched like any
+# other chat message, and shown by the recipients as a CHANMSG event if they are still in it.
+#
+# With `compression` enabled (the default), messages of MIN_TEXT_SIZE bytes or more to peers
+# that announce `zlib1` are sent zlib-compressed if that makes them noticeably smaller, and
+# image transfers negotiate compression with the sender (see processes.transfer). Bytes
+# saved and CPU time spent are reported in STATS.
+#
+# A MSG or IMG for a handle that is not in the peer table is kept in the persistent Outbox
+# (`datadir`/outbox.jsonl) and the UI is told with a QUEUED event. Everything queued for a
+# peer is sent in one go as soon as a JOIN, KNOWUSERS or KNOWDELTA entry brings it (back)
+# into the table; entries beyond `outbox_limit` per peer or older than `outbox_ttl` are
+# reported as FAILED.
+#
+# Image downloads run on a TransferScheduler: at most `download_workers` at once and
+# `downloads_per_peer` per sender, smaller images first. They are cancelled with
+# ("CANCEL", handle, ""), one at a time with ("CANCEL", "#<job id>", ""), or when the sender
+# leaves. Received images are kept in a BlobStore
+# in `imagepath` under their content hash, at most `image_quota` bytes of them; an image
+# that is already there is not downloaded again.
+#
+# Every peer that enters the peer table is reported to the UI as ("JOIN", handle, "ip:port"),
+# every peer that leaves or times out as ("LEAVE", handle, ""), so the UI never has to poll
+# the peer directory for changes.
+#
+# If the UI sets `__latency` in the config, MSG and CHANMSG events carry a fourth element:
+# the time.perf_counter() at which the datagram was read from the socket (a system-wide
+# clock on the supported platforms), so the UI can measure the delay until it displayed it.
+#
+# The process owns the authoritative PeerRegistry. Peer changes reported by the discovery
+# process arrive as deltas on `from_discovery`; after every change the registry is
+# published into the shared PeerDirectory (`config["peers"]`) read by the UI.
+#
+# @param config         Client configuration dictionary.
+# @param ui2net         Pipe for receiving commands from the UI (CLI or GUI).
+# @param net2ui         Pipe for sending events back to the UI.
+# @param from_discovery Optional pipe receiving ("JOIN"/"LEAVE", handle, addr) deltas from discovery.
+def network_process(config, ui2net, net2ui, from_discovery=None):
     handle     = config["handle"]
     port       = config["port"][0]
     whoisport  = config["whoisport"]
-    peers      = config["peers"]
+    directory  = config["peers"]      # Shared PeerDirectory snapshot for the UI
+    peers      = PeerRegistry(ttl=float(config.get("peer_ttl", DEFAULT_PEER_TTL)))  # Owned by this process
     autoreply  = config["autoreply"]
     away       = config.get("away", False)
-    img_path   = config["imagepath"]
-    os.makedirs(img_path, exist_ok=True)  # Ensure image directory exists
+    images     = BlobStore(config["imagepath"], int(config.get("image_quota", DEFAULT_IMAGE_QUOTA)))
+    data_dir   = config.get("datadir", os.path.join("data", handle))
+    os.makedirs(data_dir, exist_ok=True)
+    outbox     = Outbox(os.path.join(data_dir, "outbox.jsonl"),
+                        int(config.get("outbox_limit", DEFAULT_OUTBOX_LIMIT)),
+                        float(config.get("outbox_ttl", DEFAULT_OUTBOX_TTL)))
 
     afk_replied_to = set()  # Tracks who we've already sent AFK autoreplies to
+    timestamps     = config.get("__latency", False)  # Stamp MSG events with their receipt time
+    received_at    = 0.0    # perf_counter() when the datagrams being handled were read
+
+    use_binary = config.get("binary", True)  # Offer the binary wire format to peers
+    my_caps    = ({BINARY_CAP, RELIABLE_CAP, FRAGMENT_CAP, BATCH_CAP, TRANSFER_CAP}
+                  if use_binary else set())
+    compressed = config.get("compression", True)  # Compress long messages and image transfers
+    if use_binary and compressed:
+        my_caps.add(ZLIB_CAP)
+    text_z     = CompressionStats()      # Chat messages compressed and inflated
+    images_z   = CompressionStats() if compressed else None  # Image chunks decompressed
+    group      = config.get("group", DEFAULT_GROUP)  # "" sends messages to everyone one by one
+    channels   = ChannelIndex()          # Channel membership of every peer (and our own)
+    channels.update(handle, (c for c in config.get("channels", ()) if is_channel(c)))
+    my_id      = handle_id(handle)
+    session    = random.getrandbits(32)  # Identifies this run in reliable MSG frames
+    peer_caps  = {}                      # Handle -> capabilities we share with that peer
+    peer_names = {}                      # Handle id -> handle, rebuilt from the peer table on a miss
+    seq        = itertools.count(1)      # Sequence numbers of unreliable binary frames
+    receivers  = {}                      # Handle -> (session, ReceiveWindow) of its reliable MSGs
+    acks_due   = {}                      # Handle -> address owed an ACK at the end of this iteration
+    msg_ids    = itertools.count(1)      # Ids of fragmented outgoing messages
+    reassembly = Reassembler(int(config.get("reassembly_cap", DEFAULT_REASSEMBLY_CAP)))
 
     # Create and bind UDP socket
     udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    try:
+        udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                            int(config.get("recv_buffer", DEFAULT_RECV_BUFFER)))
+    except OSError as e:
+        print(f"[NETWORK] Could not set receive buffer size: {e}")
     udp_sock.bind(("", port))
     udp_sock.setblocking(False)
 
-    # Periodically broadcast JOIN
-    def send_periodic_join():
-        while True:
-            try:
-                msg = f"JOIN {handle} {port}".encode("utf-8")
-                udp_sock.sendto(msg, ("255.255.255.255", whoisport))
-            except Exception as e:
-                print(f"[JOIN] Error while sending: {e}")
-            time.sleep(5)
-
-    # Periodically broadcast WHO
-    def send_periodic_who():
-        while True:
-            try:
-                udp_sock.sendto(b"WHO", ("255.255.255.255", whoisport))
-            except Exception as e:
-                print(f"[WHO] Error while sending: {e}")
-            time.sleep(5)
-
-    # Start periodic broadcast threads
-    threading.Thread(target=send_periodic_join, daemon=True).start()
-    threading.Thread(target=send_periodic_who, daemon=True).start()
-
-    # Main event loop
-    while True:
-        # Handle UI commands
-        if ui2net.poll():
-            cmd, dest, payload = ui2net.recv()
-
-            if cmd == "EXIT":
-                print("[NETWORK] EXIT received. Notifying peers and shutting down.")
-                # Send LEAVE to all known peers before shutdown
-                for h, ip, pt in peers:
-                    try:
-                        udp_sock.sendto(f"LEAVE {handle}".encode("utf-8"), (ip, pt))
-                    except Exception as e:
-                        print(f"[LEAVE] Error notifying {h}: {e}")
-                break  # Exit main loop and shut down process
-
-            if cmd == "MSG":
-                # Standard SLCP message
-                header = f"MSG {handle} {dest} {payload}".encode("utf-8")
-                for h, ip, pt in peers:
-                    if h == dest:
-                        udp_sock.sendto(header, (ip, pt))
-
-            elif cmd == "IMG":
-                for h, ip, pt in peers:
-                    if h == dest:
-                        send_image_via_tcp(config, dest, payload, ip, pt)
-
-            elif cmd == "LEAVE":
-                for h, ip, pt in peers:
-                    udp_sock.sendto(f"LEAVE {handle}".encode("utf-8"), (ip, pt))
-
-            elif cmd == "AFK":
-                # AFK status toggling
-                status = payload.strip().upper()
-                away = (status == "ON")
-                config["away"] = away
-                if not away:
-                    afk_replied_to.clear()
-                print(f"[NETWORK] AFK mode {'enabled' if away else 'disabled'}.")
-
-
-        # Handle incoming UDP packets
-        try:
-            data, addr = udp_sock.recvfrom(MAX_UDP_SIZE)
-        except BlockingIOError:
-            time.sleep(0.01)
-            continue
-
+    # Reusable receive buffers, allocated once for the lifetime of the process
+    recv_pool = [memoryview(bytearray(MAX_UDP_SIZE)) for _ in range(RECV_BATCH)]
+
+    # Second socket on the shared discovery port to overhear other clients' broadcasts
+    disc_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    disc_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, "SO_REUSEPORT"):
+        disc_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    try:
+        disc_sock.bind(("", whoisport))
+        disc_sock.setblocking(False)
+    except OSError as e:
+        print(f"[NETWORK] Cannot listen on discovery port {whoisport}: {e}")
+        disc_sock.close()
+        disc_sock = None
+
+    # Receive messages to everyone: join the multicast group (broadcasts arrive anyway)
+    if use_binary and group and disc_sock is not None:
         try:
-            text = data.decode("utf-8").strip()
-        except UnicodeDecodeError:
-            continue
-
-        if not text:
-            continue
-
-        parts = text.split()
-        cmd = parts[0]
-
-        # Handle incoming chat message
-        if cmd == "MSG" and len(parts) >= 4:
-            src, dest = parts[1], parts[2]
-            msg = ' '.join(parts[3:])
-            if dest == handle:
-                net2ui.send(("MSG", src, msg))
-
-                # Auto-reply if in AFK mode
-                if away and src not in afk_replied_to:
-                    udp_sock.sendto(
-                        f"MSG {handle} {src} {autoreply}".encode("utf-8"),
-                        addr
-                    )
-                    afk_replied_to.add(src)
-
-        # Handle incoming image transfer initiation
-        elif cmd == "IMG" and len(parts) == 5:
-            src, dest, tcp_port_s, size_s = parts[1], parts[2], parts[3], parts[4]
-            if dest != handle:
-                continue
-
-            tcp_port = int(tcp_port_s)
-            size     = int(size_s)
-
-            # Connect to sender's temporary TCP server and download image
-            client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            client.connect((addr[0], tcp_port))
-
-            buf = b""
-            while len(buf) < size:
-                chunk = client.recv(4096)
-                if not chunk:
-                    break
-                buf += chunk
-            client.close()
-
-            # Save image to file and notify UI
-            fn = os.path.join(img_path, f"{src}_{int(time.time())}.png")
-            with open(fn, "wb") as f:
-                f.write(buf)
+            if socket.inet_aton(group)[0] in range(224, 240):
+                disc_sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                                     struct.pack("4s4s", socket.inet_aton(group), socket.inet_aton("0.0.0.0")))
+            my_caps.add(GROUP_CAP)
+        except OSError as e:
+            print(f"[NETWORK] Cannot join group {group}: {e}")
+
+    loop = EventLoop()
+    batcher = SendBatcher(loop, udp_sock, float(config.get("flush_delay", DEFAULT_FLUSH_DELAY)))
+
+    # Directory state (responder epoch, version) this client is in sync with
+    dir_epoch, dir_version = 0, 0
+    dir_pages = {}  # (epoch, base, version, full) -> set of page numbers received so far
+
+    # Broadcast JOIN so discovery processes (re)learn and keep us alive
+    def broadcast_join():
+        caps = ",".join(sorted(my_caps))
+        msg  = f"JOIN {handle} {port} caps={caps}" if caps else f"JOIN {handle} {port}"
+        mine = channels.channels_of(handle)
+        if mine:
+            msg += f" chans={','.join(sorted(mine))}"
+        udp_sock.sendto(msg.encode("utf-8"), ("255.255.255.255", whoisport))
+
+    # Broadcast WHO, asking only for changes since our directory state. Versioned replies are
+    # broadcast, so without the discovery port socket fall back to the classic unicast KNOWUSERS.
+    def broadcast_who():
+        msg = f"WHO {dir_epoch} {dir_version} {handle}" if disc_sock else "WHO"
+        udp_sock.sendto(msg.encode("utf-8"), ("255.255.255.255", whoisport))
+
+    ttl = peers.ttl or BROADCAST_MAX_INTERVAL
+    scheduler = DiscoveryScheduler(
+        loop, {"JOIN": broadcast_join, "WHO": broadcast_who},
+        min_interval=BROADCAST_MIN_INTERVAL,
+        max_interval={"JOIN": min(BROADCAST_MAX_INTERVAL, ttl / 3),  # Several JOINs per TTL
+                      "WHO":  BROADCAST_MAX_INTERVAL})
+
+    # Long-lived TCP listener for image offers and keep-alive connections to peers
+    tcp_server = TransferServer(config["port"][1] if len(config["port"]) > 1 else 0)
+    tcp_server.start()
+    tcp_pool = ConnectionPool()
+
+    # Close pooled connections that have not been used for a while, withdraw stale offers
+    def reap_idle_connections():
+        tcp_pool.close_idle()
+        tcp_server.expire_offers()
+        images.expire_parts(OFFER_TIMEOUT)  # Downloads nobody offered again in time
+        loop.call_later(tcp_pool.idle_timeout / 2, reap_idle_connections)
+
+    downloads = TransferScheduler(
+        max_active=int(config.get("download_workers", DEFAULT_MAX_ACTIVE)),
+        max_per_peer=int(config.get("downloads_per_peer", DEFAULT_MAX_PER_PEER)))
+
+    # Queue an image download on the transfer scheduler, the loop keeps serving chat traffic.
+    # Without a transfer id the sender predates `xfer1` and streams the image once.
+    def start_download(src, ip, tcp_port, size, xfer_id=None):
+        if xfer_id is None:
+            run = lambda cancelled: download_once(src, ip, tcp_port, size, images, cancelled)
+        else:
+            run = lambda cancelled: download_image(tcp_pool, src, ip, tcp_port, size, xfer_id,
+                                                   images, cancelled, images_z)
+        job = downloads.submit(
+            src, size, run,
+            lambda job_id, fn, error: loop.call_soon_threadsafe(
+                lambda: finish_download(job_id, src, fn, error)))
+        if job is None:
+            print(f"[IMG] Too many pending downloads, dropping image from {src}")
+        else:
+            print(f"[IMG] Download #{job} from {src} queued ({size} bytes).")
+
+    # Runs on the loop thread once a download has finished, failed or was cancelled
+    def finish_download(job_id, src, fn, error):
+        if isinstance(error, TransferCancelled):
+            print(f"[IMG] Download #{job_id} from {src} cancelled.")
+        elif error is not None:
+            print(f"[IMG] Download #{job_id} from {src} failed: {error}")
+        else:
             net2ui.send(("IMG", src, fn))
 
-        # Handle LEAVE notifications
-        elif cmd == "LEAVE" and len(parts) == 2:
-            leaver = parts[1]
-            net2ui.send(("LEAVE", leaver, ""))
-            peers[:] = [p for p in peers if p[0] != leaver]
-
-        # Handle KNOWUSERS message to update peer list
-        elif cmd == "KNOWUSERS":
-            rest = text[len("KNOWUSERS "):]
-            for chunk in rest.split(','):
-                if not chunk.strip():
-                    continue
+    # Send one binary frame, batched with others for the same peer if it accepts that
+    def send_frame(dest, addr, frame):
+        if BATCH_CAP in peer_caps.get(dest, ()):
+            batcher.send(frame, addr)
+        else:
+            udp_sock.sendto(frame, addr)
+
+    # Send to a peer in the best format it understands
+    def send_to_peer(dest, addr, text, opcode, payload=b""):
+        if BINARY_CAP in peer_caps.get(dest, ()):
+            send_frame(dest, addr, encode(opcode, next(seq), handle, dest, payload))
+        else:
+            udp_sock.sendto(text.encode("utf-8"), addr)
+
+    # Put one reliable MSG frame on the wire (called by the ReliableSender, also for retries)
+    def transmit_reliable(dest, seq_no, base, message):
+        flags, body = message
+        addr = peers.get(dest)
+        if addr:
+            send_frame(dest, addr, encode(OP_MSG, seq_no, handle, dest,
+                                          RELIABLE.pack(session, base) + body, FLAG_RELIABLE | flags))
+
+    # Report the outcome of a chat message the user sent; autoreplies carry no tag
+    def message_delivered(dest, text):
+        if text is not None:
+            net2ui.send(("DELIVERED", dest, text))
+
+    def message_failed(dest, text):
+        if text is not None:
+            net2ui.send(("FAILED", dest, text))
+
+    reliable = ReliableSender(loop, transmit_reliable, message_delivered, message_failed)
+
+    # Send a chat message, reliably if the peer acknowledges messages
+    # @param tag     Text reported back to the UI with DELIVERED/FAILED, or None for no report.
+    # @param addr    Address to use if the peer is not (or no longer) in the peer table.
+    # @param channel Channel the message is posted to, or None for a direct message.
+    def send_chat(dest, text, tag, addr=None, channel=None):
+        addr  = peers.get(dest) or addr
+        caps  = peer_caps.get(dest, ())
+        data  = text.encode("utf-8")
+        flags = 0
+        if addr is None:
+            message_failed(dest, tag)
+            return
+        if channel is not None:
+            data   = channel_payload(channel, data)
+            flags |= FLAG_CHANNEL
+        if (ZLIB_CAP in caps and MIN_TEXT_SIZE <= len(data) <= FRAGMENT_SIZE * MAX_FRAGMENTS):
+            started = time.thread_time()
+            packed  = compress(CODEC_ZLIB, data)
+            if len(packed) <= len(data) * MAX_RATIO:
+                text_z.add(len(data), len(packed), started)
+                data   = packed
+                flags |= FLAG_COMPRESSED
+
+        # Split large messages into fragments that each fit into one Ethernet frame
+        parts = [data]
+        if len(data) > FRAGMENT_SIZE and FRAGMENT_CAP in caps:
+            pieces = split(data)
+            if len(pieces) > MAX_FRAGMENTS:
+                print(f"[MSG] Message to {dest} is too large ({len(data)} bytes).")
+                message_failed(dest, tag)
+                return
+            msg_id = next(msg_ids) & 0xFFFFFFFF
+            flags |= FLAG_FRAGMENT
+            parts  = [FRAGMENT.pack(msg_id, i, len(pieces)) + p for i, p in enumerate(pieces)]
+
+        try:
+            if RELIABLE_CAP in caps:
+                reliable.send_group(dest, [(flags, p) for p in parts], tag)
+            elif BINARY_CAP in caps:
+                for p in parts:
+                    send_frame(dest, addr, encode(OP_MSG, next(seq), handle, dest, p, flags))
+            elif channel is not None:
+                udp_sock.sendto(f"CMSG {handle} {channel} {dest} {text}".encode("utf-8"), addr)
+            else:
+                udp_sock.sendto(f"MSG {handle} {dest} {text}".encode("utf-8"), addr)
+        except OSError as e:
+            print(f"[MSG] Cannot send to {dest}: {e}")
+            message_failed(dest, tag)
+
+    # Send a chat message to every peer: once to the group, one by one to everyone else
+    def send_to_all(text):
+        data    = text.encode("utf-8")
+        targets = [h for h, _, _ in peers]
+        members = {h for h in targets if GROUP_CAP in peer_caps.get(h, ())}
+        if members and len(data) <= FRAGMENT_SIZE:
+            try:
+                udp_sock.sendto(encode(OP_MSG, next(seq), handle, "", data), (group, whoisport))
+                targets = [h for h in targets if h not in members]
+            except OSError as e:
+                print(f"[MSG] Cannot send to group {group}: {e}")
+        for h in targets:
+            send_chat(h, text, None)
+
+    # Post a message to a channel we are in: one (batched) send per member
+    def send_to_channel(channel, text):
+        if channel not in channels.channels_of(handle):
+            print(f"[CHANNEL] Not in {channel}, join it first.")
+            message_failed(channel, text)
+            return
+        for member in channels.members(channel):
+            if member != handle:
+                send_chat(member, text, None, channel=channel)
+
+    # Join or part a channel and announce the new list right away
+    def change_channel(channel, action):
+        mine = channels.channels_of(handle)
+        if not is_channel(channel):
+            print(f"[CHANNEL] Invalid channel name {channel!r}.")
+            return
+        if channels.update(handle, (mine | {channel}) if action == "JOIN" else (mine - {channel})):
+            broadcast_join()
+            scheduler.reset("JOIN")  # Repeat it soon in case the broadcast was lost
+            print(f"[CHANNEL] {'Joined' if action == 'JOIN' else 'Left'} {channel}.")
+
+    # Offer an image to a peer in the peer table
+    def send_image(dest, path):
+        addr = peers.get(dest)
+        caps = peer_caps.get(dest, ())
+        try:
+            if TRANSFER_CAP in caps:
+                send_image_via_tcp(config, tcp_server, udp_sock, dest, path, *addr,
+                                   seq=next(seq) if BINARY_CAP in caps else None)
+            else:
+                send_image_once(config, udp_sock, dest, path, *addr)
+        except OSError as e:
+            print(f"[IMG] Cannot send {path} to {dest}: {e}")
+
+    # Keep a message for a peer we cannot reach right now
+    def queue_for_later(dest, kind, payload):
+        if outbox.add(dest, kind, payload):
+            net2ui.send(("QUEUED", dest, payload))
+        else:
+            print(f"[OUTBOX] Queue for {dest} is full.")
+            message_failed(dest, payload)
+
+    # A peer (re)appeared in the peer table: tell the UI and send everything queued for it
+    def peer_joined(h):
+        ip, pt = peers.get(h)
+        net2ui.send(("JOIN", h, f"{ip}:{pt}"))
+        flush_outbox(h)
+
+    # Send everything queued for a peer
+    def flush_outbox(h):
+        for kind, payload in outbox.take(h):
+            if kind == "MSG":
+                send_chat(h, payload, payload)
+            else:
+                send_image(h, payload)
+
+    # Forget everything we know about a peer that left or timed out
+    def forget_peer(h):
+        peer_caps.pop(h, None)
+        channels.drop(h)
+        receivers.pop(h, None)
+        reassembly.drop_peer(h)
+        reliable.drop(h)  # Pending messages are reported as FAILED
+        downloads.cancel_peer(h)
+
+    # Handle one command from the UI; returns False once the process is shutting down
+    def handle_ui_command():
+        nonlocal away
+        try:
+            cmd, dest, payload = ui2net.recv()
+        except EOFError:
+            # UI side is gone, treat it like EXIT so the loop does not spin on a dead pipe
+            cmd, dest, payload = "EXIT", "", ""
+
+        if cmd == "EXIT":
+            print("[NETWORK] EXIT received. Notifying peers and shutting down.")
+            # Send LEAVE to all known peers before shutdown
+            for h, ip, pt in peers:
                 try:
-                    h, ip, pt = chunk.strip().split()
-                    entry = (h, ip, int(pt))
-                    if h != handle and entry not in peers:
-                        peers.append(entry)
-                        print(f"[KNOWUSERS] New peer: {entry}")
-                except ValueError:
-                    continue
-
-        time.sleep(0.01)
\ No newline at end of file
+                    send_to_peer(h, (ip, pt), f"LEAVE {handle}", OP_LEAVE)
+                except Exception as e:
+                    print(f"[LEAVE] Error notifying {h}: {e}")
+            loop.stop()  # Exit main loop and shut down process
+            return False
+
+        if cmd == "MSG" and dest == EVERYONE:
+            send_to_all(payload)
+
+        elif cmd == "MSG" and dest.startswith("#"):
+            send_to_channel(dest, payload)
+
+        elif cmd in ("MSG", "IMG") and peers.get(dest) is None:
+            queue_for_later(dest, cmd, payload)
+
+        elif cmd == "MSG":
+            # Standard SLCP message
+            send_chat(dest, payload, payload)
+
+        elif cmd == "IMG":
+            send_image(dest, payload)
+
+        elif cmd == "LEAVE":
+            for h, ip, pt in peers:
+                send_to_peer(h, (ip, pt), f"LEAVE {handle}", OP_LEAVE)
+
+        elif cmd == "CHANNEL" and payload == "LIST":
+            mine = ", ".join(sorted(channels.channels_of(handle))) or "none"
+            net2ui.send(("CHANNELS", "", f"joined {mine}; {channels.describe() or 'no channels'}"))
+
+        elif cmd == "CHANNEL" and payload in ("JOIN", "PART"):
+            change_channel(dest, payload)
+
+        elif cmd == "STATS":
+            net2ui.send(("STATS", "discovery", scheduler.stats()))
+            net2ui.send(("STATS", "batching", batcher.stats()))
+            net2ui.send(("STATS", "outbox", outbox.stats()))
+            net2ui.send(("STATS", "transfers", downloads.stats()))
+            net2ui.send(("STATS", "images", images.stats()))
+            net2ui.send(("STATS", "compression",
+                         f"messages {text_z.describe()}; images sent "
+                         f"{tcp_server.compression.describe()}, received "
+                         f"{images_z.describe() if images_z else 'uncompressed'}"))
+            net2ui.send(("STATS", "delivery",
+                         f"{reliable.stats()}; fragments refused {reassembly.rejected}, "
+                         f"incomplete messages expired {reassembly.expired}"))
+
+        elif cmd == "CANCEL":
+            # Cancel one image download by job id ("#3"), or all of them from a peer
+            if dest[:1] == "#" and dest[1:].isdigit():
+                if not downloads.cancel(int(dest[1:])):
+                    print(f"[IMG] No download {dest}.")
+            else:
+                print(f"[IMG] Cancelled {downloads.cancel_peer(dest)} download(s) from {dest}.")
+
+        elif cmd == "AFK":
+            # AFK status toggling
+            status = payload.strip().upper()
+            away = (status == "ON")
+            config["away"] = away
+            if not away:
+                afk_replied_to.clear()
+            print(f"[NETWORK] AFK mode {'enabled' if away else 'disabled'}.")
+        return True
+
+    # Handle every command the UI queued (up to UI_BATCH), so a burst leaves in few datagrams
+    def handle_ui_commands():
+        for _ in range(UI_BATCH):
+            if not handle_ui_command() or not ui2net.poll():
+                return
+
+    # Drain every pending datagram, then dispatch them in arrival order
+    def handle_udp():
+        nonlocal received_at
+        batch       = drain_datagrams(udp_sock, recv_pool)
+        received_at = time.perf_counter()
+        for data, addr in batch:
+            handle_datagram(data, addr)
+
+    # Same for broadcasts overheard on the discovery port
+    def handle_discovery_udp():
+        nonlocal received_at
+        batch       = drain_datagrams(disc_sock, recv_pool)
+        received_at = time.perf_counter()
+        for data, addr in batch:
+            handle_datagram(data, addr)
+
+    # Send a message event to the UI, with its receipt time if the UI measures latency
+    def deliver(event):
+        net2ui.send(event + (received_at,) if timestamps else event)
+
+    # A chat message addressed to us arrived (text or binary)
+    def on_message(src, msg, addr):
+        deliver(("MSG", src, msg))
+
+        # Auto-reply if in AFK mode
+        if away and src not in afk_replied_to:
+            send_chat(src, autoreply, None, addr)
+            afk_replied_to.add(src)
+
+    # A message to one of our channels arrived; drop it if we already left the channel
+    def on_channel_message(src, channel, msg):
+        if channel in channels.channels_of(handle):
+            deliver(("CHANMSG", channel, (src, msg)))
+
+    # A peer announced that it leaves
+    def on_leave(leaver):
+        forget_peer(leaver)
+        if peers.remove(leaver):
+            directory.publish(peers)
+        net2ui.send(("LEAVE", leaver, ""))
+
+    # Binary MSG frame; reliable ones are acknowledged and delivered only once
+    def on_frame_msg(src, frame, addr):
+        peers.touch(src)
+        if frame.dst_id != my_id and (frame.dst_id or frame.flags or GROUP_CAP not in my_caps):
+            return  # Neither for us nor a message to everyone we announced to receive
+        payload = frame.payload
+        offset  = RELIABLE.size if frame.flags & FLAG_RELIABLE else 0
+        if frame.flags & FLAG_FRAGMENT:
+            if len(payload) < offset + FRAGMENT.size:
+                return
+            fragment = FRAGMENT.unpack_from(payload, offset)
+        if frame.flags & FLAG_RELIABLE:
+            if len(payload) < RELIABLE.size:
+                return
+            peer_session, base = RELIABLE.unpack_from(payload)
+            rx = receivers.get(src)
+            if rx is None or rx[0] != peer_session:
+                rx = receivers[src] = (peer_session, ReceiveWindow())  # New peer or restarted
+            window = rx[1]
+            if (frame.flags & FLAG_FRAGMENT and not window.seen(frame.seq) and
+                    not reassembly.admits(src, fragment[2], len(payload) - offset - FRAGMENT.size)):
+                return  # No room: leave it unacknowledged so the sender retries later
+            new = window.accept(frame.seq, base)
+            if not acks_due:
+                loop.call_later(0, send_acks)
+            acks_due[src] = addr
+            if not new:
+                return  # Duplicate, our earlier ACK was lost
+        if frame.flags & FLAG_FRAGMENT:
+            msg_id, index, count = fragment
+            payload = reassembly.add(src, msg_id, index, count,
+                                     bytes(payload[offset + FRAGMENT.size:]))
+            if payload is None:
+                return  # Waiting for more fragments
+        else:
+            payload = payload[offset:]
+        if frame.flags & FLAG_COMPRESSED:
+            started = time.thread_time()
+            wire    = len(payload)
+            payload = inflate(payload, FRAGMENT_SIZE * MAX_FRAGMENTS)
+            if payload is None:
+                print(f"[MSG] Dropping malformed compressed message from {src}.")
+                return
+            text_z.add(len(payload), wire, started)
+        if frame.flags & FLAG_CHANNEL:
+            posted = parse_channel_payload(payload)
+            if posted is not None:
+                on_channel_message(src, posted[0], str(posted[1], "utf-8", "replace"))
+            return
+        on_message(src, str(payload, "utf-8", "replace"), addr)
+
+    # Acknowledge everything received from each peer during this loop iteration at once
+    def send_acks():
+        for src, addr in acks_due.items():
+            rx = receivers.get(src)
+            if rx is not None:
+                session_id, window = rx
+                send_frame(src, addr, encode(OP_ACK, window.cumulative, handle, src,
+                                             ack_payload(session_id, window.sacks())))
+        acks_due.clear()
+
+    # Binary ACK for our reliable messages
+    def on_frame_ack(src, frame, addr):
+        ack = parse_ack_payload(frame.payload)
+        if frame.dst_id == my_id and ack is not None and ack[0] == session:
+            reliable.on_ack(src, frame.seq, ack[1])
+
+    # Binary IMG notice
+    def on_frame_img(src, frame, addr):
+        if frame.dst_id == my_id and len(frame.payload) == IMG_OFFER.size:
+            tcp_port, size, xfer_id = IMG_OFFER.unpack(frame.payload)
+            start_download(src, addr[0], tcp_port, size, xfer_id)
+
+    # Binary LEAVE notice
+    def on_frame_leave(src, frame, addr):
+        on_leave(src)
+
+    frame_handlers = {
+        OP_MSG:   on_frame_msg,
+        OP_IMG:   on_frame_img,
+        OP_LEAVE: on_frame_leave,
+        OP_ACK:   on_frame_ack,
+    }
+
+    # Handle one binary frame
+    def handle_frame(frame, addr):
+        src = peer_names.get(frame.src_id)
+        if src is None:
+            peer_names.clear()
+            peer_names.update((handle_id(h), h) for h, _, _ in peers)
+            src = peer_names.get(frame.src_id)
+            if src is None:
+                return  # Sender is not in our peer table, we cannot name it
+        if use_binary:
+            peer_caps.setdefault(src, set()).add(BINARY_CAP)  # It speaks binary, so answer in binary
+        handler = frame_handlers.get(frame.opcode)
+        if handler is not None:
+            handler(src, frame, addr)
+
+    # Incoming chat message
+    def on_text_msg(fields, addr):
+        src, dest, msg = fields
+        peers.touch(src)
+        if dest == handle:
+            on_message(src, msg, addr)
+
+    # Incoming channel message from a text-only peer
+    def on_text_cmsg(fields, addr):
+        src, channel, dest, msg = fields
+        peers.touch(src)
+        if dest == handle:
+            on_channel_message(src, channel, msg)
+
+    # Incoming image transfer initiation
+    def on_text_img(fields, addr):
+        src, dest, tcp_port, size, extra = fields
+        if dest != handle:
+            return
+        if not extra:
+            start_download(src, addr[0], tcp_port, size)  # Sender without xfer1
+            return
+        xfer_id = parse_fields(extra, "i")
+        if xfer_id is not None:
+            start_download(src, addr[0], tcp_port, size, xfer_id[0])
+
+    # LEAVE notification
+    def on_text_leave(fields, addr):
+        on_leave(fields[0])
+
+    # Classic directory reply: add every listed peer
+    def on_knowusers(fields, addr):
+        changed = False
+        for h, ip, pt in parse_knowusers(fields[0]):
+            if h != handle and peers.add(h, ip, pt):
+                changed = True
+                peer_joined(h)
+                print(f"[KNOWUSERS] New peer: {(h, ip, pt)}")
+        if changed:
+            directory.publish(peers)
+
+    # Another client's JOIN broadcast: learn about it and its capabilities right away
+    def on_join(fields, addr):
+        h, pt, extra = fields
+        if h == handle:
+            return
+        peer_caps[h] = parse_caps(extra) & my_caps
+        channels.update(h, parse_channels(extra))
+        if peers.add(h, addr[0], pt):
+            directory.publish(peers)
+            peer_joined(h)
+            scheduler.reset("WHO")  # The directory is about to change, resync soon
+
+    # Heartbeat of the WHO responder: a different epoch means a new responder took over
+    def on_responder(fields, addr):
+        if fields[1] != dir_epoch:
+            scheduler.reset("WHO")
+
+    # Another client's WHO: if it asks for our state, its reply serves us as well
+    def on_who(fields, addr):
+        state = parse_fields(fields[0], "ii*")
+        if state is None:
+            return  # Legacy WHO, answered with a unicast KNOWUSERS
+        if state[2] == handle:
+            return  # Our own broadcast
+        if state[:2] == (dir_epoch, dir_version):
+            scheduler.heard("WHO")
+        elif state[0] == dir_epoch and state[1] > dir_version:
+            scheduler.reset("WHO")  # Someone is ahead of us
+
+    # Apply one page of a versioned directory reply
+    def on_knowdelta(fields, addr):
+        nonlocal dir_epoch, dir_version
+        epoch, base, version, page, pages, full, entries = fields
+
+        # A delta for a state newer than ours would skip changes; wait for our own reply
+        usable = full or (epoch == dir_epoch and base <= dir_version)
+        if not usable:
+            scheduler.reset("WHO")
+            return
+        if not full and version <= dir_version:
+            # Nothing new for us, but the responder vouches that our view is still current
+            scheduler.heard("WHO")
+            for h, _, _ in peers:
+                peers.touch(h)
+            return
+
+        changed = False
+        for h, peer_addr in parse_delta(entries):
+            if h == handle:
+                continue
+            if peer_addr is not None:
+                if peers.add(h, *peer_addr):
+                    changed = True
+                    peer_joined(h)
+                    print(f"[KNOWDELTA] New peer: {(h, *peer_addr)}")
+            elif peers.remove(h):
+                forget_peer(h)
+                changed = True
+                net2ui.send(("LEAVE", h, ""))
+        if changed:
+            directory.publish(peers)
+
+        # Adopt the new directory state once every page of the reply has arrived
+        reply = (epoch, base, version, full)
+        if reply not in dir_pages and len(dir_pages) >= 8:
+            dir_pages.clear()  # Forget replies whose pages were lost
+        received = dir_pages.setdefault(reply, set())
+        received.add(page)
+        if len(received) >= pages:
+            del dir_pages[reply]
+            dir_epoch, dir_version = epoch, version
+            scheduler.heard("WHO")
+            if not full:
+                # The responder vouches that everyone else in our view is still alive
+                for h, _, _ in peers:
+                    peers.touch(h)
+
+    # Text command -> handler(fields, addr); fields are already validated by parse_text()
+    text_handlers = {
+        "MSG":       on_text_msg,
+        "CMSG":      on_text_cmsg,
+        "IMG":       on_text_img,
+        "LEAVE":     on_text_leave,
+        "KNOWUSERS": on_knowusers,
+        "KNOWDELTA": on_knowdelta,
+        "JOIN":      on_join,
+        "RESPONDER": on_responder,
+        "WHO":       on_who,
+    }
+
+    # Handle a single incoming UDP packet
+    def handle_datagram(data, addr):
+        if is_binary(data):
+            for frame in decode_all(data):  # One frame, or several from a batching peer
+                handle_frame(frame, addr)
+            return
+        parsed = parse_text(data)
+        if parsed is None:
+            return  # Malformed or unknown command
+        handler = text_handlers.get(parsed[0])
+        if handler is not None:
+            handler(parsed[1], addr)
+
+    # Apply a peer delta forwarded by the discovery process
+    def handle_discovery_delta():
+        try:
+            cmd, h, addr = from_discovery.recv()
+        except EOFError:
+            loop.remove_reader(from_discovery)
+            return
+        if h == handle:
+            return
+        if cmd == "JOIN":
+            if peers.add(h, *addr):
+                directory.publish(peers)
+                peer_joined(h)
+        elif cmd == "LEAVE":
+            # Discovery dropped the peer (LEAVE or TTL expiry), tell the UI as well
+            forget_peer(h)
+            if peers.remove(h):
+                directory.publish(peers)
+                net2ui.send(("LEAVE", h, ""))
+
+    # Drop peers that have not been heard from within the TTL
+    def sweep_expired_peers():
+        expired = peers.expire()
+        if expired:
+            directory.publish(peers)
+            for h in expired:
+                forget_peer(h)
+                print(f"[NETWORK] Peer {h} timed out.")
+                net2ui.send(("LEAVE", h, ""))
+        reassembly.expire()  # Incomplete fragmented messages that will not be completed
+        for dest, kind, payload in outbox.expire():
+            print(f"[OUTBOX] Gave up {kind} to {dest}: not seen within {outbox.ttl:.0f}s.")
+            message_failed(dest, payload)
+        loop.call_later(SWEEP_TICK, sweep_expired_peers)
+
+    loop.add_reader(ui2net, handle_ui_commands)
+    loop.add_reader(udp_sock, handle_udp)
+    if disc_sock is not None:
+        loop.add_reader(disc_sock, handle_discovery_udp)
+    if from_discovery is not None:
+        loop.add_reader(from_discovery, handle_discovery_delta)
+
+    # Start periodic broadcasts
+    scheduler.start()
+    reap_idle_connections()
+    sweep_expired_peers()
+
+    # Main event loop: blocks until a socket/pipe is ready or a timer is due
+    try:
+        loop.run()
+    finally:
+        batcher.flush()  # e.g. the LEAVE notices sent on EXIT
+        outbox.close()
+        downloads.shutdown()
+        images.close()
+        tcp_server.close()
+        tcp_pool.close()
+        loop.close()
+        udp_sock.close()
+        if disc_sock is not None:
+            disc_sock.close()
@@ -0,0 +1,149 @@
+##
+# @file outbox.py
+# @brief Persistent store-and-forward queue for messages to peers that are not reachable.
+#
+# A message or image addressed to a handle that is not in the peer table (it has not been
+# discovered yet, or briefly dropped out) is queued here instead of being lost. The queue
+# is kept in an append-only file of JSON lines in the client's data directory, so it also
+# survives a restart:
+#
+#   {"id": 7, "dest": "Bob", "kind": "MSG", "payload": "hi", "time": 1718000000.0}
+#   {"done": [7, 8]}
+#
+# The first form queues an entry, the second removes entries that were handed to the
+# network or expired. On open the file is replayed; once it holds mostly removed entries it
+# is rewritten with only the live ones. A torn last line from a crash is skipped.
+#
+# Each peer may have at most `limit` queued entries, and entries older than `ttl` seconds
+# are given up.
+#
+# @author SLCP Team
+# @date June 2025
+#
+
+import json
+import os
+import time
+
+DEFAULT_OUTBOX_LIMIT = 100     # Queued entries per peer
+DEFAULT_OUTBOX_TTL   = 3600.0  # Seconds before a queued entry is given up
+COMPACT_MIN_LINES    = 1000    # Dead lines tolerated before the file is rewritten
+
+##
+# @class Outbox
+# @brief Per-peer FIFO queues backed by an append-only file.
+class Outbox:
+    ##
+    # @param path  File the queue is kept in (created if missing).
+    # @param limit Queued entries per peer.
+    # @param ttl   Seconds after which a queued entry expires.
+    def __init__(self, path, limit=DEFAULT_OUTBOX_LIMIT, ttl=DEFAULT_OUTBOX_TTL):
+        self.path    = path
+        self.limit   = limit
+        self.ttl     = ttl
+        self._queues = {}  # dest -> {id: entry dict}, oldest first
+        self._next   = 1
+        self._lines  = 0   # Lines in the file
+        self._replay()
+        if self._lines - len(self) > len(self):
+            self._compact()
+        else:
+            self._file = open(self.path, "a", encoding="utf-8")
+
+    def __len__(self):
+        return sum(len(q) for q in self._queues.values())
+
+    ##
+    # @brief Queues a message for `dest`.
+    # @param kind    "MSG" or "IMG".
+    # @param payload Message text or image path.
+    # @return False if the peer's queue is full.
+    def add(self, dest, kind, payload, now=None):
+        queue = self._queues.setdefault(dest, {})
+        if len(queue) >= self.limit:
+            return False
+        entry = {"id": self._next, "dest": dest, "kind": kind, "payload": payload,
+                 "time": time.time() if now is None else now}
+        self._next += 1
+        queue[entry["id"]] = entry
+        self._append(entry)
+        return True
+
+    ##
+    # @brief Removes and returns everything queued for `dest`, oldest first.
+    # @return List of (kind, payload) tuples.
+    def take(self, dest):
+        queue = self._queues.pop(dest, None)
+        if not queue:
+            return []
+        self._append({"done": list(queue)})
+        return [(e["kind"], e["payload"]) for e in queue.values()]
+
+    ##
+    # @brief Removes entries older than the TTL.
+    # @return List of (dest, kind, payload) tuples that expired.
+    def expire(self, now=None):
+        cutoff  = (time.time() if now is None else now) - self.ttl
+        expired = []
+        for dest, queue in list(self._queues.items()):
+            for entry in [e for e in queue.values() if e["time"] < cutoff]:
+                del queue[entry["id"]]
+                expired.append(entry)
+            if not queue:
+                del self._queues[dest]
+        if expired:
+            self._append({"done": [e["id"] for e in expired]})
+        return [(e["dest"], e["kind"], e["payload"]) for e in expired]
+
+    ##
+    # @brief Returns the queue counters as a human-readable line.
+    def stats(self):
+        per_peer = ", ".join(f"{d} {len(q)}" for d, q in self._queues.items())
+        return f"queued {len(self)}" + (f" ({per_peer})" if per_peer else "")
+
+    def close(self):
+        self._file.close()
+
+    ##
+    # @brief Rebuilds the queues from the file.
+    def _replay(self):
+        try:
+            f = open(self.path, encoding="utf-8")
+        except FileNotFoundError:
+            return
+        entries = {}
+        with f:
+            for line in f:
+                self._lines += 1
+                try:
+                    record = json.loads(line)
+                    if "done" in record:
+                        for entry_id in record["done"]:
+                            entries.pop(entry_id, None)
+                    else:
+                        entries[record["id"]] = record
+                        self._next = max(self._next, record["id"] + 1)
+                except (ValueError, KeyError, TypeError):
+                    continue  # Torn or foreign line
+        for entry_id, entry in entries.items():
+            self._queues.setdefault(entry["dest"], {})[entry_id] = entry
+
+    def _append(self, record):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        self._lines += 1
+        if self._lines >= COMPACT_MIN_LINES and self._lines - len(self) > len(self):
+            self._file.close()
+            self._compact()
+
+    ##
+    # @brief Rewrites the file with only the live entries and reopens it for appending.
+    def _compact(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for queue in self._queues.values():
+                for entry in queue.values():
+                    f.write(json.dumps(entry) + "\n")
+        os.replace(tmp, self.path)
+        self._lines = len(self)
+        self._file  = open(self.path, "a", encoding="utf-8")
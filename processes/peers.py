@@ -0,0 +1,249 @@
+##
+# @file peers.py
+# @brief Peer registry and shared peer snapshot for SLCP processes.
+#
+# The network process owns the authoritative PeerRegistry, a dictionary keyed by handle
+# with O(1) lookup. The discovery process keeps its own registry and forwards changes to
+# the network process as deltas over a pipe.
+#
+# After every change the owner publishes the registry into a PeerDirectory, a versioned
+# snapshot kept in shared memory. Readers (CLI, GUI) compare the version counter with the
+# one they last saw and only decode the snapshot when it has changed, so looking at the
+# peer list never needs a round trip to a manager process.
+#
+# Peers carry a last-seen timestamp. When a TTL is configured the registry keeps every peer
+# in a TimingWheel, so expiring the ones that have not been heard from costs O(1) per tick
+# instead of a scan over all peers.
+#
+# A registry can also keep a bounded change log, which lets the WHO responder answer a
+# client with only the changes since the directory version that client last saw.
+#
+# @author SLCP Team
+# @date June 2025
+#
+
+import collections
+import ctypes
+import math
+import multiprocessing
+import time
+
+DEFAULT_DIRECTORY_CAPACITY = 256 * 1024  # Bytes of shared memory for the peer snapshot
+DEFAULT_PEER_TTL           = 30          # Seconds without traffic before a peer expires
+SWEEP_TICK                 = 1.0         # Resolution of the expiry timing wheel in seconds
+DEFAULT_HISTORY            = 1024        # Changes remembered for delta directory replies
+
+##
+# @class TimingWheel
+# @brief Hashed timing wheel for expiring keys with O(1) schedule, cancel and tick.
+#
+# Time is divided into ticks of `tick` seconds; each tick maps to one slot of a ring that is
+# large enough for the longest delay (`horizon`). Scheduling a key puts it into the slot of
+# its deadline tick, and advancing the wheel only visits the slots of the ticks that passed.
+class TimingWheel:
+    ##
+    # @param tick    Slot width in seconds.
+    # @param horizon Longest delay that will ever be scheduled, in seconds.
+    def __init__(self, tick, horizon):
+        self.tick    = tick
+        self._slots  = [set() for _ in range(int(math.ceil(horizon / tick)) + 2)]
+        self._where  = {}   # key -> slot index
+        self._cursor = int(time.monotonic() // tick)
+
+    ##
+    # @brief Schedules (or reschedules) `key` to expire `delay` seconds after `now`.
+    def schedule(self, key, delay, now=None):
+        now = time.monotonic() if now is None else now
+        ticks = min(int(math.ceil((now + delay) / self.tick)) - self._cursor, len(self._slots) - 1)
+        slot  = (self._cursor + max(ticks, 1)) % len(self._slots)
+        self.cancel(key)
+        self._slots[slot].add(key)
+        self._where[key] = slot
+
+    ##
+    # @brief Removes `key` from the wheel if it is scheduled.
+    def cancel(self, key):
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            self._slots[slot].discard(key)
+
+    ##
+    # @brief Moves the wheel forward to `now`.
+    # @return List of keys whose deadline has passed.
+    def advance(self, now=None):
+        now = time.monotonic() if now is None else now
+        target  = int(now // self.tick)
+        steps   = min(target - self._cursor, len(self._slots))
+        expired = []
+        for i in range(1, steps + 1):
+            slot = self._slots[(self._cursor + i) % len(self._slots)]
+            for key in slot:
+                del self._where[key]
+            expired += slot
+            slot.clear()
+        self._cursor = max(self._cursor, target)
+        return expired
+
+##
+# @class PeerRegistry
+# @brief In-process map of handle → (ip, port) with a change counter and optional TTL.
+#
+# Iterating yields `(handle, ip, port)` tuples, the same shape the old shared list used.
+class PeerRegistry:
+    ##
+    # @param ttl     Seconds without being seen after which expire() drops a peer, or None to
+    #                keep peers until they are removed explicitly.
+    # @param history Number of changes to remember for changes_since(), 0 to keep none.
+    def __init__(self, ttl=None, history=0):
+        self._peers    = {}   # handle -> (ip, port)
+        self.last_seen = {}   # handle -> time.monotonic() of the last sign of life
+        self.version   = 0    # Incremented on every change
+        self.ttl       = ttl
+        self._wheel    = TimingWheel(SWEEP_TICK, ttl) if ttl else None
+        self._log      = collections.deque(maxlen=history) if history else None  # (version, handle, addr|None)
+
+    ##
+    # @brief Adds or updates a peer.
+    # @param refresh Whether to count this as a sign of life for an already known peer.
+    # @return True if the registry changed.
+    def add(self, handle, ip, port, refresh=True):
+        addr  = (ip, port)
+        known = self._peers.get(handle)
+        self._peers[handle] = addr
+        if known is None or refresh:
+            self.touch(handle)
+        if known == addr:
+            return False
+        self._changed(handle, addr)
+        return True
+
+    ##
+    # @brief Records that a known peer has just been heard from. Unknown handles are ignored.
+    def touch(self, handle):
+        if handle not in self._peers:
+            return
+        now = time.monotonic()
+        self.last_seen[handle] = now
+        if self._wheel:
+            self._wheel.schedule(handle, self.ttl, now)
+
+    ##
+    # @brief Removes a peer.
+    # @return True if the peer was known.
+    def remove(self, handle):
+        self.last_seen.pop(handle, None)
+        if self._wheel:
+            self._wheel.cancel(handle)
+        if self._peers.pop(handle, None) is None:
+            return False
+        self._changed(handle, None)
+        return True
+
+    def _changed(self, handle, addr):
+        self.version += 1
+        if self._log is not None:
+            self._log.append((self.version, handle, addr))
+
+    ##
+    # @brief Collects what changed after directory version `since`.
+    # @return Dict handle → (ip, port) for added/updated peers and handle → None for removed
+    #         ones, or None if the change log does not reach back far enough (send everything).
+    def changes_since(self, since):
+        if since == self.version:
+            return {}
+        if self._log is None or since > self.version:
+            return None
+        if not self._log or self._log[0][0] > since + 1:
+            return None
+        changes = {}
+        for version, handle, addr in self._log:
+            if version > since:
+                changes[handle] = addr
+        return changes
+
+    ##
+    # @brief Drops every peer whose TTL has run out.
+    # @return List of expired handles.
+    def expire(self, now=None):
+        if not self._wheel:
+            return []
+        expired = [h for h in self._wheel.advance(now) if h in self._peers]
+        for h in expired:
+            self.remove(h)
+        return expired
+
+    ##
+    # @brief Returns the (ip, port) of a peer, or None if unknown.
+    def get(self, handle):
+        return self._peers.get(handle)
+
+    def __contains__(self, handle):
+        return handle in self._peers
+
+    def __len__(self):
+        return len(self._peers)
+
+    def __iter__(self):
+        for h, (ip, pt) in list(self._peers.items()):
+            yield h, ip, pt
+
+##
+# @class PeerDirectory
+# @brief Versioned peer snapshot in shared memory, written by one process and read by many.
+#
+# Must be created before the child processes are started so it is inherited by them.
+class PeerDirectory:
+    ##
+    # @param capacity Size of the shared snapshot buffer in bytes.
+    def __init__(self, capacity=DEFAULT_DIRECTORY_CAPACITY):
+        self._lock    = multiprocessing.Lock()
+        self._version = multiprocessing.RawValue(ctypes.c_uint64, 0)
+        self._length  = multiprocessing.RawValue(ctypes.c_uint32, 0)
+        self._buf     = multiprocessing.RawArray(ctypes.c_char, capacity)
+
+        # Per-process cache of the last decoded snapshot
+        self._cache_version = 0
+        self._cache         = {}
+
+    ##
+    # @brief Current snapshot version. Reading it is a plain shared-memory load.
+    @property
+    def version(self):
+        return self._version.value
+
+    ##
+    # @brief Writes the contents of a PeerRegistry as the new snapshot.
+    #
+    # Entries that do not fit into the buffer are left out with a warning.
+    def publish(self, registry):
+        data  = bytearray()
+        total = published = 0
+        for h, ip, pt in registry:
+            total += 1
+            line = f"{h} {ip} {pt}\n".encode("utf-8")
+            if len(data) + len(line) <= len(self._buf):
+                data += line
+                published += 1
+        if published < total:
+            print(f"[PEERS] Peer snapshot full, only {published} of {total} peers published.")
+        with self._lock:
+            ctypes.memmove(self._buf, bytes(data), len(data))
+            self._length.value   = len(data)
+            self._version.value += 1
+
+    ##
+    # @brief Returns the current peers as a dict handle → (ip, port).
+    #
+    # The returned dict is shared between calls and must not be modified.
+    def snapshot(self):
+        if self._version.value == self._cache_version:
+            return self._cache
+        with self._lock:
+            version = self._version.value
+            raw = ctypes.string_at(ctypes.addressof(self._buf), self._length.value)
+        peers = {}
+        for line in raw.decode("utf-8").splitlines():
+            h, ip, pt = line.split(" ")
+            peers[h] = (ip, int(pt))
+        self._cache_version, self._cache = version, peers
+        return peers
@@ -0,0 +1,318 @@
+##
+# @file protocol.py
+# @brief SLCP wire formats: table-driven text command parser and compact binary framing.
+#
+# Text commands are described by TEXT_FORMATS, one field spec per command. parse_text()
+# splits a datagram at most once per field, checks every field against the spec and returns
+# None for anything malformed, so the receive path never relies on exceptions. Each process
+# then looks the command up in its own dispatch table of handlers.
+#
+# Field spec characters:
+#   s  one token (non-empty, no spaces)
+#   i  one non-negative decimal integer, converted to int
+#   p  one port number (decimal, 1..65535), converted to int
+#   r  rest of the line, non-empty, spaces preserved (must be last)
+#   *  rest of the line, may be missing or empty (must be last)
+#
+# Besides the classic space-delimited text commands, clients can exchange length-prefixed
+# binary frames. Every frame starts with a fixed header:
+#
+#     magic u8, version u8, opcode u8, flags u8, seq u32, src_id u32, dst_id u32, length u32
+#
+# followed by `length` payload bytes. Handles are carried as 32-bit ids (CRC-32 of the
+# UTF-8 handle) and mapped back with the peer table, so a frame needs no text parsing and
+# message payloads arrive byte for byte, whitespace included.
+#
+# A MSG frame with FLAG_RELIABLE set is numbered per peer and answered with an OP_ACK frame;
+# see processes.reliable. Peers announce that they acknowledge such frames with `rel1`.
+# Messages larger than one Ethernet frame are sent as several MSG frames with FLAG_FRAGMENT
+# to peers that announce `frag1`; see processes.fragment.
+#
+# Peers that announce `batch1` also accept several frames packed back to back into one
+# datagram (decode_all() splits them using the length field of each header); see
+# processes.batch.
+#
+# A MSG frame with dst_id 0 is addressed to everyone. It is sent once to the configured
+# multicast (or broadcast) group on the shared discovery port and received by every peer
+# that announces `group1`.
+#
+# Channel messages are sent to each member of the channel; in binary form as a MSG frame
+# with FLAG_CHANNEL whose message starts with the channel name (see channel_payload()), as
+# text with the CMSG command. Channel membership is announced with `chans=#a,#b` in JOIN.
+#
+# Long messages to peers that announce `zlib1` may be zlib-compressed (FLAG_COMPRESSED);
+# compression applies to the whole message before it is fragmented.
+#
+# Images are fetched from the sender's TransferServer only by peers that announce `xfer1`;
+# their IMG notice carries the transfer id as a fifth field (binary: IMG_OFFER). Peers
+# without it get the original four-field IMG and read the image as one raw stream from a
+# listener opened for this one transfer.
+#
+# The magic byte 0xB1 can never start a UTF-8 string, so binary frames and text commands
+# can share one socket. A client advertises support by appending `caps=bin1` to its JOIN
+# broadcast; peers that did not advertise it keep receiving the text form.
+#
+# @author SLCP Team
+# @date June 2025
+#
+
+import collections
+import struct
+import zlib
+
+MAGIC      = 0xB1
+VERSION    = 1
+BINARY_CAP   = f"bin{VERSION}"  # Capability token announced in JOIN
+RELIABLE_CAP = "rel1"           # Peer acknowledges reliable MSG frames (processes.reliable)
+FRAGMENT_CAP = "frag1"          # Peer reassembles fragmented MSG frames (processes.fragment)
+BATCH_CAP    = "batch1"         # Peer accepts several frames per datagram (processes.batch)
+GROUP_CAP    = "group1"         # Peer receives MSG frames to everyone on the configured group
+ZLIB_CAP     = "zlib1"          # Peer inflates MSG frames with FLAG_COMPRESSED
+TRANSFER_CAP = "xfer1"          # Peer serves and fetches images with processes.transfer
+
+HEADER    = struct.Struct("!BBBBIIII")  # magic, version, opcode, flags, seq, src_id, dst_id, length
+IMG_OFFER = struct.Struct("!HQI")       # tcp_port, size, xfer_id
+RELIABLE  = struct.Struct("!II")        # session, window base; prefixes a reliable MSG payload
+ACK_HEAD  = struct.Struct("!I")         # session; followed by u32 selective acks
+FRAGMENT  = struct.Struct("!IHH")       # msg_id, index, count; follows RELIABLE if both are set
+CHANNEL   = struct.Struct("!B")         # Length of the channel name that starts a channel message
+
+MAX_CHANNEL_NAME = 32  # Characters, including the leading '#'
+
+# Text command -> field spec (see above)
+TEXT_FORMATS = {
+    "MSG":       "ssr",     # src dest text
+    "CMSG":      "sssr",    # src channel dest text
+    "IMG":       "sspi*",   # src dest tcp_port size [xfer_id]
+    "LEAVE":     "s",       # handle
+    "JOIN":      "sp*",     # handle port [caps=...] [chans=...]
+    "WHO":       "*",       # [epoch version [handle]]
+    "KNOWUSERS": "*",       # h ip port,h ip port,...
+    "KNOWDELTA": "iiiiii*", # epoch base version page pages full +h ip port,-h,...
+    "RESPONDER": "si",      # handle epoch
+    "RESIGN":    "s",       # handle
+}
+
+OP_MSG   = 1   # Payload: UTF-8 message text
+OP_IMG   = 2   # Payload: IMG_OFFER
+OP_LEAVE = 3   # No payload
+OP_ACK   = 4   # seq = cumulative ack; payload: ACK_HEAD + selective acks
+
+FLAG_RELIABLE = 0x01  # MSG: seq is a per-peer sequence number, payload starts with RELIABLE
+FLAG_FRAGMENT = 0x02  # MSG: payload is one fragment of a larger message, prefixed with FRAGMENT
+FLAG_CHANNEL  = 0x04  # MSG: the (reassembled) message is a channel_payload()
+FLAG_COMPRESSED = 0x08  # MSG: the (reassembled) message is zlib-compressed; inflate it first
+
+##
+# @brief Decoded binary frame. `payload` is a memoryview into the receive buffer.
+Frame = collections.namedtuple("Frame", "opcode flags seq src_id dst_id payload")
+
+##
+# @brief Precomputes what parse_fields() needs to know about a spec string.
+# @return Tuple (field count, tail kind or "", (index, is port) of every integer field).
+def _compile(spec):
+    tail = spec[-1] if spec and spec[-1] in "r*" else ""
+    return len(spec), tail, tuple((k, kind == "p") for k, kind in enumerate(spec) if kind in "ip")
+
+_compiled   = {}  # spec -> _compile(spec)
+_TEXT_SPECS = {cmd: _compile(spec) for cmd, spec in TEXT_FORMATS.items()}  # One lookup per datagram
+
+##
+# @brief Splits `text` into fields according to a spec string.
+# @return Tuple of fields (ints for `i` and `p`), or None if the text does not match the spec.
+def parse_fields(text, spec):
+    compiled = _compiled.get(spec)
+    if compiled is None:
+        compiled = _compiled[spec] = _compile(spec)
+    return _split_fields(text, compiled)
+
+##
+# @brief parse_fields() for a spec already compiled by _compile().
+def _split_fields(text, compiled):
+    n, tail, ints = compiled
+    fields = text.split(" ", n - 1 if tail else n) if text else []
+    if len(fields) != n:
+        if tail != "*" or len(fields) != n - 1:
+            return None
+        fields.append("")
+    if "" in (fields[:-1] if tail == "*" else fields):
+        return None
+    for k, port in ints:
+        f = fields[k]
+        if not (f.isdecimal() and f.isascii()):
+            return None
+        f = fields[k] = int(f)
+        if port and not 0 < f < 65536:
+            return None
+    return tuple(fields)
+
+##
+# @brief Parses one text datagram.
+# @param data Bytes or memoryview holding the datagram.
+# @return Tuple (command, fields), or None for unknown commands and malformed datagrams.
+def parse_text(data):
+    try:
+        text = str(data, "utf-8").strip()
+    except UnicodeDecodeError:
+        return None
+    cmd, _, rest = text.partition(" ")
+    compiled = _TEXT_SPECS.get(cmd)
+    if compiled is None:
+        return None
+    fields = _split_fields(rest, compiled)
+    if fields is None:
+        return None
+    return cmd, fields
+
+##
+# @brief Parses one `handle ip port` directory entry.
+# @return Tuple (handle, ip, port), or None if malformed.
+def parse_peer(entry):
+    return parse_fields(entry.strip(), "ssp")
+
+##
+# @brief Parses the entry list of a KNOWUSERS reply.
+# @return List of (handle, ip, port) tuples; malformed entries are skipped.
+def parse_knowusers(entries):
+    peers = []
+    for entry in entries.split(","):
+        peer = parse_peer(entry)
+        if peer is not None:
+            peers.append(peer)
+    return peers
+
+##
+# @brief Parses the entry list of a KNOWDELTA reply.
+# @return List of (handle, (ip, port)) for added/updated peers and (handle, None) for
+#         removed ones; malformed entries are skipped.
+def parse_delta(entries):
+    changes = []
+    for entry in entries.split(",") if entries else ():
+        op, body = entry[:1], entry[1:]
+        if op == "+":
+            peer = parse_peer(body)
+            if peer is not None:
+                changes.append((peer[0], peer[1:]))
+        elif op == "-" and body:
+            changes.append((body, None))
+    return changes
+
+##
+# @brief Returns the 32-bit id a handle is carried as in binary frames.
+def handle_id(handle):
+    return zlib.crc32(handle.encode("utf-8"))
+
+##
+# @brief Collects the comma-separated values of `key=` tokens in the tail of a JOIN message.
+def _parse_list(extra, key):
+    values = set()
+    for token in extra.split():
+        if token.startswith(key):
+            values.update(v for v in token[len(key):].split(",") if v)
+    return values
+
+##
+# @brief Extracts the capability set from the optional tail of a JOIN message.
+# @param extra Text after `JOIN <handle> <port>`, e.g. "caps=bin1,foo".
+# @return Set of capability names; empty for clients that announce none.
+def parse_caps(extra):
+    return _parse_list(extra, "caps=")
+
+##
+# @brief Returns True if `name` is a valid channel name such as "#team".
+def is_channel(name):
+    return (name.startswith("#") and 1 < len(name) <= MAX_CHANNEL_NAME and
+            name.isprintable() and not any(c in name for c in " ,"))
+
+##
+# @brief Extracts the channels a client is in from the optional tail of a JOIN message.
+# @param extra Text after `JOIN <handle> <port>`, e.g. "caps=bin1 chans=#team,#ops".
+# @return Set of valid channel names.
+def parse_channels(extra):
+    return {c for c in _parse_list(extra, "chans=") if is_channel(c)}
+
+##
+# @brief Builds a binary frame.
+# @param opcode  One of the OP_* constants.
+# @param seq     Sender sequence number.
+# @param src     Handle of the sender.
+# @param dst     Handle of the recipient, or "" for none.
+# @param payload Bytes-like payload.
+# @param flags   Opcode-specific flag bits.
+# @return The encoded frame as bytes.
+def encode(opcode, seq, src, dst, payload=b"", flags=0):
+    return HEADER.pack(MAGIC, VERSION, opcode, flags, seq & 0xFFFFFFFF, handle_id(src),
+                       handle_id(dst) if dst else 0, len(payload)) + payload
+
+##
+# @brief Builds the payload of an OP_ACK frame.
+# @param session Session id of the peer whose messages are acknowledged.
+# @param sacks   Selective acks above the cumulative ack (carried in the header seq).
+def ack_payload(session, sacks):
+    return ACK_HEAD.pack(session) + struct.pack(f"!{len(sacks)}I", *sacks)
+
+##
+# @brief Parses the payload of an OP_ACK frame.
+# @return Tuple (session, list of selective acks), or None if malformed.
+def parse_ack_payload(payload):
+    n, rest = divmod(len(payload) - ACK_HEAD.size, 4)
+    if n < 0 or rest:
+        return None
+    session, = ACK_HEAD.unpack_from(payload)
+    return session, list(struct.unpack_from(f"!{n}I", payload, ACK_HEAD.size))
+
+##
+# @brief Builds a channel message: the channel name, prefixed with its length, then the text.
+def channel_payload(channel, data):
+    name = channel.encode("utf-8")
+    return CHANNEL.pack(len(name)) + name + data
+
+##
+# @brief Splits a channel message built by channel_payload().
+# @return Tuple (channel, text bytes), or None if malformed.
+def parse_channel_payload(payload):
+    if len(payload) < CHANNEL.size:
+        return None
+    end = CHANNEL.size + CHANNEL.unpack_from(payload)[0]
+    if len(payload) < end:
+        return None
+    try:
+        channel = str(payload[CHANNEL.size:end], "utf-8")
+    except UnicodeDecodeError:
+        return None
+    if not is_channel(channel):
+        return None
+    return channel, payload[end:]
+
+##
+# @brief Returns True if a datagram looks like a binary frame rather than a text command.
+def is_binary(data):
+    return len(data) > 0 and data[0] == MAGIC
+
+##
+# @brief Parses a binary frame without copying the payload.
+# @param data Bytes or memoryview holding one datagram.
+# @return Frame, or None if the datagram is truncated or of an unsupported version.
+def decode(data):
+    if len(data) < HEADER.size:
+        return None
+    magic, version, opcode, flags, seq, src_id, dst_id, length = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or length != len(data) - HEADER.size:
+        return None
+    return Frame(opcode, flags, seq, src_id, dst_id, memoryview(data)[HEADER.size:])
+
+##
+# @brief Parses a datagram holding one or more binary frames back to back.
+# @param data Bytes or memoryview holding one datagram.
+# @return List of Frames in the order they were packed; parsing stops at the first
+#         truncated or unsupported frame, earlier frames are still returned.
+def decode_all(data):
+    view, frames, off = memoryview(data), [], 0
+    while len(view) - off >= HEADER.size:
+        magic, version, opcode, flags, seq, src_id, dst_id, length = HEADER.unpack_from(view, off)
+        end = off + HEADER.size + length
+        if magic != MAGIC or version != VERSION or end > len(view):
+            break
+        frames.append(Frame(opcode, flags, seq, src_id, dst_id, view[off + HEADER.size:end]))
+        off = end
+    return frames
@@ -0,0 +1,294 @@
+##
+# @file reliable.py
+# @brief Reliable delivery of chat messages over UDP: sequence numbers, ACKs and a send window.
+#
+# Every sender numbers its messages per peer, starting at 1 for each session (a random
+# 32-bit id chosen when the network process starts, so a restarted client is not mistaken
+# for a duplicate). Forgetting a peer does not restart its numbering within a session. The receiver answers every message with an ACK carrying
+#
+#   - the cumulative ack: every sequence number up to it has been received, and
+#   - up to MAX_SACK selective acks for messages received above that point.
+#
+# The sender keeps at most `window` sequence numbers in flight per peer, counted from its
+# oldest unacknowledged message; further messages wait in a backlog. Unacknowledged messages are retransmitted after the
+# retransmission timeout (RTO), which adapts to the measured round-trip time as in
+# RFC 6298 and doubles on every timeout. A message that the selective acks show as missing
+# while FAST_RETRANSMIT later ones already arrived is resent early, once it is older than
+# the smoothed RTT allows. A message that is still unacknowledged after
+# MAX_RETRIES retransmissions is reported as failed. The receiver remembers which sequence
+# numbers it has seen and drops duplicates caused by lost ACKs. Every message also carries
+# the sender's window base (its oldest unacknowledged sequence number), so the receiver can
+# forget about messages the sender has given up on.
+#
+# The classes here only keep state and run timers on the EventLoop; putting frames on the
+# wire is left to callbacks supplied by the network process.
+#
+# @author SLCP Team
+# @date June 2025
+#
+
+import collections
+import time
+
+WINDOW_SIZE     = 32    # Sequence numbers in flight per peer (must not exceed MAX_SACK + 1)
+MAX_RETRIES     = 6     # Retransmissions before a message is reported as failed
+MAX_SACK        = 64    # Selective acks carried per ACK
+FAST_RETRANSMIT = 3     # Later messages acked past a gap before it is resent without waiting
+INITIAL_RTO     = 1.0   # Seconds, before the first RTT sample
+MIN_RTO         = 0.2   # Seconds; a LAN round trip is far below, this bounds spurious retransmits
+MAX_RTO         = 5.0   # Seconds; a failed message is reported after about half a minute
+
+##
+# @class RttEstimator
+# @brief Smoothed round-trip time and retransmission timeout as in RFC 6298.
+class RttEstimator:
+    def __init__(self):
+        self.srtt   = None
+        self.rttvar = None
+        self.rto    = INITIAL_RTO
+
+    ##
+    # @brief Feeds one RTT measurement (only from messages that were not retransmitted).
+    def observe(self, sample):
+        if self.srtt is None:
+            self.srtt, self.rttvar = sample, sample / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - sample)
+            self.srtt   = 0.875 * self.srtt + 0.125 * sample
+        self.rto = min(max(self.srtt + 4 * self.rttvar, MIN_RTO), MAX_RTO)
+
+    ##
+    # @brief Doubles the RTO after a timeout.
+    def backoff(self):
+        self.rto = min(self.rto * 2, MAX_RTO)
+
+##
+# @class _Group
+# @brief Messages that are reported as one (e.g. the fragments of a large chat message).
+class _Group:
+    __slots__ = ("tag", "remaining", "failed")
+
+    def __init__(self, tag, count):
+        self.tag       = tag
+        self.remaining = count
+        self.failed    = False
+
+##
+# @class _Outgoing
+# @brief One unacknowledged message.
+class _Outgoing:
+    __slots__ = ("seq", "payload", "group", "sent_at", "deadline", "tries")
+
+    def __init__(self, seq, payload, group):
+        self.seq      = seq
+        self.payload  = payload
+        self.group    = group
+        self.sent_at  = 0.0
+        self.deadline = 0.0
+        self.tries    = 0
+
+##
+# @class _PeerWindow
+# @brief Send state towards one peer.
+class _PeerWindow:
+    def __init__(self, next_seq=1):
+        self.next_seq = next_seq
+        self.inflight = collections.OrderedDict()  # seq -> _Outgoing, oldest first
+        self.backlog  = collections.deque()        # _Outgoing not yet sent
+        self.rtt      = RttEstimator()
+        self.timer    = None
+
+##
+# @class ReliableSender
+# @brief Per-peer sliding send windows with adaptive retransmission.
+class ReliableSender:
+    ##
+    # @param loop         EventLoop the retransmission timers run on.
+    # @param transmit     Callable (dest, seq, base, payload) that puts one message on the wire;
+    #                     `base` is the oldest sequence number still in flight.
+    # @param on_delivered Callable (dest, tag) called once a message has been acknowledged.
+    # @param on_failed    Callable (dest, tag) called when a message is given up.
+    # @param window       Sequence numbers in flight per peer.
+    def __init__(self, loop, transmit, on_delivered, on_failed, window=WINDOW_SIZE):
+        self._loop         = loop
+        self._transmit     = transmit
+        self._on_delivered = on_delivered
+        self._on_failed    = on_failed
+        self.window        = window
+        self._peers        = {}  # dest -> _PeerWindow
+        self._resume       = {}  # dest -> next sequence number after drop()
+        self.delivered     = 0
+        self.failed        = 0
+        self.retransmitted = 0
+
+    ##
+    # @brief Queues several messages that are reported as one: delivered once all of them
+    #        are acknowledged, failed as soon as one of them is given up.
+    # @param tag Opaque value handed back to on_delivered/on_failed.
+    def send_group(self, dest, payloads, tag=None):
+        peer = self._peers.get(dest)
+        if peer is None:
+            peer = self._peers[dest] = _PeerWindow(self._resume.pop(dest, 1))
+        group = _Group(tag, len(payloads))
+        for payload in payloads:
+            peer.backlog.append(_Outgoing(peer.next_seq, payload, group))
+            peer.next_seq += 1
+        self._pump(dest, peer)
+
+    ##
+    # @brief Processes an ACK from `dest`.
+    # @param cumulative Every sequence number up to this one has been received.
+    # @param sacks      Further sequence numbers received above `cumulative`.
+    def on_ack(self, dest, cumulative, sacks=()):
+        peer = self._peers.get(dest)
+        if peer is None:
+            return
+        now   = time.monotonic()
+        acked = [s for s in peer.inflight if s <= cumulative]
+        acked += [s for s in sacks if s > cumulative and s in peer.inflight]
+        if acked:
+            # Only the newest message gives a clean sample; older ones may have waited for a
+            # gap to be filled. Karn: never sample a retransmitted message.
+            newest = peer.inflight[max(acked)]
+            if newest.tries == 1:
+                peer.rtt.observe(now - newest.sent_at)
+        for seq in acked:
+            self._acked(dest, peer.inflight.pop(seq).group)
+
+        # Resend gaps the receiver has clearly skipped over, once, without waiting for the RTO.
+        # A gap younger than the smoothed RTT may just be reordering, give it time.
+        highest  = max(sacks, default=cumulative)
+        min_wait = 1.5 * (peer.rtt.srtt or INITIAL_RTO)
+        for out in peer.inflight.values():
+            if out.seq + FAST_RETRANSMIT > highest:
+                break
+            if out.tries == 1 and now - out.sent_at >= min_wait:
+                self.retransmitted += 1
+                self._send(dest, peer, out, now)
+        if acked:
+            self._pump(dest, peer)
+
+    ##
+    # @brief Gives up every pending message to `dest`, e.g. because the peer left.
+    #
+    # The session goes on: the peer may still hold a ReceiveWindow for it (it never left, or
+    # the LEAVE was forged), so later messages continue the sequence numbers instead of
+    # starting over at 1 and being dropped as duplicates.
+    def drop(self, dest):
+        peer = self._peers.pop(dest, None)
+        if peer is None:
+            return
+        self._resume[dest] = peer.next_seq
+        if peer.timer is not None:
+            peer.timer.cancel()
+        for out in list(peer.inflight.values()) + list(peer.backlog):
+            self._give_up(dest, out.group)
+
+    ##
+    # @brief Returns the delivery counters as a human-readable line.
+    def stats(self):
+        pending = sum(len(p.inflight) + len(p.backlog) for p in self._peers.values())
+        rtts    = [f"{d} {p.rtt.srtt * 1000:.1f}ms" for d, p in self._peers.items() if p.rtt.srtt]
+        line    = (f"delivered {self.delivered}, failed {self.failed}, "
+                   f"retransmitted {self.retransmitted}, pending {pending}")
+        return line + (f"; srtt {', '.join(rtts)}" if rtts else "")
+
+    def _acked(self, dest, group):
+        group.remaining -= 1
+        if group.remaining == 0 and not group.failed:
+            self.delivered += 1
+            self._on_delivered(dest, group.tag)
+
+    def _give_up(self, dest, group):
+        if not group.failed:
+            group.failed = True
+            self.failed += 1
+            self._on_failed(dest, group.tag)
+
+    ##
+    # @brief Moves messages from the backlog into the window and sends them.
+    #
+    # The window spans `window` sequence numbers from the oldest unacknowledged message, so
+    # the receiver never has to report more selective acks than fit into one ACK.
+    def _pump(self, dest, peer):
+        now = time.monotonic()
+        while peer.backlog and (not peer.inflight or
+                                peer.backlog[0].seq < next(iter(peer.inflight)) + self.window):
+            out = peer.backlog.popleft()
+            peer.inflight[out.seq] = out
+            self._send(dest, peer, out, now)
+        self._arm(dest, peer)
+
+    def _send(self, dest, peer, out, now):
+        out.tries   += 1
+        out.sent_at  = now
+        out.deadline = now + peer.rtt.rto
+        self._transmit(dest, out.seq, next(iter(peer.inflight)), out.payload)
+
+    ##
+    # @brief Points the peer's retransmission timer at its earliest deadline.
+    def _arm(self, dest, peer):
+        if peer.timer is not None:
+            peer.timer.cancel()
+            peer.timer = None
+        if peer.inflight:
+            deadline = min(out.deadline for out in peer.inflight.values())
+            peer.timer = self._loop.call_later(deadline - time.monotonic(),
+                                               lambda: self._expire(dest, peer))
+
+    ##
+    # @brief Retransmits (or gives up) every message whose timeout has passed.
+    def _expire(self, dest, peer):
+        peer.timer = None
+        now = time.monotonic()
+        expired = [out for out in peer.inflight.values() if out.deadline <= now]
+        if expired:
+            peer.rtt.backoff()
+        for out in expired:
+            if out.seq not in peer.inflight:
+                continue  # Cancelled along with its group
+            if out.tries > MAX_RETRIES:
+                # The rest of the group is pointless now, stop sending it as well
+                for seq in [s for s, o in peer.inflight.items() if o.group is out.group]:
+                    del peer.inflight[seq]
+                peer.backlog = collections.deque(o for o in peer.backlog if o.group is not out.group)
+                self._give_up(dest, out.group)
+            else:
+                self.retransmitted += 1
+                self._send(dest, peer, out, now)
+        self._pump(dest, peer)
+
+##
+# @class ReceiveWindow
+# @brief Duplicate detection and ACK contents for messages from one peer session.
+class ReceiveWindow:
+    def __init__(self):
+        self.cumulative = 0      # Every sequence number up to this one has been received
+        self._above     = set()  # Received sequence numbers above `cumulative`
+
+    ##
+    # @brief Records a received sequence number.
+    # @param base Sender's oldest unacknowledged sequence number; anything below it is
+    #             either received or abandoned and need not be tracked any more.
+    # @return True if it is new, False for a duplicate.
+    def accept(self, seq, base=0):
+        if base - 1 > self.cumulative:
+            self.cumulative = base - 1
+            self._above = {s for s in self._above if s > self.cumulative}
+        if self.seen(seq):
+            return False
+        self._above.add(seq)
+        while self.cumulative + 1 in self._above:
+            self.cumulative += 1
+            self._above.discard(self.cumulative)
+        return True
+
+    ##
+    # @brief Returns True if `seq` has already been received.
+    def seen(self, seq):
+        return seq <= self.cumulative or seq in self._above
+
+    ##
+    # @brief Returns the selective acks to send along with the cumulative ack.
+    def sacks(self):
+        return sorted(self._above)[:MAX_SACK]
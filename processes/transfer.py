@@ -0,0 +1,931 @@
+##
+# @file transfer.py
+# @brief TCP image transfer helpers for the SLCP network process.
+#
+# Every client runs one long-lived TransferServer (by default on the second entry of `port`
+# in config.toml). Sending an image registers an *offer* with the server and announces it
+# to the recipient with a UDP notice. Offers have random transfer ids and are only served
+# to connections from the recipient's IP address:
+#
+#     IMG <src> <dest> <tcp_port> <size> <xfer_id>
+#
+# The recipient fetches the offer over a keep-alive connection taken from its
+# ConnectionPool. Each request/response on a connection is framed, so any number of
+# transfers can follow each other over the same connection; idle connections are closed
+# after a timeout on both ends.
+#
+# Request frame (receiver → sender):  REQUEST  = opcode u8, xfer_id u32, offset u64, length u64
+# Response frame (sender → receiver): RESPONSE = status u8, length u64, followed by `length` bytes
+#
+# OP_GET returns a byte range as is. OP_CHUNK additionally puts the BLAKE2b digest of the
+# range (DIGEST_SIZE bytes) between RESPONSE and the data, and OP_DONE tells the server that
+# the receiver has everything. Images larger than one TRANSFER_CHUNK are fetched as chunks
+# over up to PARALLEL_STREAMS pooled connections at once; every chunk is checked against
+# its digest and recorded in a bitmap, so a broken connection or a corrupt chunk only
+# costs that chunk, which is fetched again in the next round. Servers that predate
+# OP_CHUNK answer it with ST_NOT_FOUND and the receiver falls back to a single OP_GET.
+#
+# Before anything is downloaded the receiver asks for the image's content hash with OP_HASH
+# (the response carries the HASH_SIZE byte hash as its data). If the receiver's BlobStore
+# already holds that image, the download is skipped; otherwise the finished file must
+# match the announced hash before it is stored.
+#
+# The OP_HASH request also negotiates compression: its `offset` field carries the bitmask
+# of codecs the receiver understands (see processes.compress), and the sender appends the
+# codec it chose for this transfer to the hash. If it chose one, chunks are requested with
+# OP_ZCHUNK, whose response puts the chunk digest and the codec actually used for this chunk
+# (ZCHUNK) between RESPONSE and the possibly compressed data. Senders that predate this
+# ignore the mask and announce the hash alone, so the transfer stays uncompressed.
+#
+# Downloads run on the worker threads of a TransferScheduler owned by the network process,
+# so chat traffic keeps flowing while an image is being received. The scheduler bounds the
+# number of transfers running at once, overall and per peer, starts small transfers ahead of
+# bulk ones, gives up transfers that waited too long and can cancel queued or running ones.
+# Offers that are never fetched expire on the server side.
+#
+# Data is streamed into a part file inside the BlobStore's directory; only a finished,
+# complete file is moved to its final name, so readers never see a half-written image. When
+# a download of an image with an announced hash fails or is cancelled, its part file stays
+# behind with the chunk bitmap next to it (PART_MAP_SUFFIX), and the next offer of the same
+# image from the same sender only fetches the chunks that are still missing. Part files
+# nobody comes back for are deleted after OFFER_TIMEOUT.
+#
+# Peers that do not announce `xfer1` (see processes.protocol) predate all of this. They are
+# served with serve_once() and fetched from with download_once(): one listener per image
+# that sends the file as a single raw stream.
+#
+# Uploads never load the image into Python memory: the file descriptor is handed to the
+# kernel with socket.sendfile(), or sent as mmap-backed chunks where sendfile is missing.
+#
+# @author SLCP Team
+# @date June 2025
+#
+
+import collections
+import hashlib
+import itertools
+import mmap
+import os
+import secrets
+import socket
+import struct
+import threading
+import time
+
+from processes.blobstore import HASH_SIZE, content_hash
+from processes.compress  import (CODEC_NONE, MAX_RATIO, CompressionStats, available_codecs,
+                                 choose_codec, codec_mask, compress, decompress)
+
+CHUNK_SIZE          = 64 * 1024  # Bytes read from the socket per recv_into() call
+DOWNLOAD_TIMEOUT    = 30         # Seconds before a stalled connect/recv is aborted
+POOL_IDLE_TIMEOUT   = 30         # Seconds an unused pooled connection is kept open
+SERVER_IDLE_TIMEOUT = 60         # Seconds the server keeps a silent connection (> pool timeout)
+MAX_POOL_PER_PEER   = 4          # Idle connections kept per peer
+OFFER_TIMEOUT       = 600        # Seconds an offer waits to be fetched before it is withdrawn
+MAX_SERVER_CONNS    = 64         # Connections the TransferServer serves at once
+MAX_CONNS_PER_PEER  = 8          # ... of which from one IP address (> MAX_POOL_PER_PEER)
+HASH_CACHE_SIZE     = 64         # Content hashes of offered files the server remembers
+
+TRANSFER_CHUNK      = 1 << 20    # Bytes per verified chunk of a download
+PARALLEL_STREAMS    = 4          # Connections one download fetches chunks over at once
+DOWNLOAD_ROUNDS     = 3          # Attempts at the missing chunks before a download fails
+RETRY_DELAY         = 1.0        # Seconds before the next round, multiplied by the round
+DIGEST_SIZE         = 16         # Bytes of the BLAKE2b digest of each chunk
+PART_MAP_SUFFIX     = ".map"     # Chunk bitmap kept next to the part file of a failed download
+
+DEFAULT_MAX_ACTIVE   = 4           # Transfers running at once
+DEFAULT_MAX_PER_PEER = 2           # Transfers running at once from one peer
+DEFAULT_MAX_QUEUED   = 32          # Transfers waiting before new ones are refused
+QUEUE_TIMEOUT        = 120         # Seconds a transfer may wait for a free slot
+SMALL_TRANSFER       = 256 * 1024  # Transfers up to this size are started before bulk ones
+
+PRIORITY_SMALL = 0
+PRIORITY_BULK  = 1
+
+REQUEST  = struct.Struct("!BIQQ")  # opcode, xfer_id, offset, length
+RESPONSE = struct.Struct("!BQ")    # status, length
+ZCHUNK   = struct.Struct(f"!{DIGEST_SIZE}sB")  # chunk digest, codec; follows an OP_ZCHUNK RESPONSE
+
+OP_GET       = 1
+OP_CHUNK     = 2
+OP_DONE      = 3
+OP_HASH      = 4
+OP_ZCHUNK    = 5
+ST_OK        = 0
+ST_NOT_FOUND = 1
+
+##
+# @class TransferCancelled
+# @brief Raised inside a transfer that was cancelled, and reported as its error.
+class TransferCancelled(Exception):
+    pass
+
+##
+# @brief Reads exactly `n` bytes from a socket.
+# @return bytearray of `n` bytes.
+# @throws ConnectionError if the peer closes the connection early.
+def recv_exact(conn, n):
+    buf  = bytearray(n)
+    view = memoryview(buf)
+    got  = 0
+    while got < n:
+        k = conn.recv_into(view[got:])
+        if not k:
+            raise ConnectionError(f"connection closed after {got} of {n} bytes")
+        got += k
+    return buf
+
+##
+# @brief Returns the digest a chunk is checked against.
+def chunk_digest(data):
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+
+##
+# @brief Computes chunk_digest() of `length` bytes of an open file starting at `offset`.
+def _digest_range(f, offset, length):
+    h   = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    buf = memoryview(bytearray(min(CHUNK_SIZE, max(length, 1))))
+    f.seek(offset)
+    while length > 0:
+        n = f.readinto(buf[:min(len(buf), length)])
+        if not n:
+            raise OSError("file shrank while it was offered")
+        h.update(buf[:n])
+        length -= n
+    return h.digest()
+
+##
+# @brief Sends `size` bytes of an open file over a connected TCP socket.
+#
+# Uses the zero-copy `socket.sendfile()` path where the OS provides it and otherwise
+# sends memoryview slices of a read-only mmap, so memory use does not grow with file size.
+#
+# @param conn   Connected, blocking TCP socket.
+# @param f      File object opened in binary mode.
+# @param size   Number of bytes to send (usually taken from os.stat()).
+# @param offset Position in the file to start from.
+def send_file(conn, f, size, offset=0):
+    if size <= 0:
+        return
+    if hasattr(os, "sendfile"):
+        conn.sendfile(f, offset, size)
+        return
+    # mmap offsets must be aligned to the allocation granularity
+    start = offset - offset % mmap.ALLOCATIONGRANULARITY
+    with mmap.mmap(f.fileno(), offset - start + size, access=mmap.ACCESS_READ,
+                   offset=start) as mm:
+        view = memoryview(mm)
+        try:
+            end = offset - start + size
+            for off in range(offset - start, end, CHUNK_SIZE):
+                conn.sendall(view[off:min(off + CHUNK_SIZE, end)])
+        finally:
+            view.release()
+
+##
+# @class TransferServer
+# @brief Long-lived TCP listener serving registered image offers to peers.
+#
+# One thread accepts connections and one thread per connection answers framed requests
+# until the peer closes it or it stays silent for SERVER_IDLE_TIMEOUT seconds.
+class TransferServer:
+    ##
+    # @param port Preferred TCP port. If it is taken (e.g. several local clients share the
+    #             same config entry) an ephemeral port is used instead.
+    def __init__(self, port=0):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self._sock.bind(("", port))
+        except OSError as e:
+            print(f"[TRANSFER] Port {port} unavailable ({e}), using a random port.")
+            self._sock.bind(("", 0))
+        self._sock.listen(16)
+        self.port = self._sock.getsockname()[1]
+
+        self._offers = {}                  # xfer_id -> (path, size, recipient IP, offered at, codec)
+        self._hashes = collections.OrderedDict()  # (path, size, mtime) -> content hash
+        self._conns  = {}                  # Open peer connection -> peer IP
+        self._lock   = threading.Lock()
+        self._closed = False
+        self.compression = CompressionStats()  # Chunks sent with OP_ZCHUNK
+
+    ##
+    # @brief Starts the accept thread.
+    def start(self):
+        threading.Thread(target=self._accept_loop, name="transfer-accept", daemon=True).start()
+
+    ##
+    # @brief Registers a file so the peer at `peer_ip` can fetch it.
+    #
+    # Transfer ids are random, so another host on the LAN cannot guess them, and an offer is
+    # only served to connections from its recipient's address.
+    # @return Transfer id to put into the IMG notice.
+    def offer(self, path, size, peer_ip):
+        with self._lock:
+            xfer_id = 0
+            while xfer_id == 0 or xfer_id in self._offers:
+                xfer_id = secrets.randbits(32)
+            self._offers[xfer_id] = (path, size, peer_ip, time.monotonic(), CODEC_NONE)
+        return xfer_id
+
+    ##
+    # @brief Withdraws offers the recipient has not fetched within OFFER_TIMEOUT seconds.
+    # @return Number of withdrawn offers.
+    def expire_offers(self, timeout=OFFER_TIMEOUT):
+        cutoff = time.monotonic() - timeout
+        with self._lock:
+            stale = [x for x, (_, _, _, t, _) in self._offers.items() if t < cutoff]
+            for xfer_id in stale:
+                del self._offers[xfer_id]
+        return len(stale)
+
+    ##
+    # @brief Stops accepting and closes all open connections.
+    def close(self):
+        self._closed = True
+        self._sock.close()
+        with self._lock:
+            conns = list(self._conns)
+        for conn in conns:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _accept_loop(self):
+        while not self._closed:
+            try:
+                conn, addr = self._sock.accept()
+            except OSError:
+                break
+            with self._lock:
+                busy = (len(self._conns) >= MAX_SERVER_CONNS or
+                        sum(ip == addr[0] for ip in self._conns.values()) >= MAX_CONNS_PER_PEER)
+                if not busy:
+                    self._conns[conn] = addr[0]
+            if busy:
+                conn.close()  # The peer retries over one of its pooled connections
+                continue
+            conn.settimeout(SERVER_IDLE_TIMEOUT)
+            threading.Thread(target=self._serve, args=(conn, addr[0]), name="transfer-conn",
+                             daemon=True).start()
+
+    ##
+    # @brief Answers requests on one connection from `ip` until it is closed or idle.
+    def _serve(self, conn, ip):
+        try:
+            while True:
+                try:
+                    op, xfer_id, offset, length = REQUEST.unpack(recv_exact(conn, REQUEST.size))
+                except OSError:
+                    break  # Peer closed the connection or it went idle
+
+                with self._lock:
+                    offer = self._offers.get(xfer_id)
+                    if offer is not None and offer[2] != ip:
+                        offer = None  # Offered to someone else
+                    elif op == OP_DONE:
+                        self._offers.pop(xfer_id, None)
+                if op not in (OP_GET, OP_CHUNK, OP_ZCHUNK, OP_HASH) or offer is None:
+                    conn.sendall(RESPONSE.pack(ST_OK if op == OP_DONE else ST_NOT_FOUND, 0))
+                    continue
+
+                path, size, peer_ip, offered, codec = offer
+                if op == OP_HASH:
+                    try:
+                        digest = self._content_hash(path, size)
+                        if offset:  # The receiver's codec mask
+                            codec = choose_codec(path, size, offset)
+                            with self._lock:
+                                if xfer_id in self._offers:
+                                    self._offers[xfer_id] = (path, size, peer_ip, offered, codec)
+                            digest += bytes((codec,))
+                    except OSError as e:
+                        print(f"[TRANSFER] Cannot hash {path}: {e}")
+                        conn.sendall(RESPONSE.pack(ST_NOT_FOUND, 0))
+                        continue
+                    conn.sendall(RESPONSE.pack(ST_OK, len(digest)) + digest)
+                    continue
+
+                length = max(0, min(length, size - offset))
+                try:
+                    if op == OP_ZCHUNK:
+                        self._send_zchunk(conn, path, offset, length, codec)
+                        continue
+                    with open(path, "rb") as f:
+                        digest = _digest_range(f, offset, length) if op == OP_CHUNK else b""
+                        conn.sendall(RESPONSE.pack(ST_OK, length) + digest)
+                        send_file(conn, f, length, offset)
+                except OSError as e:
+                    print(f"[TRANSFER] Serving {path} failed: {e}")
+                    break  # Stream is out of sync now, drop the connection
+
+                # A plain GET of the rest of the offer delivered it, forget it. Chunked
+                # receivers say so with OP_DONE since their chunks may arrive in any order.
+                if op == OP_GET and offset + length >= size:
+                    with self._lock:
+                        self._offers.pop(xfer_id, None)
+        finally:
+            with self._lock:
+                self._conns.pop(conn, None)
+            conn.close()
+
+    ##
+    # @brief Answers OP_ZCHUNK: the range compressed with `codec`, or raw if it does not shrink.
+    def _send_zchunk(self, conn, path, offset, length, codec):
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read(length)
+        if len(data) != length:
+            raise OSError("file shrank while it was offered")
+        digest = chunk_digest(data)
+        if codec != CODEC_NONE:
+            started = time.thread_time()
+            packed  = compress(codec, data)
+            if len(packed) <= length * MAX_RATIO:
+                self.compression.add(length, len(packed), started)
+                data = packed
+            else:
+                self.compression.add(length, length, started)
+                codec = CODEC_NONE
+        conn.sendall(RESPONSE.pack(ST_OK, len(data)) + ZCHUNK.pack(digest, codec))
+        conn.sendall(data)
+
+    ##
+    # @brief Returns the content hash of an offered file.
+    #
+    # The same image is often sent to several peers, so hashes are remembered per path,
+    # size and modification time.
+    def _content_hash(self, path, size):
+        key = (path, size, os.stat(path).st_mtime_ns)
+        with self._lock:
+            digest = self._hashes.get(key)
+        if digest is None:
+            digest = content_hash(path)
+            with self._lock:
+                self._hashes[key] = digest
+                if len(self._hashes) > HASH_CACHE_SIZE:
+                    self._hashes.popitem(last=False)
+        return digest
+
+##
+# @class ConnectionPool
+# @brief Keep-alive TCP connections to peer transfer servers, shared by worker threads.
+class ConnectionPool:
+    def __init__(self, idle_timeout=POOL_IDLE_TIMEOUT, max_per_peer=MAX_POOL_PER_PEER):
+        self._idle        = {}   # (ip, port) -> list of (conn, last_used)
+        self._lock        = threading.Lock()
+        self.idle_timeout = idle_timeout
+        self.max_per_peer = max_per_peer
+
+    ##
+    # @brief Returns an open connection to `addr`, reusing an idle one when possible.
+    # @return Tuple (conn, reused).
+    def acquire(self, addr):
+        with self._lock:
+            idle = self._idle.get(addr)
+            if idle:
+                conn, _ = idle.pop()
+                return conn, True
+        return socket.create_connection(addr, timeout=DOWNLOAD_TIMEOUT), False
+
+    ##
+    # @brief Returns a healthy connection to the pool once a request has completed.
+    def release(self, addr, conn):
+        with self._lock:
+            idle = self._idle.setdefault(addr, [])
+            if len(idle) < self.max_per_peer:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    ##
+    # @brief Closes connections that have not been used for `idle_timeout` seconds.
+    def close_idle(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        stale  = []
+        with self._lock:
+            for addr, idle in list(self._idle.items()):
+                stale  += [c for c, t in idle if t < cutoff]
+                idle[:] = [(c, t) for c, t in idle if t >= cutoff]
+                if not idle:
+                    del self._idle[addr]
+        for conn in stale:
+            conn.close()
+
+    ##
+    # @brief Closes every pooled connection.
+    def close(self):
+        with self._lock:
+            conns = [c for idle in self._idle.values() for c, _ in idle]
+            self._idle.clear()
+        for conn in conns:
+            conn.close()
+
+##
+# @brief Streams exactly `size` bytes from `conn` into the open file `f`.
+# @param cancelled Optional threading.Event; checked between chunks.
+def _receive_into(conn, f, size, cancelled=None):
+    view = memoryview(bytearray(min(CHUNK_SIZE, max(size, 1))))
+    received = 0
+    while received < size:
+        if cancelled is not None and cancelled.is_set():
+            raise TransferCancelled(f"cancelled after {received} of {size} bytes")
+        n = conn.recv_into(view, min(len(view), size - received))
+        if not n:
+            raise ConnectionError(f"connection closed after {received} of {size} bytes")
+        f.write(view[:n])
+        received += n
+
+##
+# @brief Fetches an offer over a pooled connection and writes it to the open file `f`.
+#
+# A pooled connection may have been closed by the server in the meantime; in that case
+# the request is repeated once on a fresh connection.
+def _fetch(pool, addr, xfer_id, size, f, cancelled=None):
+    for attempt in range(2):
+        conn, reused = pool.acquire(addr)
+        try:
+            conn.sendall(REQUEST.pack(OP_GET, xfer_id, 0, size))
+            status, length = RESPONSE.unpack(recv_exact(conn, RESPONSE.size))
+        except OSError:
+            conn.close()
+            if reused and attempt == 0:
+                continue
+            raise
+        try:
+            if status != ST_OK:
+                raise FileNotFoundError(f"transfer {xfer_id} is not offered by {addr[0]}")
+            if length != size:
+                raise ConnectionError(f"peer offers {length} bytes, expected {size}")
+            _receive_into(conn, f, size, cancelled)
+        except BaseException:
+            conn.close()
+            raise
+        pool.release(addr, conn)
+        return
+
+##
+# @brief Raised when a server does not know OP_CHUNK (or the offer).
+class _ChunksUnsupported(Exception):
+    pass
+
+##
+# @brief Sends one request that expects a RESPONSE over a pooled connection.
+#
+# A pooled connection may have been closed by the server in the meantime; in that case
+# the request is repeated once on a fresh connection.
+# @return Tuple (conn, status, length); the caller releases or closes `conn`.
+def _request(pool, addr, op, xfer_id, offset, length):
+    for attempt in range(2):
+        conn, reused = pool.acquire(addr)
+        try:
+            conn.sendall(REQUEST.pack(op, xfer_id, offset, length))
+            status, n = RESPONSE.unpack(recv_exact(conn, RESPONSE.size))
+            return conn, status, n
+        except OSError:
+            conn.close()
+            if not reused or attempt:
+                raise
+
+##
+# @brief Fetches and verifies one chunk.
+# @param codec Codec negotiated for the transfer; CODEC_NONE requests the chunk with OP_CHUNK.
+# @param stats CompressionStats the decompression of the chunk is counted in, or None.
+# @return The chunk data.
+# @throws _ChunksUnsupported if the server answers ST_NOT_FOUND.
+# @throws ValueError if the data does not match its digest.
+def _fetch_chunk(pool, addr, xfer_id, offset, length, codec=CODEC_NONE, stats=None):
+    op = OP_CHUNK if codec == CODEC_NONE else OP_ZCHUNK
+    conn, status, n = _request(pool, addr, op, xfer_id, offset, length)
+    if status != ST_OK:
+        pool.release(addr, conn)
+        raise _ChunksUnsupported()
+    try:
+        if n > length or (n != length and op == OP_CHUNK):
+            raise ConnectionError(f"peer offers {n} bytes at {offset}, expected {length}")
+        if op == OP_ZCHUNK:
+            digest, codec = ZCHUNK.unpack(recv_exact(conn, ZCHUNK.size))
+        else:
+            digest = recv_exact(conn, DIGEST_SIZE)
+        data = recv_exact(conn, n)
+    except BaseException:
+        conn.close()
+        raise
+    pool.release(addr, conn)  # All bytes were read, the connection is still in sync
+    if op == OP_ZCHUNK:
+        started = time.thread_time()
+        if codec != CODEC_NONE:
+            data = decompress(codec, data, length)
+        elif n != length:
+            raise ValueError(f"chunk at {offset} is {n} bytes, expected {length}")
+        if stats is not None:
+            stats.add(length, n, started)
+    if chunk_digest(data) != digest:
+        raise ValueError(f"chunk at {offset} failed its integrity check")
+    return data
+
+##
+# @brief Downloads an offer chunk by chunk over parallel connections into the open file `f`.
+#
+# Chunks are handed out to up to PARALLEL_STREAMS threads; a chunk whose transfer fails or
+# whose digest does not match stays missing in the bitmap and is fetched again in the next
+# of up to DOWNLOAD_ROUNDS rounds.
+#
+# @param done Chunk bitmap (see _chunk_count()): 1 for every chunk `f` already holds. It is
+#             updated in place, so after a failure it tells what a later attempt can skip.
+# @return False if the server does not support chunked downloads, True once all chunks
+#         have been written.
+# @throws ConnectionError if chunks are still missing after the last round.
+# @throws TransferCancelled if `cancelled` was set.
+def _fetch_chunks(pool, addr, xfer_id, size, f, done, cancelled=None, codec=CODEC_NONE,
+                  stats=None):
+    count  = len(done)
+    lock   = threading.Lock()
+    errors = []
+
+    def stream(todo):
+        while not errors or not isinstance(errors[-1], _ChunksUnsupported):
+            if cancelled is not None and cancelled.is_set():
+                return
+            with lock:
+                if not todo:
+                    return
+                index = todo.popleft()
+            offset = index * TRANSFER_CHUNK
+            try:
+                data = _fetch_chunk(pool, addr, xfer_id, offset,
+                                    min(TRANSFER_CHUNK, size - offset), codec, stats)
+                with lock:
+                    f.seek(offset)
+                    f.write(data)
+                    done[index] = 1
+            except Exception as e:
+                errors.append(e)  # The chunk stays missing for the next round
+
+    for attempt in range(DOWNLOAD_ROUNDS):
+        todo = collections.deque(i for i in range(count) if not done[i])
+        if not todo:
+            break
+        if attempt:
+            reason = errors[-1] if errors else "no data"
+            print(f"[TRANSFER] {len(todo)} of {count} chunk(s) missing ({reason}), retrying.")
+            if cancelled is not None and cancelled.wait(RETRY_DELAY * attempt):
+                break
+        errors.clear()
+        threads = [threading.Thread(target=stream, args=(todo,), daemon=True)
+                   for _ in range(min(PARALLEL_STREAMS, len(todo)))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors and isinstance(errors[-1], _ChunksUnsupported) and not any(done):
+            return False
+        if cancelled is not None and cancelled.is_set():
+            raise TransferCancelled(f"cancelled with {count - sum(done)} of {count} chunks missing")
+
+    missing = count - sum(done)
+    if missing:
+        raise ConnectionError(f"{missing} of {count} chunks missing after "
+                              f"{DOWNLOAD_ROUNDS} rounds: {errors[-1] if errors else 'no data'}")
+    try:
+        conn, _, _ = _request(pool, addr, OP_DONE, xfer_id, 0, 0)
+        pool.release(addr, conn)
+    except OSError:
+        pass  # The offer expires on its own
+    return True
+
+##
+# @brief Asks the sender for the content hash of an offer and negotiates compression.
+# @param mask Bitmask of the codecs this client understands.
+# @return Tuple (hash or None if the sender does not announce hashes, codec).
+def _fetch_hash(pool, addr, xfer_id, mask):
+    conn, status, n = _request(pool, addr, OP_HASH, xfer_id, mask, 0)
+    try:
+        if status == ST_OK and n > HASH_SIZE + 1:
+            raise ConnectionError(f"peer announces a {n} byte hash")
+        reply = recv_exact(conn, n) if status == ST_OK else b""
+    except BaseException:
+        conn.close()
+        raise
+    pool.release(addr, conn)
+    if n == HASH_SIZE + 1:
+        return bytes(reply[:HASH_SIZE]), reply[-1] if mask & (1 << reply[-1]) else CODEC_NONE
+    return (bytes(reply) if n == HASH_SIZE else None), CODEC_NONE
+
+##
+# @brief Downloads an image offer from a peer's TransferServer into a BlobStore.
+#
+# The sender's announced content hash is looked up in the store first; an image that is
+# already there is not transferred again. Otherwise the file is written to a hidden `.part`
+# file in the store's directory and moved into the store once it is complete and matches
+# the hash. If the transfer fails or is cancelled, the part file of an announced image is
+# kept with its chunk bitmap and the next download of that image from `src` resumes it;
+# other incomplete transfers are discarded.
+#
+# @param pool      ConnectionPool used to reach the sender.
+# @param src       Handle of the sending peer (recorded in the store's index).
+# @param ip        IP address of the sender.
+# @param tcp_port  TCP port of the sender's TransferServer.
+# @param size      Announced image size in bytes.
+# @param xfer_id   Transfer id from the IMG notice.
+# @param store     BlobStore the image is kept in.
+# @param cancelled Optional threading.Event that aborts the download when set.
+# @param stats     CompressionStats to count decompressed chunks in, or None to refuse
+#                  compression.
+# @return Path of the stored image.
+# @throws OSError if the connection fails or ends before `size` bytes were received.
+# @throws ValueError if the image does not match the announced hash.
+# @throws TransferCancelled if `cancelled` was set.
+def download_image(pool, src, ip, tcp_port, size, xfer_id, store, cancelled=None, stats=None):
+    addr          = (ip, tcp_port)
+    mask          = codec_mask(available_codecs()) if stats is not None else 0
+    digest, codec = _fetch_hash(pool, addr, xfer_id, mask)
+    if digest is not None:
+        fn = store.get(digest, src)
+        if fn is not None:
+            try:
+                conn, _, _ = _request(pool, addr, OP_DONE, xfer_id, 0, 0)
+                pool.release(addr, conn)
+            except OSError:
+                pass  # The offer expires on its own
+            return fn
+
+    # An announced image goes to the part file an earlier attempt at it may have left behind,
+    # anything else (or a second download of the same image at once) to a unique name
+    part = store.claim_part(src, digest) if digest is not None else None
+    tmp  = part or store.temp_path(src)
+    done = _load_part_map(tmp, size) if part else None
+    if done is None or not any(done):
+        done = bytearray(_chunk_count(size))
+        _remove(tmp, tmp + PART_MAP_SUFFIX)  # Leftovers are stale; "xb" never reuses a file
+    else:
+        print(f"[TRANSFER] Resuming image from {src}, {sum(done)} of {len(done)} chunk(s) kept.")
+    try:
+        with open(tmp, "r+b" if any(done) else "xb") as f:
+            f.truncate(size)  # Chunks are written at their offsets in any order
+            if not _fetch_chunks(pool, addr, xfer_id, size, f, done, cancelled, codec, stats):
+                _fetch(pool, addr, xfer_id, size, f, cancelled)  # Older sender
+        _remove(tmp + PART_MAP_SUFFIX)
+        return store.put(tmp, src, digest)
+    except BaseException:
+        # Keep what arrived for the next offer; put() already removed a file that failed
+        # its hash check
+        if part is None or not any(done) or not _save_part_map(tmp, done):
+            _remove(tmp, tmp + PART_MAP_SUFFIX)
+        raise
+    finally:
+        if part is not None:
+            store.release_part(part)
+
+##
+# @brief Returns the number of chunks _fetch_chunks() splits an offer of `size` bytes into.
+def _chunk_count(size):
+    return max(1, -(-size // TRANSFER_CHUNK))
+
+##
+# @brief Returns the chunk bitmap a failed download left next to its part file `path`.
+# @return The bitmap, or None if there is none or it does not match the part file.
+def _load_part_map(path, size):
+    try:
+        if os.path.getsize(path) != size:
+            return None
+        with open(path + PART_MAP_SUFFIX, "rb") as m:
+            done = bytearray(m.read())
+    except OSError:
+        return None
+    return done if len(done) == _chunk_count(size) and set(done) <= {0, 1} else None
+
+##
+# @brief Stores the chunk bitmap of the part file `path` for the next attempt.
+# @return False if the part file is gone or the bitmap could not be written.
+def _save_part_map(path, done):
+    if not os.path.exists(path):
+        return False
+    try:
+        with open(path + PART_MAP_SUFFIX, "wb") as m:
+            m.write(done)
+    except OSError:
+        return False
+    return True
+
+def _remove(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+##
+# @brief Serves one file the way clients without `xfer1` expect it: a listener opened for
+#        this transfer that sends the whole file, unframed, to its first connection.
+#
+# Connections from other addresses than `peer_ip` are turned away. The listener gives up
+# after OFFER_TIMEOUT seconds.
+# @return TCP port of the listener, for the IMG notice.
+def serve_once(path, size, peer_ip, timeout=OFFER_TIMEOUT):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("", 0))
+    server.listen(1)
+
+    def serve():
+        deadline = time.monotonic() + timeout
+        with server:
+            while True:
+                server.settimeout(max(0.0, deadline - time.monotonic()))
+                try:
+                    conn, addr = server.accept()
+                except OSError:
+                    return  # Never fetched
+                if addr[0] == peer_ip:
+                    break
+                conn.close()
+        with conn:
+            conn.settimeout(DOWNLOAD_TIMEOUT)
+            try:
+                with open(path, "rb") as f:
+                    send_file(conn, f, size)
+            except OSError as e:
+                print(f"[TRANSFER] Serving {path} failed: {e}")
+
+    threading.Thread(target=serve, name="transfer-once", daemon=True).start()
+    return server.getsockname()[1]
+
+##
+# @brief Downloads an image from a client without `xfer1` (see serve_once()) into a BlobStore.
+# @return Path of the stored image.
+# @throws OSError if the connection fails or ends before `size` bytes were received.
+# @throws TransferCancelled if `cancelled` was set.
+def download_once(src, ip, tcp_port, size, store, cancelled=None):
+    tmp = store.temp_path(src)
+    try:
+        with socket.create_connection((ip, tcp_port), timeout=DOWNLOAD_TIMEOUT) as conn:
+            with open(tmp, "xb") as f:
+                _receive_into(conn, f, size, cancelled)
+        return store.put(tmp, src)
+    except BaseException:
+        _remove(tmp)
+        raise
+
+##
+# @class _Job
+# @brief One transfer waiting for, or running in, the TransferScheduler.
+class _Job:
+    __slots__ = ("id", "peer", "size", "priority", "run", "on_done", "queued_at", "cancelled")
+
+    def __init__(self, job_id, peer, size, priority, run, on_done):
+        self.id        = job_id
+        self.peer      = peer
+        self.size      = size
+        self.priority  = priority
+        self.run       = run
+        self.on_done   = on_done
+        self.queued_at = time.monotonic()
+        self.cancelled = threading.Event()
+
+##
+# @class TransferScheduler
+# @brief Bounded worker pool for transfers with priorities, per-peer limits and cancellation.
+#
+# A fixed set of worker threads takes the next transfer whose peer is below its limit:
+# small transfers first, otherwise in submission order. A transfer is a callable taking
+# the job's cancellation Event; its outcome is handed to `on_done(job_id, result, error)`
+# on the worker thread.
+class TransferScheduler:
+    ##
+    # @param max_active    Transfers running at once (= worker threads).
+    # @param max_per_peer  Transfers running at once for one peer.
+    # @param max_queued    Waiting transfers before submit() refuses new ones.
+    # @param queue_timeout Seconds a transfer may wait before it fails with TimeoutError.
+    def __init__(self, max_active=DEFAULT_MAX_ACTIVE, max_per_peer=DEFAULT_MAX_PER_PEER,
+                 max_queued=DEFAULT_MAX_QUEUED, queue_timeout=QUEUE_TIMEOUT):
+        self.max_per_peer  = max_per_peer
+        self.max_queued    = max_queued
+        self.queue_timeout = queue_timeout
+        self._cond         = threading.Condition()
+        self._queue        = []   # Waiting _Jobs
+        self._active       = {}   # job id -> running _Job
+        self._ids          = itertools.count(1)
+        self._closed       = False
+        self.completed     = 0
+        self.failed        = 0
+        self.cancelled     = 0
+        for n in range(max_active):
+            threading.Thread(target=self._worker, name=f"transfer-{n}", daemon=True).start()
+
+    ##
+    # @brief Queues a transfer.
+    # @param peer     Handle the transfer belongs to (for the per-peer limit and cancel_peer).
+    # @param size     Bytes to transfer, used to pick the priority unless one is given.
+    # @param run      Callable (cancelled Event) -> result, run on a worker thread.
+    # @param on_done  Callable (job_id, result, error) called on the worker thread.
+    # @param priority PRIORITY_SMALL or PRIORITY_BULK; None picks it from `size`.
+    # @return Job id, or None if the queue is full.
+    def submit(self, peer, size, run, on_done, priority=None):
+        if priority is None:
+            priority = PRIORITY_SMALL if size <= SMALL_TRANSFER else PRIORITY_BULK
+        with self._cond:
+            if self._closed or len(self._queue) >= self.max_queued:
+                return None
+            job = _Job(next(self._ids), peer, size, priority, run, on_done)
+            self._queue.append(job)
+            self._cond.notify()
+        return job.id
+
+    ##
+    # @brief Cancels one transfer, queued or running.
+    # @return True if it was found.
+    def cancel(self, job_id):
+        return self._cancel(lambda job: job.id == job_id) > 0
+
+    ##
+    # @brief Cancels every transfer of `peer`, e.g. because it left.
+    # @return Number of cancelled transfers.
+    def cancel_peer(self, peer):
+        return self._cancel(lambda job: job.peer == peer)
+
+    ##
+    # @brief Returns queue depth and active transfers as a human-readable line.
+    def stats(self):
+        with self._cond:
+            active = ", ".join(f"#{j.id} {j.peer} {j.size} B" for j in self._active.values())
+            return (f"queued {len(self._queue)}, active {len(self._active)}"
+                    + (f" ({active})" if active else "")
+                    + f"; completed {self.completed}, failed {self.failed}, cancelled {self.cancelled}")
+
+    ##
+    # @brief Cancels everything and stops the workers once their current transfer ends.
+    def shutdown(self):
+        self._cancel(lambda job: True)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _cancel(self, match):
+        with self._cond:
+            dropped = [j for j in self._queue if match(j)]
+            self._queue = [j for j in self._queue if not match(j)]
+            running = [j for j in self._active.values() if match(j)]
+        for job in running:
+            job.cancelled.set()  # The worker reports it once the transfer notices
+        for job in dropped:
+            self._finish(job, None, TransferCancelled("cancelled while queued"))
+        return len(dropped) + len(running)
+
+    ##
+    # @brief Picks the next waiting job, or None if none may start right now.
+    #
+    # Jobs that waited longer than `queue_timeout` are returned as well so the worker can
+    # fail them. Must be called with the lock held.
+    def _next_job(self):
+        busy = {}
+        for job in self._active.values():
+            busy[job.peer] = busy.get(job.peer, 0) + 1
+        cutoff = time.monotonic() - self.queue_timeout
+        best   = None
+        for job in self._queue:
+            if job.queued_at < cutoff:
+                return job
+            if busy.get(job.peer, 0) < self.max_per_peer and (
+                    best is None or (job.priority, job.id) < (best.priority, best.id)):
+                best = job
+        return best
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None and not self._closed:
+                    # Sleep until something is queued or finishes, or a waiting job times out
+                    oldest = min((j.queued_at for j in self._queue), default=None)
+                    self._cond.wait(None if oldest is None else
+                                    max(0.0, oldest + self.queue_timeout - time.monotonic()))
+                    job = self._next_job()
+                if job is None:
+                    return
+                self._queue.remove(job)
+                expired = job.queued_at < time.monotonic() - self.queue_timeout
+                if not expired:
+                    self._active[job.id] = job
+            if expired:
+                self._finish(job, None, TimeoutError(f"waited more than {self.queue_timeout}s"))
+                continue
+            result, error = None, None
+            try:
+                result = job.run(job.cancelled)
+            except Exception as e:
+                error = e
+            with self._cond:
+                del self._active[job.id]
+                self._cond.notify_all()  # A per-peer slot may have opened up
+            self._finish(job, result, error)
+
+    def _finish(self, job, result, error):
+        with self._cond:
+            if error is None:
+                self.completed += 1
+            elif isinstance(error, TransferCancelled):
+                self.cancelled += 1
+            else:
+                self.failed += 1
+        job.on_done(job.id, result, error)
@@ -0,0 +1,117 @@
+##
+# @file test_blobstore.py
+# @brief Tests of the image store's quota, index replay and part files.
+#
+# @author SLCP Team
+# @date June 2025
+#
+
+import os
+import tempfile
+import unittest
+
+from processes.blobstore import BlobStore, content_hash
+
+PNG = b"\x89PNG\r\n\x1a\n"
+
+class BlobStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir   = tempfile.TemporaryDirectory()
+        self.root  = os.path.join(self.dir.name, "images")
+        self.store = BlobStore(self.root, quota=250)
+
+    def tearDown(self):
+        self.store.close()
+        self.dir.cleanup()
+
+    ##
+    # @brief Stores an image of `size` bytes filled with `fill` and returns its hash.
+    def put(self, fill, size=100, now=0.0):
+        path = self.store.temp_path("Bob")
+        with open(path, "wb") as f:
+            f.write(PNG + fill * (size - len(PNG)))
+        digest = content_hash(path)
+        blob   = self.store.put(path, "Bob", digest, now=now)
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(blob.endswith(".png"))
+        return digest
+
+    def test_put_and_get(self):
+        digest = self.put(b"a")
+        self.assertIsNone(self.store.get(b"\x00" * len(digest), "Bob"))
+        blob = self.store.get(digest, "Carol")
+        with open(blob, "rb") as f:
+            self.assertTrue(f.read().startswith(PNG))
+        self.assertEqual(self.store.hits, 1)
+        self.assertEqual(self.put(b"a"), digest)  # The same image is kept once
+        self.assertEqual(len(self.store), 1)
+
+    def test_wrong_hash(self):
+        path = self.store.temp_path("Bob")
+        with open(path, "wb") as f:
+            f.write(PNG)
+        with self.assertRaises(ValueError):
+            self.store.put(path, "Bob", b"\x00" * 32)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(len(self.store), 0)
+
+    def test_lru_quota(self):
+        a = self.put(b"a", now=1.0)
+        b = self.put(b"b", now=2.0)
+        self.assertIsNotNone(self.store.get(a, "Bob", now=3.0))  # a is now the most recent
+        c = self.put(b"c", now=4.0)
+        self.assertEqual(self.store.evicted, 1)
+        self.assertIsNone(self.store.get(b, "Bob"))
+        self.assertIsNotNone(self.store.get(a, "Bob"))
+        self.assertIsNotNone(self.store.get(c, "Bob"))
+        big = self.put(b"d", size=300)  # Larger than the quota: kept, everything else goes
+        self.assertEqual(self.store.evicted, 3)
+        self.assertEqual(list(self.store._blobs), [big.hex()])
+
+    def test_replay(self):
+        a = self.put(b"a", now=1.0)
+        b = self.put(b"b", now=2.0)
+        self.store.get(a, "Bob", now=3.0)
+        self.store.close()
+        self.store = BlobStore(self.root, quota=250)
+        self.assertEqual(list(self.store._blobs), [b.hex(), a.hex()])
+        os.remove(self.store.get(b, "Bob"))  # Deleted behind the store's back
+        self.store.close()
+        self.store = BlobStore(self.root, quota=150)
+        self.assertEqual(list(self.store._blobs), [a.hex()])
+        self.assertIn("blobs 1, 100 of 150 bytes", self.store.stats())
+
+    def test_claim_part(self):
+        digest = b"\x11" * 32
+        path   = self.store.claim_part("Bob", digest)
+        self.assertIsNone(self.store.claim_part("Bob", digest))  # Busy
+        self.assertNotEqual(self.store.claim_part("Carol", digest), path)
+        with open(path, "wb") as f:
+            f.write(b"half")
+        self.store.release_part(path)
+        # A later attempt at the same image finds what the first one wrote
+        self.assertEqual(self.store.claim_part("Bob", digest), path)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"half")
+
+    def test_part_names(self):
+        for src in ("../../etc", "a/b", "..", "x" * 65, ""):
+            for path in (self.store.temp_path(src), self.store.claim_part(src, b"\x22" * 32)):
+                self.assertEqual(os.path.dirname(path), self.root)
+                self.assertTrue(os.path.basename(path).startswith("."))
+                self.assertNotIn("/", os.path.basename(path)[1:])
+
+    def test_expire_parts(self):
+        busy = self.store.claim_part("Bob", b"\x33" * 32)
+        idle = self.store.claim_part("Bob", b"\x44" * 32)
+        self.store.release_part(idle)
+        for path in (busy, idle, idle + ".map"):
+            with open(path, "wb") as f:
+                f.write(b"x")
+        self.assertEqual(self.store.expire_parts(60.0), 0)
+        self.assertEqual(self.store.expire_parts(60.0, now=os.path.getmtime(idle) + 61), 2)
+        self.assertTrue(os.path.exists(busy))
+        self.assertFalse(os.path.exists(idle) or os.path.exists(idle + ".map"))
+
+if __name__ == "__main__":
+    unittest.main()
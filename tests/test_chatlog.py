@@ -0,0 +1,96 @@
+##
+# @file test_chatlog.py
+# @brief Tests of the chat log ring and history paging.
+#
+# @author SLCP Team
+# @date June 2025
+#
+
+import os
+import tempfile
+import unittest
+
+from processes.chatlog import MAX_PAGED_IN, ChatLog
+
+def line(n):
+    return ("[12:00:00]", "#204EB4", f"line {n}")
+
+class ChatLogTest(unittest.TestCase):
+    def setUp(self):
+        self.dir  = tempfile.TemporaryDirectory()
+        self.log  = ChatLog(os.path.join(self.dir.name, "history.jsonl"), capacity=10)
+        self.next = 0
+
+    def tearDown(self):
+        self.log.close()
+        self.dir.cleanup()
+
+    ##
+    # @brief Adds `n` lines the way the GUI model does and returns the rows dropped.
+    def add(self, n):
+        dropped = 0
+        while n:
+            batch = min(n, self.log.capacity)
+            expected = self.log.rows_to_drop(batch)
+            self.assertEqual(self.log.make_room(batch), expected)
+            dropped += expected
+            self.log.extend(line(self.next + i) for i in range(batch))
+            self.next += batch
+            n -= batch
+        return dropped
+
+    def texts(self):
+        return [self.log[row][2] for row in range(len(self.log))]
+
+    def assertContiguous(self):
+        numbers = [int(text.split()[1]) for text in self.texts()]
+        self.assertEqual(numbers, list(range(numbers[0], self.next)))
+
+    def test_ring(self):
+        self.assertEqual(self.add(8), 0)
+        self.assertFalse(self.log.has_older())
+        self.assertEqual(self.log.rows_to_drop(5), 3)
+        self.assertEqual(self.add(5), 3)
+        self.assertEqual(len(self.log), 10)
+        self.assertEqual(self.texts()[0], "line 3")
+        self.assertTrue(self.log.has_older())
+
+    def test_paging(self):
+        self.add(35)
+        entries, start = page = self.log.older_page(10)
+        self.assertEqual([e[2] for e in entries], [f"line {n}" for n in range(15, 25)])
+        self.log.prepend(page)
+        self.log.prepend(self.log.older_page(10))
+        self.log.prepend(self.log.older_page(10))  # Only 5 lines left
+        self.assertEqual(self.log.paged_in(), 25)
+        self.assertFalse(self.log.has_older())
+        self.assertEqual(self.log.older_page(10), ([], 0))
+        self.assertEqual(self.log[0], line(0))
+        self.assertContiguous()
+        self.assertEqual(self.log.collapse(), 25)
+        self.assertEqual(self.texts()[0], "line 25")
+        self.assertEqual(self.log.older_page(3)[0], [line(22), line(23), line(24)])
+
+    def test_lines_leaving_the_ring_while_paged_in(self):
+        self.add(30)
+        self.log.prepend(self.log.older_page(5))
+        self.assertEqual(self.add(4), 0)  # Spilled lines join the paged-in rows
+        self.assertEqual(self.log.paged_in(), 9)
+        self.assertContiguous()
+        # The rows shown right before the paged-in ones are still in the file
+        self.assertEqual(self.log.older_page(2)[0], [line(13), line(14)])
+
+    def test_paged_in_rows_are_capped(self):
+        self.add(MAX_PAGED_IN + 100)
+        while self.log.has_older():
+            self.log.prepend(self.log.older_page())
+        self.assertEqual(self.log.paged_in(), MAX_PAGED_IN + 90)
+        self.assertEqual(self.add(20), 110)
+        self.assertEqual(self.log.paged_in(), MAX_PAGED_IN)
+        self.assertContiguous()
+        first = int(self.texts()[0].split()[1])
+        self.assertTrue(self.log.has_older())
+        self.assertEqual(self.log.older_page(2)[0], [line(first - 2), line(first - 1)])
+
+if __name__ == "__main__":
+    unittest.main()
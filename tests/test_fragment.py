@@ -0,0 +1,77 @@
+##
+# @file test_fragment.py
+# @brief Tests of fragment reassembly limits.
+#
+# @author SLCP Team
+# @date June 2025
+#
+
+import unittest
+
+from processes.fragment import MAX_FRAGMENTS, Reassembler, split
+
+class SplitTest(unittest.TestCase):
+    def test_split(self):
+        self.assertEqual(split(b"abcdefg", 3), [b"abc", b"def", b"g"])
+        self.assertEqual(split(b"", 3), [b""])
+
+class ReassemblerTest(unittest.TestCase):
+    def setUp(self):
+        self.r = Reassembler(cap=100, timeout=30.0)
+
+    def test_out_of_order(self):
+        r = self.r
+        self.assertIsNone(r.add("Alice", 1, 2, 3, b"ef", now=0.0))
+        self.assertIsNone(r.add("Alice", 1, 0, 3, b"ab", now=0.0))
+        self.assertIsNone(r.add("Alice", 1, 0, 3, b"xx", now=0.0))  # Duplicate
+        self.assertIsNone(r.add("Alice", 1, 1, 4, b"cd", now=0.0))  # Inconsistent count
+        self.assertEqual(r.add("Alice", 1, 1, 3, b"cd", now=0.0), b"abcdef")
+        self.assertEqual(r._usage["Alice"], 0)
+
+    def test_malformed(self):
+        r = self.r
+        self.assertIsNone(r.add("Alice", 1, 3, 3, b"x"))
+        self.assertIsNone(r.add("Alice", 1, -1, 3, b"x"))
+        self.assertIsNone(r.add("Alice", 1, 0, MAX_FRAGMENTS + 1, b""))
+        self.assertEqual(r._partial, {})
+
+    def test_cap(self):
+        r = self.r
+        self.assertIsNone(r.add("Alice", 1, 0, 101, b"x"))          # Could never fit
+        self.assertEqual(r.rejected, 1)
+        for msg_id in range(2):
+            self.assertIsNone(r.add("Alice", msg_id + 2, 0, 2, b"x" * 30, now=0.0))
+        self.assertIsNone(r.add("Alice", 4, 0, 2, b"x" * 50, now=0.0))  # Over the cap now
+        self.assertEqual(r.rejected, 2)
+        self.assertIsNone(r.add("Bob", 1, 0, 2, b"x" * 50, now=0.0))    # The cap is per peer
+        self.assertEqual(r.rejected, 2)
+        # Completing a message frees its bytes
+        self.assertEqual(r.add("Alice", 2, 1, 2, b"y" * 30, now=0.0), b"x" * 30 + b"y" * 30)
+        self.assertIsNone(r.add("Alice", 4, 0, 2, b"x" * 50, now=0.0))
+        self.assertEqual(r.rejected, 2)
+        self.assertEqual(r._usage["Alice"], 80)
+
+    def test_timeout(self):
+        r = self.r
+        r.add("Alice", 1, 0, 2, b"old", now=0.0)
+        r.add("Alice", 2, 0, 2, b"new", now=20.0)
+        r.expire(now=29.0)
+        self.assertEqual(r.expired, 0)
+        r.expire(now=31.0)
+        self.assertEqual(r.expired, 1)
+        self.assertEqual(r._usage["Alice"], 3)
+        self.assertIsNone(r.add("Alice", 1, 1, 2, b"!", now=31.0))  # Restarts message 1
+        self.assertEqual(r.add("Alice", 2, 1, 2, b"!", now=31.0), b"new!")
+        r.expire(now=100.0)
+        self.assertEqual(r.expired, 2)
+        self.assertEqual((r._partial, r._usage), ({}, {}))
+
+    def test_drop_peer(self):
+        r = self.r
+        r.add("Alice", 1, 0, 2, b"x" * 50)
+        r.drop_peer("Alice")
+        self.assertIsNone(r.add("Alice", 1, 1, 2, b"y" * 50))  # The first half is gone
+        self.assertEqual(r._usage["Alice"], 50)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+##
+# @file test_outbox.py
+# @brief Tests of the persistent outbox across restarts.
+#
+# @author SLCP Team
+# @date June 2025
+#
+
+import os
+import tempfile
+import unittest
+
+from processes.outbox import COMPACT_MIN_LINES, Outbox
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.dir  = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "outbox.jsonl")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def reopen(self, box, **kwargs):
+        box.close()
+        return Outbox(self.path, **kwargs)
+
+    def lines(self):
+        with open(self.path, encoding="utf-8") as f:
+            return f.read().splitlines()
+
+    def test_replay(self):
+        box = Outbox(self.path)
+        box.add("Bob", "MSG", "one", now=0.0)
+        box.add("Bob", "IMG", "/tmp/a.png", now=0.0)
+        box.add("Carol", "MSG", "two", now=0.0)
+        self.assertEqual(box.take("Carol"), [("MSG", "two")])
+        box = self.reopen(box)
+        self.assertEqual(len(box), 2)
+        self.assertEqual(box.take("Carol"), [])
+        box.add("Bob", "MSG", "three", now=0.0)  # Ids continue after the replayed ones
+        box = self.reopen(box)
+        self.assertEqual(box.take("Bob"), [("MSG", "one"), ("IMG", "/tmp/a.png"), ("MSG", "three")])
+        box = self.reopen(box)
+        self.assertEqual(len(box), 0)
+        box.close()
+
+    def test_torn_line(self):
+        box = Outbox(self.path)
+        box.add("Bob", "MSG", "kept", now=0.0)
+        box.close()
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write('{"id": 9, "dest": "Bob", "ki')
+        box = Outbox(self.path)
+        self.assertEqual(box.take("Bob"), [("MSG", "kept")])
+        box.close()
+
+    def test_compaction_on_open(self):
+        box = Outbox(self.path)
+        for n in range(4):
+            box.add("Bob", "MSG", f"m{n}", now=0.0)
+        box.take("Bob")
+        box.add("Carol", "MSG", "live", now=0.0)
+        box = self.reopen(box)  # 6 lines, 1 live: rewritten
+        self.assertEqual(len(self.lines()), 1)
+        box.add("Carol", "MSG", "more", now=0.0)
+        box = self.reopen(box)
+        self.assertEqual(len(self.lines()), 2)
+        self.assertEqual(box.take("Carol"), [("MSG", "live"), ("MSG", "more")])
+        box.close()
+
+    def test_compaction_while_running(self):
+        box = Outbox(self.path)
+        for n in range(COMPACT_MIN_LINES // 2):
+            box.add("Bob", "MSG", f"m{n}", now=0.0)
+            box.take("Bob")
+        self.assertLess(len(self.lines()), COMPACT_MIN_LINES)
+        box.add("Carol", "MSG", "live", now=0.0)
+        box = self.reopen(box)
+        self.assertEqual(box.take("Carol"), [("MSG", "live")])
+        box.close()
+
+    def test_limit_and_ttl(self):
+        box = Outbox(self.path, limit=2, ttl=10.0)
+        self.assertTrue(box.add("Bob", "MSG", "old", now=0.0))
+        self.assertTrue(box.add("Bob", "MSG", "new", now=5.0))
+        self.assertFalse(box.add("Bob", "MSG", "full", now=5.0))
+        self.assertTrue(box.add("Carol", "MSG", "other", now=5.0))
+        self.assertEqual(box.expire(now=12.0), [("Bob", "MSG", "old")])
+        box = self.reopen(box, limit=2, ttl=10.0)
+        self.assertEqual(box.take("Bob"), [("MSG", "new")])
+        self.assertEqual(box.expire(now=20.0), [("Carol", "MSG", "other")])
+        self.assertEqual(len(box), 0)
+        box.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+##
+# @file test_peers.py
+# @brief Tests of peer expiry and the registry's change log.
+#
+# @author SLCP Team
+# @date June 2025
+#
+
+import time
+import unittest
+from unittest import mock
+
+from processes.peers import PeerDirectory, PeerRegistry
+
+class ExpiryTest(unittest.TestCase):
+    def test_ttl(self):
+        now = time.monotonic()
+        with mock.patch("time.monotonic", lambda: now):
+            reg = PeerRegistry(ttl=5)
+            reg.add("Alice", "10.0.0.1", 5000)
+            reg.add("Bob", "10.0.0.2", 5000)
+            self.assertEqual(reg.expire(), [])
+            now += 3
+            self.assertEqual(reg.expire(), [])
+            reg.touch("Bob")
+            now += 3
+            self.assertEqual(reg.expire(), ["Alice"])
+            self.assertNotIn("Alice", reg)
+            now += 1
+            self.assertEqual(reg.expire(), [])
+            now += 2
+            self.assertEqual(reg.expire(), ["Bob"])
+            self.assertEqual(len(reg), 0)
+
+    def test_refresh(self):
+        reg = PeerRegistry(ttl=5)
+        reg.add("Alice", "10.0.0.1", 5000)
+        self.assertFalse(reg.add("Alice", "10.0.0.1", 5000, refresh=False))
+        reg.remove("Alice")  # A removed peer is not expired later
+        self.assertEqual(reg.expire(now=time.monotonic() + 7), [])
+
+    def test_no_ttl(self):
+        reg = PeerRegistry()
+        reg.add("Alice", "10.0.0.1", 5000)
+        self.assertEqual(reg.expire(now=time.monotonic() + 3600), [])
+        self.assertIn("Alice", reg)
+
+class ChangesTest(unittest.TestCase):
+    def test_changes_since(self):
+        reg = PeerRegistry(history=3)
+        reg.add("Alice", "10.0.0.1", 5000)
+        seen = reg.version
+        self.assertEqual(reg.changes_since(seen), {})
+        self.assertFalse(reg.add("Alice", "10.0.0.1", 5000))  # Unchanged: no new version
+        self.assertEqual(reg.version, seen)
+        reg.add("Bob", "10.0.0.2", 5000)
+        reg.add("Alice", "10.0.0.1", 6000)
+        self.assertEqual(reg.changes_since(seen),
+                         {"Bob": ("10.0.0.2", 5000), "Alice": ("10.0.0.1", 6000)})
+        reg.remove("Bob")
+        self.assertEqual(reg.changes_since(seen), {"Bob": None, "Alice": ("10.0.0.1", 6000)})
+        reg.add("Carol", "10.0.0.3", 5000)  # The log no longer reaches back to `seen`
+        self.assertIsNone(reg.changes_since(seen))
+        self.assertEqual(reg.changes_since(reg.version - 1), {"Carol": ("10.0.0.3", 5000)})
+        self.assertIsNone(reg.changes_since(reg.version + 1))  # From another registry
+
+    def test_without_history(self):
+        reg = PeerRegistry()
+        reg.add("Alice", "10.0.0.1", 5000)
+        self.assertEqual(reg.changes_since(reg.version), {})
+        self.assertIsNone(reg.changes_since(0))
+
+class DirectoryTest(unittest.TestCase):
+    def test_snapshot(self):
+        reg = PeerRegistry()
+        reg.add("Alice", "10.0.0.1", 5000)
+        reg.add("Bob", "10.0.0.2", 5001)
+        directory = PeerDirectory()
+        directory.publish(reg)
+        self.assertEqual(directory.snapshot(),
+                         {"Alice": ("10.0.0.1", 5000), "Bob": ("10.0.0.2", 5001)})
+        self.assertEqual(directory.version, 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+##
+# @file test_protocol.py
+# @brief Tests of the text command parser and binary frame decoding.
+#
+# @author SLCP Team
+# @date June 2025
+#
+
+import unittest
+
+from processes.protocol import (HEADER, OP_ACK, OP_MSG, decode, decode_all, encode, handle_id,
+                                parse_delta, parse_fields, parse_knowusers, parse_text)
+
+class ParseTextTest(unittest.TestCase):
+    def test_commands(self):
+        self.assertEqual(parse_text(b"MSG Alice Bob hello  world"),
+                         ("MSG", ("Alice", "Bob", "hello  world")))
+        self.assertEqual(parse_text(b"IMG Alice Bob 6000 1048576 42"),
+                         ("IMG", ("Alice", "Bob", 6000, 1048576, "42")))
+        self.assertEqual(parse_text(b"IMG Alice Bob 6000 1048576"),
+                         ("IMG", ("Alice", "Bob", 6000, 1048576, "")))
+        self.assertEqual(parse_text(b"JOIN Alice 5008 caps=bin1\n"),
+                         ("JOIN", ("Alice", 5008, "caps=bin1")))
+        self.assertEqual(parse_text(b"LEAVE Alice"), ("LEAVE", ("Alice",)))
+        self.assertEqual(parse_text(memoryview(b"WHO")), ("WHO", ("",)))
+
+    def test_malformed(self):
+        for data in (b"", b"   ", b"NOPE a b", b"LEAVE", b"LEAVE a b", b"JOIN Alice",
+                     b"JOIN  Alice 5008", b"MSG Alice Bob", b"IMG Alice Bob port 1 2",
+                     b"IMG Alice Bob 6000 -1", b"JOIN Alice \xd9\xa1\xd9\xa2", b"\xff\xfe"):
+            self.assertIsNone(parse_text(data), data)
+
+    def test_ports(self):
+        self.assertEqual(parse_text(b"JOIN A 1")[1][1], 1)
+        self.assertEqual(parse_text(b"JOIN A 65535")[1][1], 65535)
+        for data in (b"JOIN A 0", b"JOIN A 65536", b"JOIN A 70000", b"IMG A B 70000 1 2"):
+            self.assertIsNone(parse_text(data), data)
+
+    def test_fields(self):
+        self.assertEqual(parse_fields("1 2", "ii"), (1, 2))
+        self.assertEqual(parse_fields("1 2 Bob", "ii*"), (1, 2, "Bob"))
+        self.assertEqual(parse_fields("1 2", "ii*"), (1, 2, ""))
+        self.assertIsNone(parse_fields("1", "ii"))
+        self.assertIsNone(parse_fields("1 x", "ii"))
+        self.assertIsNone(parse_fields("", "s"))
+
+    def test_peer_lists(self):
+        self.assertEqual(parse_knowusers("a 10.0.0.1 5000, b 10.0.0.2 99999,c 10.0.0.3,d 10.0.0.4 5001"),
+                         [("a", "10.0.0.1", 5000), ("d", "10.0.0.4", 5001)])
+        self.assertEqual(parse_delta("+a 10.0.0.1 5000,+b 10.0.0.2 0,-c,-,?d"),
+                         [("a", ("10.0.0.1", 5000)), ("c", None)])
+        self.assertEqual(parse_delta(""), [])
+
+class DecodeTest(unittest.TestCase):
+    def test_round_trip(self):
+        frame = decode(encode(OP_MSG, 7, "Alice", "Bob", b"hi  there", flags=1))
+        self.assertEqual((frame.opcode, frame.flags, frame.seq), (OP_MSG, 1, 7))
+        self.assertEqual((frame.src_id, frame.dst_id), (handle_id("Alice"), handle_id("Bob")))
+        self.assertEqual(bytes(frame.payload), b"hi  there")
+
+    def test_malformed(self):
+        data = encode(OP_MSG, 1, "Alice", "Bob", b"hello")
+        self.assertIsNone(decode(data[:HEADER.size - 1]))
+        self.assertIsNone(decode(data[:-1]))                   # Truncated payload
+        self.assertIsNone(decode(data + b"x"))                 # Trailing garbage
+        self.assertIsNone(decode(b"\x00" + data[1:]))          # Wrong magic
+        self.assertIsNone(decode(data[:1] + b"\x09" + data[2:]))  # Unknown version
+
+    def test_decode_all(self):
+        a = encode(OP_MSG, 1, "Alice", "Bob", b"one")
+        b = encode(OP_ACK, 2, "Alice", "Bob", b"")
+        frames = decode_all(a + b)
+        self.assertEqual([(f.opcode, bytes(f.payload)) for f in frames], [(OP_MSG, b"one"), (OP_ACK, b"")])
+        # Parsing stops at a truncated frame, the frames before it are kept
+        self.assertEqual(len(decode_all(a + b + a[:-1])), 2)
+        self.assertEqual(len(decode_all(a + a[:HEADER.size + 1])), 1)
+        self.assertEqual(decode_all(b"\x00" * HEADER.size), [])
+        self.assertEqual(decode_all(b""), [])
+
+if __name__ == "__main__":
+    unittest.main()
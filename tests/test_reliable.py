@@ -0,0 +1,82 @@
+##
+# @file test_reliable.py
+# @brief Tests of reliable delivery when a peer is forgotten and comes back.
+#
+# A ReliableSender and a ReceiveWindow are wired back to back the way the network process
+# uses them: every transmitted message is accepted by the receiver, shown if it is new, and
+# answered with an ACK.
+#
+# @author SLCP Team
+# @date June 2025
+#
+
+import unittest
+
+from processes.eventloop import EventLoop
+from processes.reliable  import ReceiveWindow, ReliableSender
+
+##
+# @class Link
+# @brief One sender talking to one receiver over a lossless wire.
+class Link:
+    def __init__(self):
+        self.loop      = EventLoop()
+        self.rx        = ReceiveWindow()
+        self.shown     = []  # Payloads the receiver displayed
+        self.delivered = []  # Tags the sender reported as delivered
+        self.failed    = []
+        self.lossy     = False
+        self.tx        = ReliableSender(self.loop, self.transmit,
+                                        lambda dest, tag: self.delivered.append(tag),
+                                        lambda dest, tag: self.failed.append(tag))
+
+    def transmit(self, dest, seq, base, payload):
+        if self.lossy:
+            return
+        if self.rx.accept(seq, base):
+            self.shown.append(payload)
+        self.tx.on_ack(dest, self.rx.cumulative, self.rx.sacks())
+
+    def close(self):
+        self.loop.close()
+
+class DropTest(unittest.TestCase):
+    def setUp(self):
+        self.link = Link()
+
+    def tearDown(self):
+        self.link.close()
+
+    def test_messages_after_drop_are_shown(self):
+        link = self.link
+        for n in range(3):
+            link.tx.send_group("Bob", [f"m{n}"], n)
+        link.tx.drop("Bob")  # e.g. a forged LEAVE; Bob still knows the session
+        link.tx.send_group("Bob", ["again"], "again")
+        self.assertEqual(link.shown, ["m0", "m1", "m2", "again"])
+        self.assertEqual(link.delivered, [0, 1, 2, "again"])
+
+    def test_messages_given_up_by_drop_are_skipped(self):
+        link = self.link
+        link.tx.send_group("Bob", ["first"], "first")
+        link.lossy = True
+        link.tx.send_group("Bob", ["lost"], "lost")
+        link.tx.drop("Bob")
+        link.lossy = False
+        link.tx.send_group("Bob", ["after"], "after")
+        self.assertEqual(link.shown, ["first", "after"])
+        self.assertEqual(link.delivered, ["first", "after"])
+        self.assertEqual(link.failed, ["lost"])
+        self.assertEqual(link.rx.sacks(), [])
+
+    def test_receiver_forgetting_the_sender(self):
+        link = self.link
+        link.tx.send_group("Bob", ["m0"], 0)
+        link.tx.drop("Bob")
+        link.rx = ReceiveWindow()  # Bob forgot us as well
+        link.tx.send_group("Bob", ["m1"], 1)
+        self.assertEqual(link.shown, ["m0", "m1"])
+        self.assertEqual(link.delivered, [0, 1])
+
+if __name__ == "__main__":
+    unittest.main()